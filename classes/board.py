@@ -1,22 +1,29 @@
 from collections import Counter
 from collections import defaultdict
-from random import shuffle
-import re
+import numpy as np
+import random
 from tabulate import tabulate
+from classes.config import get_object_records
 from classes.game_objects import *
 
 
 class Board:
-    def __init__(self, width, height, object_positions, config):
+    def __init__(self, width, height, object_positions, config, rng=random, template=None):
         self.width = None
         self.height = None
         self.board = None
         self.objects = None
         self.config = config
+        self.object_records = get_object_records(config)
+        # Random stream used for monster movement
+        self.rng = rng
         # Keeps track of object counts for indexing purposes
         self.obj_counts = None
-        # Initialize board
-        self.reset_board(width, height, object_positions)
+        # Initialize board, from the level's compiled template if there is one
+        if template is not None:
+            self.restore(template)
+        else:
+            self.reset_board(width, height, object_positions)
 
     def reset_board(self, width, height, object_positions):
 
@@ -53,61 +60,98 @@ class Board:
         index = obj_code
         if self.obj_counts[obj_code] > 1:
             index += f"({self.obj_counts[obj_code]})"
+        record = self.object_records[obj_code]
         # Player objects
-        if re.match("\\dS", obj_code):
+        if record.kind == "player":
             obj = Player(obj_code=obj_code,
                          index=index,
-                         name=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["NAME"],
+                         name=record.name,
                          x=x_pos,
                          y=y_pos,
-                         action_points=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["ACTION_POINTS"],
-                         health=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["HEALTH"],
-                         sight_range=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["SIGHT_RANGE"],
-                         dice_rolls=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["DICE_ROLLS"])
+                         action_points=record.action_points,
+                         health=record.health,
+                         sight_range=record.sight_range,
+                         dice_rolls=record.dice_rolls)
         # Enemy objects
-        elif re.match("(M\\d|S\\d|T\\d)", obj_code):
+        elif record.kind == "enemy":
             obj = Enemy(obj_code=obj_code,
                         index=index,
-                        name=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["NAME"],
-                        type_=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["TYPE"],
+                        name=record.name,
+                        type_=record.type,
                         x=x_pos,
                         y=y_pos,
-                        dice_rolls=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["DICE_ROLLS"],
-                        action_points=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["ACTION_POINTS"]
-                        if obj_code[0] == "M" else None)
-        # Special objects
+                        dice_rolls=record.dice_rolls,
+                        action_points=record.action_points)
+        # Walls and empty spaces don't get their own python objects
+        elif record.kind in ["wall", "empty"]:
+            obj = None
+        # Tower object
+        elif record.kind == "tower":
+            obj = Tower(obj_code=obj_code,
+                        index=index,
+                        name=record.name,
+                        type_=record.type,
+                        x=x_pos,
+                        y=y_pos)
+        # Shrine objects
+        elif record.kind == "shrine":
+            obj = Shrine(obj_code=obj_code,
+                         index=index,
+                         name=record.name,
+                         type_=record.type,
+                         x=x_pos,
+                         y=y_pos,
+                         player_code=obj_code[0])
+        # Pin objects
         else:
-            # Walls and empty spaces don't get their own python objects
-            if obj_code in ["##", ".."]:
-                obj = None
-            # Tower object
-            elif obj_code == "**":
-                obj = Tower(obj_code=obj_code,
-                            index=index,
-                            name=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["NAME"],
-                            type_=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["TYPE"],
-                            x=x_pos,
-                            y=y_pos)
-            # Shrine objects
-            elif re.match("\\dG", obj_code):
-                obj = Shrine(obj_code=obj_code,
-                             index=index,
-                             name=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["NAME"],
-                             type_=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["TYPE"],
-                             x=x_pos,
-                             y=y_pos,
-                             player_code=obj_code[0])
-            # Pin objects
-            else:
-                obj = Pin(obj_code=obj_code,
-                          index=index,
-                          x=x_pos,
-                          y=y_pos,
-                          placed_by=placed_by,
-                          type_=self.config["OBJECT_INFO"]["OBJECT_CODES"][obj_code]["TYPE"])
+            obj = Pin(obj_code=obj_code,
+                      index=index,
+                      x=x_pos,
+                      y=y_pos,
+                      placed_by=placed_by,
+                      type_=record.type)
 
         return obj
 
+    ######################
+    # SNAPSHOT & RESTORE #
+    ######################
+
+    def snapshot(self):
+        """
+        Captures the board occupancy and the fields of every object on the board. Objects listed in more than one cell
+        (or no longer in the object list) are stored once and referred to by their position in the object tuple.
+        :return: Tuple
+        """
+        slots = {}
+        objects = []
+
+        def slot(obj):
+            if id(obj) not in slots:
+                slots[id(obj)] = len(objects)
+                objects.append((obj.__class__, obj.snapshot()))
+            return slots[id(obj)]
+
+        cells = tuple((pos, None if cell is None else tuple((k, slot(obj)) for k, obj in cell.items()))
+                      for pos, cell in self.board.items())
+        object_list = tuple((k, slot(obj)) for k, obj in self.objects.items())
+        return self.width, self.height, cells, tuple(objects), object_list, tuple(self.obj_counts.items())
+
+    def restore(self, snapshot):
+        """
+        Restores the board from a snapshot taken with snapshot(). The board and object containers are replaced rather
+        than modified, so shallow copies of this board are not affected.
+        :param snapshot: The snapshot
+        :return: N/A
+        """
+        # Snapshots of subclasses may carry extra data after the board fields
+        self.width, self.height, cells, objects, object_list, obj_counts = snapshot[:6]
+        objects = [cls.from_snapshot(fields) for cls, fields in objects]
+        self.board = defaultdict(dict, {pos: None if entries is None else {k: objects[i] for k, i in entries}
+                                        for pos, entries in cells})
+        self.objects = {k: objects[i] for k, i in object_list}
+        self.obj_counts = Counter(dict(obj_counts))
+
     ##########################
     # POSITIONING & MOVEMENT #
     ##########################
@@ -126,7 +170,7 @@ class Board:
         # no objects in the avoid list is at x,y position
         if 0 <= x < self.width and 0 <= y < self.height:
             if self.board[(y,x)]:
-                if not any([True for obj in self.board[(y,x)].values() if obj.name in avoid]):
+                if not any(obj.name in avoid for obj in self.board[(y,x)].values()):
                     return True
             elif allow_wall:
                 return True
@@ -170,7 +214,7 @@ class Board:
         y = self.objects[m].y
         # old_pos = (x, y)
 
-        shuffle(directions)
+        self.rng.shuffle(directions)
         while directions:
             op = directions.pop()
             new_x, new_y = self.update_location_by_direction(op, x, y, avoid=["Stone", "Trap"])
@@ -223,13 +267,13 @@ class Board:
         #     obj = f"{obj}({index})"
         if create:
             new_obj = self.create_object(x, y, obj_index, placed_by=placed_by)
-            self.board[(y,x)][obj_index] = new_obj
+            self.add_to_cell(obj_index, new_obj, x, y)
             self.objects[obj_index] = new_obj
         else:
             # Update location of object
             self.objects[obj_index].x = x
             self.objects[obj_index].y = y
-            self.board[(y,x)][obj_index] = self.objects[obj_index]
+            self.add_to_cell(obj_index, self.objects[obj_index], x, y)
 
             # Remove obj from old position if it was previously on the grid
             if old_x is not None:
@@ -249,11 +293,32 @@ class Board:
             x = self.objects[obj_index].x
             y = self.objects[obj_index].y
         # Delete object from board
-        self.board[(y,x)] = {k: v for k, v in self.board[(y,x)].items() if k != obj_index}
+        self.remove_from_cell(obj_index, x, y)
         # In this case, should delete object entirely (from game)
         if delete:
             del self.objects[obj_index]
 
+    def add_to_cell(self, obj_index, obj, x, y):
+        """
+        Lists an object in the cell at the given x,y position, replacing any object listed under the same index
+        :param obj_index: The index to list the object under
+        :param obj: The object
+        :param x: The x position of the cell
+        :param y: The y position of the cell
+        :return: N/A
+        """
+        self.board[(y,x)][obj_index] = obj
+
+    def remove_from_cell(self, obj_index, x, y):
+        """
+        Removes the object listed under the given index from the cell at the given x,y position, if there is one
+        :param obj_index: The index of the object
+        :param x: The x position of the cell
+        :param y: The y position of the cell
+        :return: N/A
+        """
+        self.board[(y,x)].pop(obj_index, None)
+
     def multi_remove(self, objs):
         """
         Removes the given objects from the grid
@@ -271,6 +336,15 @@ class Board:
     # GOAL TESTING #
     ################
 
+    def enemies_at(self, x, y):
+        """
+        Checks whether any enemy is listed in the cell at the given x,y position
+        :param x: The x position of the cell
+        :param y: The y position of the cell
+        :return: True/False
+        """
+        return any(isinstance(obj, Enemy) for obj in self.board[(y,x)].values())
+
     def at(self, player, obj):
         """
         Checks whether the given player and object are co-located
@@ -313,3 +387,92 @@ class Board:
             table.append(row)
         print("Grid:")
         print(tabulate(reversed(table), tablefmt="grid"), end="\n\n")
+
+
+class ArrayBoard(Board):
+    """
+    Board that also keeps the grid as NumPy layers: a wall mask, the number of objects listed in each cell, the number
+    listed per object name and the number of enemies. Validity checks and enemy co-location tests read the layers
+    instead of the cell dicts. The cell dicts are kept up to date as well, so the dict view of Board is still available.
+    """
+    def __init__(self, width, height, object_positions, config, rng=random, template=None):
+        names = sorted(set([record.name for record in get_object_records(config).values()]))
+        self.name_index = {name: i for i, name in enumerate(names)}
+        self.enemy_names = set([record.name for record in get_object_records(config).values()
+                                if record.kind == "enemy"])
+        self.walls = None
+        self.counts = None
+        self.name_counts = None
+        self.enemy_counts = None
+        super().__init__(width, height, object_positions, config, rng=rng, template=template)
+
+    def reset_board(self, width, height, object_positions):
+        super().reset_board(width, height, object_positions)
+        self.build_layers()
+
+    def build_layers(self):
+        """
+        Builds the layers from the cell dicts
+        :return: N/A
+        """
+        self.walls = np.zeros((self.height, self.width), dtype=bool)
+        self.counts = np.zeros((self.height, self.width), dtype=np.int16)
+        self.name_counts = np.zeros((len(self.name_index), self.height, self.width), dtype=np.int16)
+        self.enemy_counts = np.zeros((self.height, self.width), dtype=np.int16)
+        for (y, x), cell in self.board.items():
+            if cell is None:
+                self.walls[y, x] = True
+            else:
+                for obj in cell.values():
+                    self.count(obj, x, y, 1)
+
+    def snapshot(self):
+        return super().snapshot() + ((self.walls.copy(), self.counts.copy(), self.name_counts.copy(),
+                                      self.enemy_counts.copy()),)
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        # Snapshots taken from a plain Board have no layers
+        if len(snapshot) > 6:
+            self.walls, self.counts, self.name_counts, self.enemy_counts = [layer.copy() for layer in snapshot[6]]
+        else:
+            self.build_layers()
+
+    def count(self, obj, x, y, n):
+        """
+        Adds n to the layer counts of the given object at the given x,y position
+        :param obj: The object
+        :param x: The x position
+        :param y: The y position
+        :param n: The amount to add
+        :return: N/A
+        """
+        self.counts[y, x] += n
+        self.name_counts[self.name_index[obj.name], y, x] += n
+        if obj.name in self.enemy_names:
+            self.enemy_counts[y, x] += n
+
+    def add_to_cell(self, obj_index, obj, x, y):
+        cell = self.board[(y,x)]
+        if obj_index in cell:
+            self.count(cell[obj_index], x, y, -1)
+        cell[obj_index] = obj
+        self.count(obj, x, y, 1)
+
+    def remove_from_cell(self, obj_index, x, y):
+        obj = self.board[(y,x)].pop(obj_index, None)
+        if obj is not None:
+            self.count(obj, x, y, -1)
+
+    def check_valid_move(self, x, y, avoid=None, allow_wall=False):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            if self.counts[y, x]:
+                if avoid is None or not any(self.name_counts[self.name_index[name], y, x]
+                                            for name in avoid if name in self.name_index):
+                    return True
+            elif allow_wall:
+                return True
+        return False
+
+    def enemies_at(self, x, y):
+        return bool(self.enemy_counts[y, x])
@@ -0,0 +1,104 @@
+from json import loads
+import re
+
+MAIN_CONFIG = "game/config/main_config.json"
+# Configs loaded by this process, keyed by file path
+CONFIGS = {}
+# Object code records, keyed by the id of the config they were computed from (see get_object_records())
+OBJECT_RECORDS = {}
+
+
+def load_config(filepath=MAIN_CONFIG):
+    """
+    Loads a config file once per process. The same read-only config is shared by every caller, so it must not be
+    changed. Lists in the file are converted to tuples.
+    :param filepath: The config file
+    :return: FrozenDict
+    """
+    if filepath not in CONFIGS:
+        CONFIGS[filepath] = freeze(loads(open(filepath, "r").read()))
+    return CONFIGS[filepath]
+
+
+def freeze(obj):
+    """
+    Recursively converts dicts and lists in a parsed JSON object to FrozenDicts and tuples.
+    :param obj: The parsed JSON object
+    :return: The frozen object
+    """
+    if isinstance(obj, dict):
+        return FrozenDict({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+def get_object_records(config):
+    """
+    Gets the precomputed record of every object code in the config. Records are computed once per config.
+    :param config: The game config
+    :return: FrozenDict of object code to ObjectRecord
+    """
+    if id(config) not in OBJECT_RECORDS:
+        size_mapping = config["OBJECT_INFO"]["ENEMIES"]["ENEMY_SIZE_MAPPING"]
+        records = FrozenDict({code: ObjectRecord(code, info, size_mapping)
+                              for code, info in config["OBJECT_INFO"]["OBJECT_CODES"].items()})
+        # The config is kept alongside its records so its id can not be reused
+        OBJECT_RECORDS[id(config)] = (config, records)
+    return OBJECT_RECORDS[id(config)][1]
+
+
+class FrozenDict(dict):
+    """
+    A dict that can not be changed after it is created.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Config values are read-only.")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class ObjectRecord:
+    def __init__(self, code, info, size_mapping):
+        self.code = code
+        self.name = info["NAME"]
+        self.type = info["TYPE"]
+        self.kind = self.get_kind(code)
+        self.action_points = info.get("ACTION_POINTS")
+        self.health = info.get("HEALTH")
+        self.sight_range = info.get("SIGHT_RANGE")
+        self.dice_rolls = info.get("DICE_ROLLS")
+        # Dice as shown in the state, i.e. D6+0
+        if self.kind == "player":
+            self.dice = {enemy: f"D{dice['VAL']}+{dice['CONST']}" for enemy, dice in self.dice_rolls.items()}
+        elif self.kind == "enemy":
+            self.dice = f"D{self.dice_rolls['VAL']}+{self.dice_rolls['CONST']}"
+        else:
+            self.dice = None
+        self.size = size_mapping[self.type.split("_")[0]] if self.kind == "enemy" else None
+
+    @staticmethod
+    def get_kind(code):
+        if re.match("\\dS", code):
+            return "player"
+        elif re.match("(M\\d|S\\d|T\\d)", code):
+            return "enemy"
+        elif code == "##":
+            return "wall"
+        elif code == "..":
+            return "empty"
+        elif code == "**":
+            return "tower"
+        elif re.match("\\dG", code):
+            return "shrine"
+        return "pin"
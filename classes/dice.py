@@ -0,0 +1,56 @@
+import numpy as np
+
+# Number of uniform values drawn at a time
+BLOCK_SIZE = 256
+
+
+class DiceRoller:
+    """
+    Rolls dice from a game's own seeded NumPy Generator. Uniform draws are generated in blocks so a combat only slices
+    the current block. When the block can not supply every roll of a call, the rest of it is dropped and a new block is
+    drawn, so the rolls only depend on the seed and the sequence of calls.
+    """
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.block = None
+        self.position = 0
+        self.next_block()
+
+    def next_block(self):
+        """
+        Draws a new block of uniform values
+        :return: N/A
+        """
+        self.block = self.generator.random(self.block_size)
+        self.position = 0
+
+    def roll(self, vals, consts):
+        """
+        Rolls one die per value. A die with value 'val' and constant 'const' (i.e., D6+2) rolls an integer from const to
+        const + val - 1, or just const if val is 0.
+        :param vals: The die values
+        :param consts: The die constants
+        :return: Array of rolls
+        """
+        n = len(vals)
+        if self.position + n > self.block_size:
+            self.next_block()
+        draws = self.block[self.position:self.position + n]
+        self.position += n
+        return (draws * vals).astype(int) + consts
+
+    def get_state(self):
+        """
+        Gets the state of the roller. Blocks are never changed once drawn, so the current block is not copied
+        :return: Tuple
+        """
+        return self.generator.bit_generator.state, self.block, self.position
+
+    def set_state(self, state):
+        """
+        Sets the state of the roller to one returned by get_state()
+        :param state: The state
+        :return: N/A
+        """
+        self.generator.bit_generator.state, self.block, self.position = state
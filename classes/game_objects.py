@@ -1,7 +1,18 @@
-from random import choice
+from operator import attrgetter
 
 
 class GameObject:
+    __slots__ = ("obj_code", "index", "type", "x", "y")
+    # All fields of the class in a fixed order, which is the order used by snapshots
+    fields = __slots__
+    get_fields = attrgetter(*fields)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The fields of a subclass are the fields of its parent followed by its own slots
+        cls.fields = cls.__base__.fields + cls.__slots__
+        cls.get_fields = attrgetter(*cls.fields)
+
     def __init__(self, obj_code, index, x, y, type_):
         self.obj_code = obj_code
         self.index = index
@@ -9,8 +20,29 @@ class GameObject:
         self.x = x
         self.y = y
 
+    def snapshot(self):
+        """
+        Captures the fields of the object.
+        :return: Tuple of field values, in the order of 'fields'
+        """
+        return self.get_fields(self)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Creates an object from a snapshot taken with snapshot().
+        :param snapshot: The snapshot
+        :return: The object
+        """
+        obj = cls.__new__(cls)
+        for name, value in zip(cls.fields, snapshot):
+            setattr(obj, name, value)
+        return obj
+
 
 class Goal(GameObject):
+    __slots__ = ("name", "reached")
+
     def __init__(self, obj_code, index, name, type_, x, y):
         super().__init__(obj_code, index, x, y, type_)
         self.name = name
@@ -18,6 +50,8 @@ class Goal(GameObject):
 
 
 class Shrine(Goal):
+    __slots__ = ("player",)
+
     def __init__(self, obj_code, index, name, type_, x, y, player_code):
         super().__init__(obj_code, index, name, type_, x, y)
         self.player = self.get_player(player_code)
@@ -29,29 +63,37 @@ class Shrine(Goal):
 
 
 class Tower(Goal):
+    __slots__ = ("subgoal_count",)
+
     def __init__(self, obj_code, index, name, type_, x, y):
         super().__init__(obj_code, index, name, type_, x, y)
         self.subgoal_count = 0
 
 
 class Enemy(GameObject):
+    __slots__ = ("name", "dice_rolls", "action_points")
+
     def __init__(self, obj_code, index, name, type_, x, y, dice_rolls, action_points=None):
         super().__init__(obj_code, index, x, y, type_)
         self.name = name
         self.dice_rolls = dice_rolls
         self.action_points = action_points
 
-    def get_dice_roll(self):
-        val = self.dice_rolls["VAL"]
-        const = self.dice_rolls["CONST"]
-        if val > 0:
-            roll = choice(range(val))
-        else:
-            roll = 0
-        return roll + const
+    def get_dice(self):
+        return self.dice_rolls["VAL"], self.dice_rolls["CONST"]
+
+    def get_dice_roll(self, dice):
+        val, const = self.get_dice()
+        return int(dice.roll([val], [const])[0])
 
 
 class Player(GameObject):
+    # action_plan and action_positions must stay next to each other (see snapshot())
+    __slots__ = ("name", "action_points", "max_action_points", "health", "max_health", "sight_range", "dice_rolls",
+                 "start_x", "start_y", "prev_x", "prev_y", "dead", "death_round", "goal_reached", "pin_x", "pin_y",
+                 "placed_pin", "pin_finalized", "action_plan", "action_positions", "action_path_x", "action_path_y",
+                 "action_plan_finalized")
+
     def __init__(self, obj_code, index, name, x, y, action_points, health, sight_range, dice_rolls):
         super().__init__(obj_code, index, x, y, type_=name)
         # Indexing
@@ -70,10 +112,8 @@ class Player(GameObject):
         self.prev_y = y
         # Status
         self.dead = False
-        self.respawn_counter = None
         self.death_round = None
         self.goal_reached = False
-        self.combat_success = False
         # Pinning
         self.pin_x = x
         self.pin_y = y
@@ -82,22 +122,31 @@ class Player(GameObject):
         # Action planning
         self.action_plan = []
         self.action_positions = []
-        self.action_plan_x = None
+        # Position of the end of the action plan
+        self.action_path_x = None
         self.action_path_y = None
-        self.prev_action_plan_x = None
-        self.prev_action_path_y = None
-        self.action_plan_step = None
         self.action_plan_finalized = False
 
-    def get_dice_roll(self, enemy_type):
+    def get_dice(self, enemy_type):
         enemy_type = enemy_type.upper()
-        val = self.dice_rolls[enemy_type]["VAL"]
-        const = self.dice_rolls[enemy_type]["CONST"]
-        if val > 0:
-            roll = choice(range(val))
-        else:
-            roll = 0
-        return roll + const
+        return self.dice_rolls[enemy_type]["VAL"], self.dice_rolls[enemy_type]["CONST"]
+
+    def get_dice_roll(self, enemy_type, dice):
+        val, const = self.get_dice(enemy_type)
+        return int(dice.roll([val], [const])[0])
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        # Action plans are extended in place, so they are stored as tuples
+        i = self.fields.index("action_plan")
+        return snapshot[:i] + (tuple(self.action_plan), tuple(self.action_positions)) + snapshot[i + 2:]
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        obj = super().from_snapshot(snapshot)
+        obj.action_plan = list(obj.action_plan)
+        obj.action_positions = list(obj.action_positions)
+        return obj
 
     def reset_phase_values(self):
         # Pinning
@@ -108,17 +157,15 @@ class Player(GameObject):
         # Action planning
         self.action_plan = []
         self.action_positions = []
-        self.action_plan_x = None
+        self.action_path_x = None
         self.action_path_y = None
-        self.action_plan_step = None
         self.action_plan_finalized = False
 
 
 class Pin(GameObject):
+    __slots__ = ("name", "placed_by")
+
     def __init__(self, obj_code, index, x, y, placed_by, type_):
         super().__init__(obj_code, index, x, y, type_)
         self.name = obj_code
         self.placed_by = placed_by
-
-
-
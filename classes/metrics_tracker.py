@@ -1,18 +1,122 @@
-import os
+import multiprocessing as mp
+import numpy as np
 from collections import Counter
-from collections import defaultdict
 from datetime import datetime
-from dateutil.parser import parse
+from datetime import timedelta
+from multiprocessing.reduction import ForkingPickler
 from os import makedirs
 from os import path
-from time import sleep
-from time import time
+from queue import SimpleQueue
+from time import monotonic_ns
+from time import time_ns
 import tensorflow as tf
 from threading import Thread
 
+# Timestamps are monotonic_ns() values, which are converted to wall-clock time through this anchor when written
+CLOCK_ANCHOR = (monotonic_ns(), time_ns())
+EPOCH = datetime(1970, 1, 1)
+
+
+def format_timestamp(timestamp):
+    """
+    Formats a monotonic timestamp as UTC wall-clock time
+    :param timestamp: The monotonic_ns() value
+    :return: String (i.e., 2024-01-31 12:00:00.000000)
+    """
+    wall_ns = CLOCK_ANCHOR[1] + int(timestamp) - CLOCK_ANCHOR[0]
+    return (EPOCH + timedelta(microseconds=wall_ns // 1000)).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class TimeSeries:
+    """
+    Series of records stored in a fixed-capacity structured array. When the array is full, its records are appended
+    to the series' file and the array is reused, so memory stays constant however long the series runs. The first
+    column is always the timestamp. String values (i.e., phases and actions) are stored as indices into the series'
+    category list. Timestamps are formatted and categories decoded only when records are written (see rows()).
+    """
+    def __init__(self, columns=(), capacity=4096, filepath=None, header=None):
+        """
+        :param columns: List of (name, dtype) after the timestamp column. The dtype "category" stores strings.
+        :param capacity: The number of records held in memory
+        :param filepath: The file records are written to. If None, records are dropped when the array is full.
+        :param header: The column names written at the top of a new file
+        """
+        self.categorical = [name for name, dtype in columns if dtype == "category"]
+        self.categories = {name: [] for name in self.categorical}
+        self.category_index = {name: {} for name in self.categorical}
+        self.dtype = np.dtype([("timestamp", np.int64)] +
+                              [(name, np.int16 if dtype == "category" else dtype) for name, dtype in columns])
+        self.capacity = capacity
+        # Allocated by the first record, since many series (i.e., combat against each enemy size) stay empty
+        self.data = None
+        self.size = 0
+        self.filepath = filepath
+        self.header = header if header is not None else list(self.dtype.names)
+        # Timestamp of the latest record, which is kept when records are written
+        self.last_timestamp = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, *values):
+        if self.data is None:
+            self.data = np.zeros(self.capacity, dtype=self.dtype)
+        elif self.size == self.capacity:
+            self.save()
+        if self.categorical:
+            values = list(values)
+            for i, name in enumerate(self.dtype.names[1:]):
+                if name in self.category_index:
+                    values[i] = self.encode(name, values[i])
+        self.data[self.size] = (timestamp, *values)
+        self.size += 1
+        self.last_timestamp = timestamp
+
+    def encode(self, name, value):
+        index = self.category_index[name]
+        if value not in index:
+            index[value] = len(self.categories[name])
+            self.categories[name].append(value)
+        return index[value]
+
+    def rows(self):
+        """
+        Gets the records for writing, with formatted timestamps and decoded categories
+        :return: List of lists
+        """
+        columns = [[format_timestamp(t) for t in self.data["timestamp"][:self.size].tolist()]]
+        for name in self.dtype.names[1:]:
+            values = self.data[name][:self.size].tolist()
+            if name in self.categories:
+                values = [self.categories[name][v] for v in values]
+            columns.append(values)
+        return [list(row) for row in zip(*columns)]
+
+    def save(self):
+        """
+        Appends the records to the series' file and clears the series
+        :return: N/A
+        """
+        if self.size and self.filepath is not None:
+            save_records(self.rows(), self.header, self.filepath)
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+
+
+def save_records(records, columns, filepath):
+    mode = "a" if path.exists(filepath) else "w"
+    with open(filepath, mode) as file:
+        # Need to write columns if first time
+        if mode == "w":
+            file.write("\t".join(columns)+"\n")
+        for rec in records:
+            file.write("\t".join([str(i) for i in rec])+"\n")
+
 
 class GameMetricsTracker:
-    def __init__(self, level, metrics_config, instance_id=1, model_number=1):
+    def __init__(self, level, metrics_config, instance_id=1, model_number=1, tb_writer=None):
         self.id = instance_id
         self.model_number = model_number
         self.level = level
@@ -26,40 +130,51 @@ class GameMetricsTracker:
         self.num_games = 0
         self.num_phases = 0
         self.num_team_deaths = 0
-        self.clock_start = self._timestamp(as_string=False)
-        self.level_start = self._timestamp(as_string=False)
-        # Time Series Lists
-        self.agent_actions = defaultdict(list)
-        self.levels = defaultdict(list)
-        self.team_deaths = []
-        self.rounds = []
-        self.games = []
-        self.phases = []
-        self.player_trackers = {"Dwarf": PlayerMetricsTracker("Dwarf"),
-                                "Giant": PlayerMetricsTracker("Giant"),
-                                "Human": PlayerMetricsTracker("Human")}
-        # Time series counter
-        self.metric_counter = Counter()
+        self.clock_start = self._timestamp()
+        self.level_start = self._timestamp()
         self.metrics_dir = self.metrics_config["DIRECTORIES"]["LOGFILES"].format(self.model_number)
-        self.tb_dir = self.metrics_config["DIRECTORIES"]["TENSORBOARD"]
         self._setup_directories()
+        # Time Series
+        self.agent_actions = {p: self._get_series("GAME", "AGENT_ACTIONS", [("level", np.int16), ("round", np.int32),
+                                                                            ("phase", "category"),
+                                                                            ("action", "category")], params=p)
+                              for p in ["Dwarf", "Giant", "Human"]}
+        self.levels = {}
+        self.team_deaths = self._get_series("GAME", "TEAM_DEATHS", [("level", np.int16), ("round", np.int32)])
+        self.rounds = self._get_series("GAME", "ROUNDS", [("round", np.int32), ("time_elapsed", np.int64)])
+        self.games = self._get_series("GAME", "GAMES", [("game", np.int32), ("time_elapsed", np.int64)])
+        self.phases = self._get_series("GAME", "PHASES", [("phase", "category"), ("time_elapsed", np.int64)])
+        self.player_trackers = {"Dwarf": PlayerMetricsTracker("Dwarf", self._get_series),
+                                "Giant": PlayerMetricsTracker("Giant", self._get_series),
+                                "Human": PlayerMetricsTracker("Human", self._get_series)}
+        # Time series counter
+        self.metric_counter = Counter()
 
-        # Start tensorboard writer
-        TensorBoardWriter(metrics_config=self.metrics_config, model_number=self.model_number)
+        # Records are sent to the writer of the training run if there is one, otherwise to the writer of this process
+        self.tb_writer = tb_writer or get_tensorboard_writer(self.metrics_config, self.model_number)
 
     def save(self):
+        """
+        Writes the records of every series to their files
+        :return: N/A
+        """
         ##############
         # GAME LEVEL #
         ##############
-        # Levels
-        self._save_level_metrics()
-
-        self._reset()
+        for series in [*self.levels.values(), *self.agent_actions.values(), self.team_deaths, self.rounds,
+                       self.games, self.phases]:
+            series.save()
+        ################
+        # PLAYER LEVEL #
+        ################
+        for tracker in self.player_trackers.values():
+            tracker.save()
 
     def _setup_directories(self):
         makedirs(self.metrics_dir, exist_ok=True)
-        for metric in self.metrics_config["GAME"]:
-            makedirs(self.metrics_dir + self.metrics_config["GAME"][metric]["SUBDIRECTORY"], exist_ok=True)
+        for component in ["GAME", "PLAYER"]:
+            for metric in self.metrics_config[component]:
+                makedirs(self.metrics_dir + self.metrics_config[component][metric]["SUBDIRECTORY"], exist_ok=True)
 
     def _get_filepath(self, component, metric, params=None, additional_info=""):
         if params is None:
@@ -70,27 +185,29 @@ class GameMetricsTracker:
             self.metrics_config[component][metric]["FILENAME"].format(*params) + additional_info + \
             self.metrics_config["EXTENSION"].format(self.id)
 
-    def _save_level_metrics(self, component="GAME", metric="LEVEL"):
-        for level in self.levels:
+    def _get_series(self, component, metric, columns=(), params=None, additional_info=""):
+        """
+        Creates a series that is written to the file of a metric
+        :param component: GAME or PLAYER
+        :param metric: The metric (i.e., LEVEL)
+        :param columns: The columns after the timestamp (see TimeSeries)
+        :param params: The values of the metric's filename
+        :param additional_info: Text added to the filename
+        :return: TimeSeries
+        """
+        return TimeSeries(columns,
+                          capacity=self.metrics_config["BUFFER_CAPACITY"],
+                          filepath=self._get_filepath(component, metric, params, additional_info),
+                          header=self.metrics_config[component][metric]["COLUMNS"])
+
+    def _get_level_series(self, level, component="GAME", metric="LEVEL"):
+        if level not in self.levels:
             graph_name = self.metrics_config[component][metric]["GRAPH_NAME"].format(level)
-            filepath = self._get_filepath(component, metric, params=level, additional_info="-gn-{}".format(graph_name))
-            columns = self.metrics_config[component][metric]["COLUMNS"]
-            self._save_records(records=self.levels[level], columns=columns, filepath=filepath)
-
-    @staticmethod
-    def _save_records(records, columns, filepath):
-        mode = "a" if path.exists(filepath) else "w"
-        with open(filepath, mode) as file:
-            # Need to write columns if first time
-            if mode == "w":
-                file.write("\t".join(columns)+"\n")
-            for rec in records:
-                # self.metric_counter[metric_counter_name] += 1
-
-                file.write("\t".join([str(i) for i in rec])+"\n")
-
-    def _reset(self):
-        self.levels = defaultdict(list)
+            self.levels[level] = self._get_series(component, metric, [("level", np.int16),
+                                                                      ("number_repeats", np.int32),
+                                                                      ("time_to_complete", np.float64)],
+                                                  params=level, additional_info="-gn-{}".format(graph_name))
+        return self.levels[level]
 
     def update(self, target, **kwargs):
         self.num_records += 1
@@ -119,72 +236,80 @@ class GameMetricsTracker:
 
         if metric_name == "new_phase":
             self.num_phases += 1
-            self.phases.append([timestamp, phase, self._calculate_time_elapsed(self.phases)])
+            self.phases.append(timestamp, phase, self._calculate_time_elapsed(self.phases, timestamp))
 
         elif metric_name == "new_round":
             self.num_rounds += 1
-            self.rounds.append([timestamp, self.num_rounds, self._calculate_time_elapsed(self.rounds)])
+            self.rounds.append(timestamp, self.num_rounds, self._calculate_time_elapsed(self.rounds, timestamp))
 
         elif metric_name == "game_over":
             self.num_games += 1
-            self.games.append([timestamp, self.num_games, self._calculate_time_elapsed(self.games)])
+            self.games.append(timestamp, self.num_games, self._calculate_time_elapsed(self.games, timestamp))
             self.save()
         elif metric_name == "new_level":
             print("LEVEL HAS CHANGED!")
             print(F"level is: {self.level}")
             # Track time to complete last level
-            elapsed_time = (self._timestamp(as_string=False) - self.level_start)
-            self.levels[self.level].append([timestamp, self.level, self.repeat_counter[self.level],
-                                            elapsed_time.total_seconds()])
+            self._record_level(timestamp)
             # Update level
             self.level = level
-            self.level_start = self._timestamp(as_string=False)
+            self.level_start = timestamp
             self.repeat_counter[self.level] += 1
         elif metric_name == "num_repeats":
             # Track time to complete last level
-            elapsed_time = (self._timestamp(as_string=False) - self.level_start)
-            self.levels[self.level].append([timestamp, self.level, self.repeat_counter[self.level],
-                                            elapsed_time.total_seconds()])
+            self._record_level(timestamp)
 
             self.repeat_counter[self.level] += 1
-            self.level_start = self._timestamp(as_string=False)
+            self.level_start = timestamp
             # self.save()
         elif metric_name == "agent_action":
             self.num_agent_actions += 1
-            self.agent_actions[player].append([timestamp, self.level, self.num_rounds, phase, agent_action])
+            self.agent_actions[player].append(timestamp, self.level, self.num_rounds, phase, agent_action)
         elif metric_name == "team_death":
             self.num_team_deaths += 1
-            self.team_deaths.append([timestamp, self.level, self.num_rounds])
+            self.team_deaths.append(timestamp, self.level, self.num_rounds)
+
+    def _record_level(self, timestamp, component="GAME", metric="LEVEL"):
+        time_to_complete = (timestamp - self.level_start) / 1e9
+        self._get_level_series(self.level).append(timestamp, self.level, self.repeat_counter[self.level],
+                                                  time_to_complete)
+        tag = "{}/{}".format(self.metrics_config[component][metric]["SUBDIRECTORY"].strip("/"),
+                             self.metrics_config[component][metric]["GRAPH_NAME"].format(self.level))
+        self.tb_writer.put(tag, time_to_complete)
 
     # new round vs new phase
-    def _calculate_time_elapsed(self, time_series):
-        if time_series:
-            # Get time elapsed since last round
-            time_elapsed = self._timestamp(as_string=False) - parse(time_series[-1][0])
-        else:
-            time_elapsed = self._timestamp(as_string=False) - self.clock_start
-        return time_elapsed.seconds
+    def _calculate_time_elapsed(self, time_series, timestamp):
+        # Get whole seconds elapsed since the last record, or since the tracker started
+        last = self.clock_start if time_series.last_timestamp is None else time_series.last_timestamp
+        return (timestamp - last) // 1_000_000_000
 
     @staticmethod
-    def _timestamp(as_string=True):
-        timestamp = datetime.utcnow()
-        if as_string:
-            timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
-
-        return timestamp
+    def _timestamp():
+        return monotonic_ns()
 
 
 class PlayerMetricsTracker:
-    def __init__(self, player):
+    def __init__(self, player, get_series):
+        """
+        :param player: The player
+        :param get_series: Creates the series of a metric (see GameMetricsTracker._get_series())
+        """
         self.player = player
-        self.health_loss = []
-        self.deaths = []
-        self.pins = {"pinga": [], "pingb": [], "pingc": [], "pingd": []}
+        self.health_loss = get_series("PLAYER", "HEALTH_LOSS", params=player)
+        self.deaths = get_series("PLAYER", "DEATHS", params=player)
+        self.pins = {pin: get_series("PLAYER", "PINS", params=[player, pin])
+                     for pin in ["pinga", "pingb", "pingc", "pingd"]}
         # Combat Tracking
         self.total_wins = 0
         self.total_losses = 0
-        self.wins = self._get_enemy_tracker()
-        self.losses = self._get_enemy_tracker()
+        self.wins = self._get_enemy_tracker(get_series, "win")
+        self.losses = self._get_enemy_tracker(get_series, "loss")
+
+    def save(self):
+        combat = [series for tracker in [self.wins, self.losses] for sizes in tracker.values()
+                  for series in sizes.values()]
+        for series in [self.health_loss, self.deaths, *self.pins.values(), *combat]:
+            series.save()
 
     def pin(self, pin_type, timestamp):
         self.pins[pin_type].append(timestamp)
@@ -203,69 +328,120 @@ class PlayerMetricsTracker:
         elif metric_name == "health_loss":
             self.health_loss.append(timestamp)
 
-    @staticmethod
-    def _get_enemy_tracker():
-        return {"Monster": {"S": [], "M": [], "L": [], "XL": []},
-                "Stone": {"S": [], "M": [], "L": []},
-                "Trap": {"S": [], "M": [], "L": []}}
-
-
-class TensorBoardWriter:
-    def __init__(self, metrics_config, model_number):
-        self.metrics_config = metrics_config
-        self.model_number = model_number
-
-        self.metrics_dir = self.metrics_config["DIRECTORIES"]["LOGFILES"].format(self.model_number)
-        self.tb_dir = self.metrics_config["DIRECTORIES"]["TENSORBOARD"].format(self.model_number)
-        # TB Logger
-        # self.tf_writer = tf.summary.create_file_writer(self.tb_dir)
-        # self.metric_counter = Counter()
-        # self.record_offset = Counter()
-
-        logging_thread = Thread(target=self.logger, args=(self.metrics_dir, self.tb_dir,
-                                                          self.metrics_config["TB_LOGGER_REFRESH_RATE"]))
-        logging_thread.start()
-
-    @staticmethod
-    def logger(metrics_dir, tb_dir, refresh_rate):
-        tf_writer = tf.summary.create_file_writer(tb_dir, flush_millis=30000)
-        metric_counter = Counter()
-
-        dirs = [metrics_dir + dir_ for dir_ in os.listdir(metrics_dir)]
-        with tf_writer.as_default():
-            while True:
-                sleep(refresh_rate)
-                for d in dirs:
-                    files = [d + "/" + file for file in os.listdir(d)]
-                    for file in files:
-                        graph_name = file.split("-")[-2]
-                        num_cols = None
-                        with open(file, "r") as logfile:
-                            c = 0
-                            for line in logfile:
-                                # Don't reread records already written to tensorboard
-                                if c < metric_counter[graph_name]:
-                                    c += 1
-                                    continue
-
-                                line = line.split("\t")
-                                if not num_cols:
-                                    num_cols = len(line)
-                                # This is an incomplete line, so finish reading file
-                                if len(line) < num_cols:
-                                    break
-                                if c > 0:
-                                    tf.summary.scalar(name="{}/{}".format(d.split("/")[-1], graph_name),
-                                                      data=float(line[-1]),
-                                                      step=metric_counter[graph_name])
-                                    metric_counter[graph_name] += 1
-                                c += 1
-                        tf_writer.flush()
-
-
-
-
+    def _get_enemy_tracker(self, get_series, outcome):
+        sizes = {"Monster": ["S", "M", "L", "XL"], "Stone": ["S", "M", "L"], "Trap": ["S", "M", "L"]}
+        return {enemy_type: {size: get_series("PLAYER", "COMBAT", params=[self.player, outcome, enemy_type, size])
+                             for size in enemy_sizes}
+                for enemy_type, enemy_sizes in sizes.items()}
 
 
+def get_tensorboard_writer(metrics_config, model_number):
+    """
+    Gets the TensorBoard writer of this process for a model. Every tracker of the process shares it.
+    :param metrics_config: The metrics config
+    :param model_number: The model number
+    :return: TensorBoardWriter
+    """
+    tb_dir = metrics_config["DIRECTORIES"]["TENSORBOARD"].format(model_number)
+    if tb_dir not in TB_WRITERS:
+        TB_WRITERS[tb_dir] = TensorBoardWriter(tb_dir, metrics_config["TB_LOGGER_REFRESH_RATE"])
+    return TB_WRITERS[tb_dir]
 
 
+class TensorBoardWriter:
+    """
+    Sink for the metric records of trackers. Trackers only put records on the writer's queue, and a single daemon
+    thread owns the TensorBoard file writer. The thread is started by the first record. Writers of a
+    MetricsAggregator put records on the queue of the aggregator process instead, and start no thread.
+    """
+    def __init__(self, tb_dir, refresh_rate, queue=None):
+        """
+        :param tb_dir: The TensorBoard directory
+        :param refresh_rate: The time (in seconds) between flushes of the TensorBoard file
+        :param queue: The queue of a MetricsAggregator
+        """
+        self.tb_dir = tb_dir
+        self.refresh_rate = refresh_rate
+        self.queue = queue
+        self.thread = None
+
+    def __getstate__(self):
+        if self.queue is None:
+            raise TypeError("Only the writers of a MetricsAggregator can be passed to other processes.")
+        # Writers reach worker processes inside cloudpickled env functions, which would copy the file descriptors of
+        # the queue as plain ints, so the queue is pickled by multiprocessing
+        return {**self.__dict__, "queue": ForkingPickler.dumps(self.queue)}
+
+    def __setstate__(self, state):
+        state["queue"] = ForkingPickler.loads(state["queue"])
+        self.__dict__.update(state)
+
+    def put(self, tag, value):
+        """
+        Adds a record to the TensorBoard series of a tag. Each record is the next step of its series.
+        :param tag: The tag (i.e., level/time_to_complete_level_1)
+        :param value: The value
+        :return: N/A
+        """
+        if self.queue is None:
+            self.queue = SimpleQueue()
+            self.thread = Thread(target=write_records, args=(self.queue, self.tb_dir, self.refresh_rate), daemon=True)
+            self.thread.start()
+        self.queue.put((tag, float(value)))
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+
+
+class MetricsAggregator:
+    """
+    A process that writes the metric records of every env of a training run to TensorBoard. Envs in worker processes
+    put their records on its queue through the writer returned by writer().
+    """
+    def __init__(self, metrics_config, model_number, start_method=None):
+        """
+        :param metrics_config: The metrics config
+        :param model_number: The model number
+        :param start_method: The multiprocessing start method, which must match the one of the worker processes
+        """
+        ctx = mp.get_context(start_method)
+        self.tb_dir = metrics_config["DIRECTORIES"]["TENSORBOARD"].format(model_number)
+        self.refresh_rate = metrics_config["TB_LOGGER_REFRESH_RATE"]
+        self.queue = ctx.Queue()
+        self.process = ctx.Process(target=write_records, args=(self.queue, self.tb_dir, self.refresh_rate),
+                                   daemon=True)
+        self.process.start()
+
+    def writer(self):
+        return TensorBoardWriter(self.tb_dir, self.refresh_rate, queue=self.queue)
+
+    def close(self):
+        self.queue.put(None)
+        self.process.join()
+
+
+def write_records(queue, tb_dir, refresh_rate):
+    """
+    Writes the records of a queue to TensorBoard until it receives None
+    :param queue: The queue of (tag, value) records
+    :param tb_dir: The TensorBoard directory
+    :param refresh_rate: The time (in seconds) between flushes of the TensorBoard file
+    :return: N/A
+    """
+    tf_writer = tf.summary.create_file_writer(tb_dir, flush_millis=int(refresh_rate * 1000))
+    metric_counter = Counter()
+    with tf_writer.as_default():
+        while True:
+            record = queue.get()
+            if record is None:
+                break
+            tag, value = record
+            tf.summary.scalar(name=tag, data=value, step=metric_counter[tag])
+            metric_counter[tag] += 1
+    tf_writer.flush()
+
+
+# Writers of this process, keyed by TensorBoard directory (see get_tensorboard_writer())
+TB_WRITERS = {}
@@ -0,0 +1,68 @@
+from time import perf_counter_ns
+
+
+class PerfStats:
+    """
+    Call counters and cumulative timers (in nanoseconds) of the engine stages of a game. Stages are timed by wrapping
+    the game's methods on the instance (see instrument()), so games that are not instrumented run the plain methods
+    and pay nothing. Times are inclusive: a stage called by another stage (i.e., check_combat() by execute_plans()) is
+    also counted in the time of the outer stage.
+    """
+    def __init__(self, stages):
+        """
+        :param stages: The names of the methods to time
+        """
+        self.calls = dict.fromkeys(stages, 0)
+        self.times = dict.fromkeys(stages, 0)
+
+    def instrument(self, obj):
+        """
+        Replaces the stage methods of an object with timed versions, which are set as instance attributes
+        :param obj: The object
+        :return: N/A
+        """
+        for stage in self.calls:
+            setattr(obj, stage, self.timed(stage, getattr(obj, stage)))
+
+    @staticmethod
+    def uninstrument(obj, stages):
+        """
+        Removes the timed versions of the stage methods from an object (i.e., a copy of an instrumented object)
+        :param obj: The object
+        :param stages: The names of the timed methods
+        :return: N/A
+        """
+        for stage in stages:
+            obj.__dict__.pop(stage, None)
+
+    def timed(self, stage, method):
+        calls = self.calls
+        times = self.times
+
+        def timed_method(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[stage] += perf_counter_ns() - start
+                calls[stage] += 1
+        return timed_method
+
+    def get(self):
+        """
+        :return: Dict of stage to its number of calls and total time (in nanoseconds)
+        """
+        return {stage: {"calls": self.calls[stage], "total_ns": self.times[stage]} for stage in self.calls}
+
+
+def add_stats(totals, stats):
+    """
+    Adds the stats of a game (see PerfStats.get()) to running totals
+    :param totals: Dict of stage to calls and total time, updated in place
+    :param stats: Dict of stage to calls and total time
+    :return: N/A
+    """
+    for stage, values in stats.items():
+        total = totals.setdefault(stage, {"calls": 0, "total_ns": 0})
+        total["calls"] += values["calls"]
+        total["total_ns"] += values["total_ns"]
@@ -0,0 +1,272 @@
+from collections.abc import Mapping
+import numpy as np
+import struct
+from classes.config import get_object_records
+from classes.game_objects import *
+
+# Commands and statuses are stored by their index
+COMMANDS = ("get_state", "execute_action", "execute_actions")
+STATUSES = ("OK", "Done")
+# Codecs, keyed by the id of the config they were built from (see get_state_codec())
+CODECS = {}
+
+
+def get_state_codec(config):
+    """
+    Gets the state codec of a config. Codecs are built once per config.
+    :param config: The game config
+    :return: StateCodec
+    """
+    if id(config) not in CODECS:
+        # The config is kept alongside its codec so its id can not be reused
+        CODECS[id(config)] = (config, StateCodec(config))
+    return CODECS[id(config)][1]
+
+
+class StateCodec:
+    """
+    Compact binary encoding of the state returned by get_state(). An encoded state is a fixed-size header holding the
+    command, status and gameData, followed by one fixed-width record per scene entry. Values that only depend on the
+    object code (names, dice, sight ranges, enemy action points) are not stored and are looked up in the object records
+    when decoding.
+    """
+    # Magic, command, status, level, num_repeats, phase, board width, board height, number of records
+    header = struct.Struct("<4sBBhhBhhI")
+    magic = b"DAS1"
+
+    def __init__(self, config):
+        self.object_records = get_object_records(config)
+        self.phases = config["GAMEPLAY"]["PHASES"]["PHASE_LIST"]
+        self.moves = config["GAMEPLAY"]["ACTIONS"]["VALID_MOVE_ACTIONS"]
+        self.move_index = {m: i for i, m in enumerate(self.moves)}
+        self.types = tuple(dict.fromkeys(r.type for r in self.object_records.values()))
+        self.type_index = {t: i for i, t in enumerate(self.types)}
+        # Players are stored by their character id (1-3), 0 is no player
+        self.players = {r.name: int(r.code[0]) for r in self.object_records.values() if r.kind == "player"}
+        self.player_names = {i: name for name, i in self.players.items()}
+        self.max_plan = max([r.action_points for r in self.object_records.values() if r.kind == "player"])
+        # Pin cursors can be unset, which is stored as -1
+        self.dtype = np.dtype([("type", "u1"), ("code", "S2"), ("copy", "<u2"), ("x", "<i2"), ("y", "<i2"),
+                               ("pin_x", "<i2"), ("pin_y", "<i2"), ("health", "i1"), ("dead", "?"),
+                               ("action_points", "i1"), ("plan_finalized", "?"), ("plan_length", "u1"),
+                               ("plan", "u1", (self.max_plan,)), ("reached", "?"), ("subgoal_count", "u1"),
+                               ("placed_by", "u1")])
+
+    ############
+    # ENCODING #
+    ############
+
+    def encode(self, state):
+        """
+        Encodes a state dict (i.e., from get_state())
+        :param state: The state
+        :return: bytes
+        """
+        return self.encode_records(state["command"], state["status"], state["content"]["gameData"],
+                                   [self.entity_record(e) for e in state["content"]["scene"]])
+
+    def encode_records(self, command, status, game_data, records):
+        """
+        Encodes a state from its header values and records
+        :param command: The command the state answers
+        :param status: The game status
+        :param game_data: The gameData dict
+        :param records: List of record tuples (see record())
+        :return: bytes
+        """
+        header = self.header.pack(self.magic, COMMANDS.index(command), STATUSES.index(status), game_data["level"],
+                                  game_data["num_repeats"], self.phases.index(game_data["currentPhase"]),
+                                  game_data["boardWidth"], game_data["boardHeight"], len(records))
+        return header + np.array(records, dtype=self.dtype).tobytes()
+
+    def record(self, type_, code, x, y, copy=0, pin_x=None, pin_y=None, health=0, dead=False, action_points=0,
+               plan_finalized=False, plan=(), reached=False, subgoal_count=0, placed_by=None):
+        """
+        Creates the record tuple of a scene entry. Numbers that do not fit their field are rejected by NumPy when the
+        records are encoded, but longer codes would be cut short, so they are rejected here.
+        :return: Tuple
+        """
+        if len(code) != 2:
+            raise ValueError(f"Object codes must be 2 characters long: {code!r}.")
+        return (self.type_index[type_], code, copy, x, y,
+                -1 if pin_x is None else pin_x, -1 if pin_y is None else pin_y,
+                health, dead, action_points, plan_finalized, len(plan),
+                tuple([self.move_index[a] for a in plan]) + (0,) * (self.max_plan - len(plan)),
+                reached, subgoal_count, self.players.get(placed_by, 0))
+
+    def wall_record(self, x, y):
+        return self.record("wall", "##", x, y)
+
+    def object_record(self, obj):
+        """
+        Creates the record tuple of a game object
+        :param obj: The object
+        :return: Tuple
+        """
+        if isinstance(obj, Player):
+            return self.record(obj.type, obj.obj_code, obj.x, obj.y, pin_x=obj.pin_x, pin_y=obj.pin_y,
+                               health=obj.health, dead=obj.dead, action_points=obj.action_points,
+                               plan_finalized=obj.action_plan_finalized, plan=obj.action_plan)
+        elif isinstance(obj, Shrine):
+            return self.record(obj.type, obj.obj_code, obj.x, obj.y, reached=obj.reached)
+        elif isinstance(obj, Tower):
+            return self.record(obj.type, obj.obj_code, obj.x, obj.y, subgoal_count=obj.subgoal_count)
+        elif isinstance(obj, Pin):
+            return self.record(obj.type, obj.obj_code, obj.x, obj.y, placed_by=obj.placed_by)
+        # Enemies are named by their index, which is their code followed by a copy number for repeated codes (M1(2))
+        return self.record(obj.type, obj.obj_code, obj.x, obj.y, int(obj.index[3:-1]) if len(obj.index) > 2 else 0)
+
+    def entity_record(self, ele):
+        """
+        Creates the record tuple of a scene entry dict
+        :param ele: The scene entry
+        :return: Tuple
+        """
+        if ele["type"] == "wall":
+            return self.wall_record(ele["x"], ele["y"])
+        if "characterId" in ele:
+            return self.record(ele["type"], f"{ele['characterId']}S", ele["x"], ele["y"], pin_x=ele["pinCursorX"],
+                               pin_y=ele["pinCursorY"], health=ele["health"], dead=ele["dead"],
+                               action_points=ele["actionPoints"], plan_finalized=ele["action_plan_finalized"],
+                               plan=ele["actionPlan"])
+        if ele["type"] == "shrine":
+            return self.record(ele["type"], f"{self.players[ele['character']]}G", ele["x"], ele["y"],
+                               reached=ele["reached"])
+        if "subgoalCount" in ele:
+            return self.record(ele["type"], "**", ele["x"], ele["y"], subgoal_count=ele["subgoalCount"])
+        if ele["type"] == "pin":
+            return self.record(ele["type"], ele["name"], ele["x"], ele["y"], placed_by=ele["placedBy"])
+        name = ele["name"]
+        return self.record(ele["type"], name[:2], ele["x"], ele["y"], int(name[3:-1]) if len(name) > 2 else 0)
+
+    ############
+    # DECODING #
+    ############
+
+    def decode(self, data):
+        """
+        Decodes an encoded state. The records are read in place, without creating any scene entry dicts.
+        :param data: bytes
+        :return: BinaryState
+        """
+        magic, command, status, level, num_repeats, phase, width, height, count = self.header.unpack_from(data)
+        if magic != self.magic:
+            raise ValueError("Not an encoded state.")
+        game_data = {
+            "boardWidth": width,
+            "boardHeight": height,
+            "level": level,
+            "num_repeats": num_repeats,
+            "currentPhase": self.phases[phase],
+        }
+        records = np.frombuffer(data, dtype=self.dtype, count=count, offset=self.header.size)
+        return BinaryState(self, COMMANDS[command], STATUSES[status], game_data, records)
+
+    def entity(self, rec):
+        """
+        Creates the scene entry dict of a record, identical to the entry built by DiceAdventure.get_object_state()
+        :param rec: The record
+        :return: Dict
+        """
+        code = rec["code"].decode()
+        object_record = self.object_records[code]
+        ele = {"name": object_record.name, "type": self.types[rec["type"]], "x": int(rec["x"]), "y": int(rec["y"])}
+        if object_record.kind == "player":
+            ele.update({
+                "characterId": int(code[0]),
+                "pinCursorX": int(rec["pin_x"]) if rec["pin_x"] >= 0 else None,
+                "pinCursorY": int(rec["pin_y"]) if rec["pin_y"] >= 0 else None,
+                "sightRange": object_record.sight_range,
+                "monsterDice": object_record.dice["MONSTER"],
+                "trapDice": object_record.dice["TRAP"],
+                "stoneDice": object_record.dice["STONE"],
+                "health": int(rec["health"]),
+                "dead": bool(rec["dead"]),
+                "actionPoints": int(rec["action_points"]),
+                "actionPlan": [self.moves[a] for a in rec["plan"][:rec["plan_length"]]],
+                "action_plan_finalized": bool(rec["plan_finalized"])
+            })
+        elif object_record.kind == "shrine":
+            ele.update({
+                "reached": bool(rec["reached"]),
+                "character": self.player_names[int(code[0])]
+            })
+        elif object_record.kind == "tower":
+            ele.update({
+                "subgoalCount": int(rec["subgoal_count"])
+            })
+        elif object_record.kind == "enemy":
+            ele.update({
+                "name": code + (f"({rec['copy']})" if rec["copy"] else ""),
+                "combatDice": object_record.dice
+            })
+            # Action points only apply to monsters
+            if object_record.name == "Monster":
+                ele["actionPoints"] = object_record.action_points
+        elif object_record.kind == "pin":
+            ele.update({
+                "name": code,
+                "placedBy": self.player_names.get(int(rec["placed_by"]))
+            })
+        return ele
+
+
+class BinaryState(Mapping):
+    """
+    A decoded state. It can be read like a state dict (state["content"]["gameData"]), but the scene entry dicts are
+    only created if the scene is read. Code that knows about binary states reads 'records' directly.
+    """
+    def __init__(self, codec, command, status, game_data, records):
+        self.codec = codec
+        self.command = command
+        self.status = status
+        self.game_data = game_data
+        self.records = records
+        self.content = BinaryContent(self)
+
+    def __getitem__(self, key):
+        if key == "command":
+            return self.command
+        elif key == "status":
+            return self.status
+        elif key == "message":
+            return "Full State"
+        elif key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("command", "status", "message", "content"))
+
+    def __len__(self):
+        return 4
+
+    def find(self, type_):
+        """
+        Gets the scene entry of the first record of a type
+        :param type_: The type (i.e., Dwarf, shrine)
+        :return: Dict, or None if there is no record of the type
+        """
+        i = np.flatnonzero(self.records["type"] == self.codec.type_index[type_])
+        return self.codec.entity(self.records[i[0]]) if len(i) else None
+
+
+class BinaryContent(Mapping):
+    def __init__(self, state):
+        self.state = state
+        self.scene = None
+
+    def __getitem__(self, key):
+        if key == "gameData":
+            return self.state.game_data
+        elif key == "scene":
+            if self.scene is None:
+                self.scene = [self.state.codec.entity(rec) for rec in self.state.records]
+            return self.scene
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("gameData", "scene"))
+
+    def __len__(self):
+        return 2
@@ -0,0 +1,5 @@
+# Scripts that drive a running game by hand rather than pytest tests
+collect_ignore = ["test_unity_version.py",
+                  "tests/test_dice_adventure.py",
+                  "tests/test_socket.py",
+                  "tests/test_unity_pinging.py"]
@@ -0,0 +1,901 @@
+from random import Random
+import numpy as np
+from classes.config import get_object_records
+from classes.config import load_config
+from classes.dice import BLOCK_SIZE
+
+
+class BatchedDiceAdventure:
+    """
+    Struct-of-arrays implementation of DiceAdventure that steps N games in lockstep. Positions, health, action points,
+    phases and enemy state for every game live in NumPy arrays and each engine stage is applied to all games at once.
+    Game i follows exactly the same rules as DiceAdventure(seed=seeds[i], ...) and produces the same results for the
+    same sequence of actions.
+    """
+    def __init__(self,
+                 num_games,
+                 seeds=None,
+                 level=1,
+                 limit_levels=None,
+                 level_sampling=False,
+                 num_repeats=0,
+                 restart_on_finish=False,
+                 round_cap=0,
+                 **kwargs):
+        """
+        :param num_games: The number of games to simulate
+        :param seeds: One seed per game. Game i draws from the same random stream as DiceAdventure(seed=seeds[i])
+        :param kwargs: Remaining DiceAdventure settings (rendering, metrics) are not supported and ignored
+        """
+        #################
+        # GAME METADATA #
+        #################
+        self.config = load_config()
+        self.object_records = get_object_records(self.config)
+        self.num_games = num_games
+        seeds = seeds if seeds is not None else [None] * num_games
+        self.rngs = [Random(s) for s in seeds]
+        # Dice streams (see DiceRoller). The current block of every game is kept in one array so the dice of all
+        # combats are read at once
+        self.dice_generators = [np.random.default_rng(s) for s in seeds]
+        self.dice_blocks = np.stack([gen.random(BLOCK_SIZE) for gen in self.dice_generators])
+        self.dice_position = np.zeros(num_games, dtype=int)
+        self.respawn_wait = 2
+        self.round_cap = round_cap
+        self.level_sampling = level_sampling
+        self.restart_on_finish = restart_on_finish
+        self.num_repeats = num_repeats
+
+        ###########
+        # PLAYERS #
+        ###########
+        self.player_code_mapping = self.config["OBJECT_INFO"]["PLAYERS"]["PLAYER_CODE_MAPPING"]
+        self.players = list(self.player_code_mapping.keys())
+        self.player_codes = list(self.player_code_mapping.values())
+        self.max_health = np.array([self.object_records[c].health for c in self.player_codes])
+        self.max_action_points = np.array([self.object_records[c].action_points for c in self.player_codes])
+        self.sight_ranges = {self.object_records[c].name: self.object_records[c].sight_range for c in self.player_codes}
+        # Enemy kinds are indexed in this order everywhere (enemy_kind array, player dice table)
+        self.enemy_kinds = ["Monster", "Trap", "Stone"]
+        self.player_dice = np.array([[[self.object_records[c].dice_rolls[k.upper()]["VAL"],
+                                       self.object_records[c].dice_rolls[k.upper()]["CONST"]]
+                                      for k in self.enemy_kinds]
+                                     for c in self.player_codes])
+
+        ###########
+        # ACTIONS #
+        ###########
+        # Same ordering as the action map of DiceAdventurePythonEnv
+        self.directions = self.config["GAMEPLAY"]["ACTIONS"]["DIRECTIONS"]
+        self.valid_pin_types = self.config["GAMEPLAY"]["ACTIONS"]["VALID_PIN_TYPES"]
+        self.actions = list(self.directions) + ["wait", "submit"] + list(self.valid_pin_types) + ["undo"]
+        self.action_codes = {a: i for i, a in enumerate(self.actions)}
+        self.submit = self.action_codes["submit"]
+        self.pin_action_offset = self.action_codes[self.valid_pin_types[0]]
+        self.pin_codes = [self.config["OBJECT_INFO"]["OTHER"]["PIN"]["PIN_CODE_MAPPING"][t]
+                          for t in self.valid_pin_types]
+        self.is_direction = np.array([a in self.directions for a in self.actions])
+        self.is_pin_type = np.array([a in self.valid_pin_types for a in self.actions])
+        self.is_pin_action = np.array([a in self.config["GAMEPLAY"]["ACTIONS"]["VALID_PIN_ACTIONS"] or
+                                       a in self.valid_pin_types for a in self.actions])
+        self.is_move_action = np.array([a in self.config["GAMEPLAY"]["ACTIONS"]["VALID_MOVE_ACTIONS"]
+                                        for a in self.actions])
+        moves = {"left": (-1, 0), "right": (1, 0), "up": (0, 1), "down": (0, -1)}
+        self.dx = np.array([moves.get(a, (0, 0))[0] for a in self.actions])
+        self.dy = np.array([moves.get(a, (0, 0))[1] for a in self.actions])
+
+        ##########
+        # LEVELS #
+        ##########
+        self.limit_levels = limit_levels if limit_levels \
+            else [int(i) for i in list(self.config["GAMEPLAY"]["LEVELS"].keys())]
+        self.levels = self.get_levels()
+        self.level_nums = list(self.levels.keys())
+        self.level_index = {k: i for i, k in enumerate(self.level_nums)}
+        self.start_level = level if level in self.limit_levels else self.limit_levels[0]
+        self.height = max([lvl["height"] for lvl in self.levels.values()])
+        self.width = max([lvl["width"] for lvl in self.levels.values()])
+        self.max_enemies = max([1] + [len(lvl["enemy_x"]) for lvl in self.levels.values()])
+        self.max_plan_length = int(self.max_action_points.max())
+
+        ###############
+        # OBSERVATION #
+        ###############
+        self.observation_object_positions = self.config["GYM_ENVIRONMENT"]["OBSERVATION"]["OBJECT_POSITIONS"]
+        self.num_object_types = len(set(self.observation_object_positions.values()))
+        self.mask_size = max(self.sight_ranges.values()) * 2 + 1
+        self.observation_length = self.mask_size * self.mask_size * self.num_object_types * 4 + 6
+
+        self._allocate()
+        self.reset()
+
+    #################
+    # LEVEL CONTROL #
+    #################
+
+    def get_levels(self):
+        """
+        Compiles every level in limit_levels into arrays describing the walls, fixed objects and starting positions.
+        Objects are enumerated in the same order Board creates them so enemy slots follow object creation order.
+        :return: Dict of level number to compiled level
+        """
+        levels = {}
+        for k, v in self.config["GAMEPLAY"]["LEVELS"].items():
+            if int(k) not in self.limit_levels:
+                continue
+            # This makes sure positions are indexed with origin at "bottom left"
+            grid = [[row[i:i + 2] for i in range(0, len(row), 2)] for row in reversed(v.strip().split("\n"))]
+            height, width = len(grid), len(grid[0])
+            lvl = {"height": height, "width": width,
+                   "wall": np.zeros((height, width), dtype=bool), "static": np.zeros((height, width), dtype=bool),
+                   "start": np.zeros((3, 2), dtype=int), "shrine": np.zeros((3, 2), dtype=int), "tower": (0, 0),
+                   "enemy_x": [], "enemy_y": [], "enemy_kind": [], "enemy_obs_type": [],
+                   "enemy_val": [], "enemy_const": [], "enemy_ap": [], "enemy_code": [], "enemy_index": []}
+            counts = {}
+            for y in range(height):
+                for x in range(width):
+                    code = grid[y][x]
+                    counts[code] = counts.get(code, 0) + 1
+                    if code == "##":
+                        lvl["wall"][y, x] = True
+                    elif code == "..":
+                        continue
+                    elif code == "**":
+                        lvl["static"][y, x] = True
+                        lvl["tower"] = (x, y)
+                    elif code[1] == "G":
+                        lvl["static"][y, x] = True
+                        lvl["shrine"][self.player_codes.index(code[0] + "S")] = (x, y)
+                    elif code[1] == "S" and code[0].isdigit():
+                        lvl["start"][self.player_codes.index(code)] = (x, y)
+                    else:
+                        record = self.object_records[code]
+                        lvl["enemy_x"].append(x)
+                        lvl["enemy_y"].append(y)
+                        lvl["enemy_kind"].append(self.enemy_kinds.index(record.name))
+                        lvl["enemy_obs_type"].append(self.config["GYM_ENVIRONMENT"]["OBSERVATION"]
+                                                     ["OBJECT_POSITIONS"][record.type])
+                        lvl["enemy_val"].append(record.dice_rolls["VAL"])
+                        lvl["enemy_const"].append(record.dice_rolls["CONST"])
+                        lvl["enemy_ap"].append(record.action_points or 0)
+                        lvl["enemy_code"].append(code)
+                        lvl["enemy_index"].append(code + (f"({counts[code]})" if counts[code] > 1 else ""))
+            levels[int(k)] = lvl
+        return levels
+
+    def _allocate(self):
+        n, h, w, e, a = self.num_games, self.height, self.width, self.max_enemies, self.max_plan_length
+        # Game
+        self.curr_level_num = np.zeros(n, dtype=int)
+        self.lvl_repeats = np.zeros((n, len(self.level_nums)), dtype=int)
+        self.phase_num = np.zeros(n, dtype=int)
+        self.num_rounds = np.zeros(n, dtype=int)
+        self.terminated = np.zeros(n, dtype=bool)
+        self.restart_on_team_loss = np.zeros(n, dtype=bool)
+        # Board
+        self.board_level = np.zeros(n, dtype=int)
+        self.board_width = np.zeros(n, dtype=int)
+        self.board_height = np.zeros(n, dtype=int)
+        self.wall = np.zeros((n, h, w), dtype=bool)
+        self.static = np.zeros((n, h, w), dtype=bool)
+        self.shrine_x = np.zeros((n, 3), dtype=int)
+        self.shrine_y = np.zeros((n, 3), dtype=int)
+        self.tower_x = np.zeros(n, dtype=int)
+        self.tower_y = np.zeros(n, dtype=int)
+        self.subgoal_count = np.zeros(n, dtype=int)
+        # Players. A player can be listed in more than one cell (the board does not clear the old cell when a player
+        # is respawned or pushed back), so cell membership is tracked separately from the player's position
+        self.x = np.zeros((n, 3), dtype=int)
+        self.y = np.zeros((n, 3), dtype=int)
+        self.start_x = np.zeros((n, 3), dtype=int)
+        self.start_y = np.zeros((n, 3), dtype=int)
+        self.player_cells = np.zeros((n, 3, h, w), dtype=bool)
+        self.action_points = np.zeros((n, 3), dtype=int)
+        self.health = np.zeros((n, 3), dtype=int)
+        self.dead = np.zeros((n, 3), dtype=bool)
+        self.death_round = np.full((n, 3), -1, dtype=int)
+        self.goal_reached = np.zeros((n, 3), dtype=bool)
+        # Pin cursor. -1 stands for None
+        self.pin_x = np.zeros((n, 3), dtype=int)
+        self.pin_y = np.zeros((n, 3), dtype=int)
+        self.placed_pin = np.zeros((n, 3), dtype=bool)
+        self.pin_finalized = np.zeros((n, 3), dtype=bool)
+        # Action plans
+        self.plan = np.zeros((n, 3, a), dtype=int)
+        self.plan_x = np.zeros((n, 3, a), dtype=int)
+        self.plan_y = np.zeros((n, 3, a), dtype=int)
+        self.plan_length = np.zeros((n, 3), dtype=int)
+        self.path_x = np.zeros((n, 3), dtype=int)
+        self.path_y = np.zeros((n, 3), dtype=int)
+        self.plan_finalized = np.zeros((n, 3), dtype=bool)
+        # Enemies, one slot per enemy in object creation order
+        self.enemy_x = np.zeros((n, e), dtype=int)
+        self.enemy_y = np.zeros((n, e), dtype=int)
+        self.enemy_alive = np.zeros((n, e), dtype=bool)
+        self.enemy_kind = np.zeros((n, e), dtype=int)
+        self.enemy_obs_type = np.zeros((n, e), dtype=int)
+        self.enemy_val = np.zeros((n, e), dtype=int)
+        self.enemy_const = np.zeros((n, e), dtype=int)
+        self.enemy_ap = np.zeros((n, e), dtype=int)
+        self.enemy_count = np.zeros((n, h, w), dtype=int)
+        # Stones and traps block monster movement
+        self.blocker_count = np.zeros((n, h, w), dtype=int)
+        # Pins. Only the most recent pin of each type is registered with the board and removed after planning,
+        # older pins of the same type stay in their cell until the level is reset
+        self.pin_cells = np.zeros((n, 4, h, w), dtype=bool)
+        self.pin_owner = np.zeros((n, 4, h, w), dtype=int)
+        self.pin_registered = np.zeros((n, 4), dtype=bool)
+        self.pin_registered_x = np.zeros((n, 4), dtype=int)
+        self.pin_registered_y = np.zeros((n, 4), dtype=int)
+        # Game data seen by the last reward computation
+        self.prev_level = np.zeros(n, dtype=int)
+        self.prev_num_repeats = np.zeros(n, dtype=int)
+
+    def reset(self, games=None):
+        """
+        Starts the given games over from the initial level. Each game keeps its random stream.
+        :param games: Boolean mask or index array of games to reset. Defaults to all games
+        :return: N/A
+        """
+        g = self._indices(games)
+        self.curr_level_num[g] = self.start_level
+        self.lvl_repeats[g] = self.num_repeats
+        self.terminated[g] = False
+        self.restart_on_team_loss[g] = False
+        self.load_level(g)
+        self.prev_level[g], self.prev_num_repeats[g] = self.curr_level_num[g], self.get_num_repeats()[g]
+
+    def load_level(self, g):
+        """
+        Rebuilds the board of the given games from their current level
+        :param g: Index array of games
+        :return: N/A
+        """
+        for level_num in np.unique(self.curr_level_num[g]):
+            gl = g[self.curr_level_num[g] == level_num]
+            lvl = self.levels[int(level_num)]
+            h, w, e = lvl["height"], lvl["width"], len(lvl["enemy_x"])
+            # Board
+            self.board_level[gl] = level_num
+            self.board_width[gl] = w
+            self.board_height[gl] = h
+            self.wall[gl] = False
+            self.wall[gl, :h, :w] = lvl["wall"]
+            self.static[gl] = False
+            self.static[gl, :h, :w] = lvl["static"]
+            self.shrine_x[gl] = lvl["shrine"][:, 0]
+            self.shrine_y[gl] = lvl["shrine"][:, 1]
+            self.tower_x[gl], self.tower_y[gl] = lvl["tower"]
+            self.subgoal_count[gl] = 0
+            # Players
+            self.x[gl] = self.start_x[gl] = self.pin_x[gl] = lvl["start"][:, 0]
+            self.y[gl] = self.start_y[gl] = self.pin_y[gl] = lvl["start"][:, 1]
+            self.player_cells[gl] = False
+            for p in range(3):
+                self.player_cells[gl, p, lvl["start"][p, 1], lvl["start"][p, 0]] = True
+            self.action_points[gl] = self.max_action_points
+            self.health[gl] = self.max_health
+            self.dead[gl] = False
+            self.death_round[gl] = -1
+            self.goal_reached[gl] = False
+            self.placed_pin[gl] = False
+            self.pin_finalized[gl] = False
+            self.plan_length[gl] = 0
+            self.plan_finalized[gl] = False
+            # Enemies
+            self.enemy_alive[gl] = False
+            self.enemy_alive[gl, :e] = True
+            for name in ["enemy_x", "enemy_y", "enemy_kind", "enemy_obs_type",
+                         "enemy_val", "enemy_const", "enemy_ap"]:
+                getattr(self, name)[gl, :e] = lvl[name]
+            self.enemy_count[gl] = 0
+            self.blocker_count[gl] = 0
+            self.enemy_count[gl, :h, :w] = self._enemy_grid(lvl, h, w, range(3))
+            self.blocker_count[gl, :h, :w] = self._enemy_grid(lvl, h, w, [1, 2])
+            # Pins
+            self.pin_cells[gl] = False
+            self.pin_registered[gl] = False
+        self.phase_num[g] = 0
+        self.num_rounds[g] = 0
+
+    @staticmethod
+    def _enemy_grid(lvl, h, w, kinds):
+        grid = np.zeros((h, w), dtype=int)
+        for x, y, kind in zip(lvl["enemy_x"], lvl["enemy_y"], lvl["enemy_kind"]):
+            if kind in kinds:
+                grid[y, x] += 1
+        return grid
+
+    def next_level(self, g):
+        """
+        Moves the given games to the next level or repeats the same level
+        :param g: Index array of games
+        :return: N/A
+        """
+        if not len(g):
+            return
+        # Don't change anything if restarting level due to whole team dying
+        advance = g[~self.restart_on_team_loss[g]]
+        eligible = self.lvl_repeats[advance] >= 0
+        # Games with no eligible level left are over and keep their board
+        over = advance[~eligible.any(1)]
+        advance, eligible = advance[eligible.any(1)], eligible[eligible.any(1)]
+
+        prev_level = self.curr_level_num[advance]
+        if self.level_sampling:
+            for i, elig in zip(advance, eligible):
+                self.curr_level_num[i] = self.rngs[i].choice([k for k, e in zip(self.level_nums, elig) if e])
+        else:
+            self.curr_level_num[advance] += 1
+        known = np.isin(self.curr_level_num[advance], self.level_nums)
+        idx = np.array([self.level_index.get(int(k), 0) for k in self.curr_level_num[advance]], dtype=int)
+        self.lvl_repeats[advance[known], idx[known]] -= 1
+        # If finished final level and set to restart, go back to first level
+        if not self.level_sampling:
+            finished = (self.curr_level_num[advance] > len(self.levels)) | ~known
+            if self.restart_on_finish:
+                self.curr_level_num[advance[finished]] = self.limit_levels[0]
+            else:
+                # Levels past the last configured one can not be reported, so those games stay on their last level
+                self.curr_level_num[advance[~known]] = prev_level[~known]
+                over = np.concatenate((over, advance[finished]))
+        self.terminated[over] = True
+        self.load_level(np.setdiff1d(g, over))
+
+    def get_num_repeats(self):
+        idx = np.array([self.level_index[int(k)] for k in self.curr_level_num], dtype=int)
+        return self.num_repeats - self.lvl_repeats[np.arange(self.num_games), idx]
+
+    ###########################
+    # GET STATE & SEND ACTION #
+    ###########################
+
+    def execute_action(self, player, actions):
+        """
+        Applies one action per game to the given player.
+        :param player: The player to apply actions to
+        :param actions: Array of action indices (DiceAdventurePythonEnv action map) or action names, one per game
+        :return: N/A
+        """
+        p = self.players.index(player)
+        actions = self._action_codes(actions)
+        g = np.arange(self.num_games)
+        pinning = self.phase_num == 0
+        planning = self.phase_num == 1
+        self.pin_planning(p, g[pinning], actions[pinning])
+        self.action_planning(p, g[planning], actions[planning])
+
+    def step(self, player, actions, teammate_actions=None):
+        """
+        Batched equivalent of DiceAdventurePythonEnv.step for a local game. Applies the player's actions, computes
+        rewards, plays the teammates' actions and resets terminated games.
+        :param player: The player controlled by the agent
+        :param actions: Array of actions for the player, one per game
+        :param teammate_actions: Optional dict of teammate name to array of actions
+        :return: observations, rewards, terminated
+        """
+        p = self.players.index(player)
+        actions = self._action_codes(actions)
+        x, y, health = self.x[:, p].copy(), self.y[:, p].copy(), self.health[:, p].copy()
+        self.execute_action(player, actions)
+        rewards = self._get_rewards(p, x, y, health)
+
+        if teammate_actions:
+            for other in self.players:
+                if other != player:
+                    # Teammates follow a submit, as in DiceAdventurePythonEnv.play_others
+                    other_actions = self._action_codes(teammate_actions[other])
+                    self.execute_action(other, np.where(actions == self.submit, self.submit, other_actions))
+
+        terminated = self.terminated.copy()
+        self.reset(terminated)
+        return self.get_observation(player), rewards, terminated
+
+    def _get_rewards(self, p, x, y, health):
+        """
+        Computes the rewards of DiceAdventurePythonEnv.get_reward for every game. Shrines are never marked as reached
+        by the engine, so goals only pay out once the level changes or repeats.
+        :param p: The player index
+        :param x: Player x positions before the action
+        :param y: Player y positions before the action
+        :param health: Player health before the action
+        :return: Array of rewards
+        """
+        num_repeats = self.get_num_repeats()
+        new_level = self.curr_level_num != self.prev_level
+        r = np.zeros(self.num_games)
+        # Player getting goal
+        r += new_level | (num_repeats > self.prev_num_repeats)
+        # Players getting to tower after getting all goals
+        r += new_level
+        # Player losing health
+        r -= .2 * ((health < self.health[:, p]) | self.dead[:, p])
+        # Player not moving
+        r -= .1 * ((x == self.x[:, p]) & (y == self.y[:, p]))
+        self.prev_level[:], self.prev_num_repeats[:] = self.curr_level_num, num_repeats
+        return r
+
+    def get_observation(self, player, mask_radius=None):
+        """
+        Constructs the observation vector of DiceAdventurePythonEnv.get_observation for every game.
+        :param player: The player to observe from
+        :param mask_radius: Radius of the observed neighbourhood. Defaults to the player's sight range
+        :return: Array of shape (num_games, observation_length)
+        """
+        p = self.players.index(player)
+        r = self.sight_ranges[player] if mask_radius is None else mask_radius
+        obs = np.zeros((self.num_games, self.observation_length), dtype=np.float32)
+        g = np.arange(self.num_games)
+        px, py = self.x[:, p], self.y[:, p]
+        positions = self.observation_object_positions
+
+        def mark(gi, ox, oy, obj_type, version):
+            # Objects on the x == 0 or y == 0 lines are left out of the observation, as in the scene based version
+            keep = (ox != 0) & (oy != 0) & (np.abs(ox - px[gi]) <= r) & (np.abs(oy - py[gi]) <= r)
+            cell = (ox - px[gi] + r) * self.mask_size + (oy - py[gi] + r)
+            obs[gi[keep], ((cell * self.num_object_types + obj_type) * 4 + version)[keep]] = 1
+
+        # Neighbourhood of the player
+        offsets = np.arange(-r, r + 1)
+        wx = (px[:, None] + np.repeat(offsets, len(offsets))[None, :])
+        wy = (py[:, None] + np.tile(offsets, len(offsets))[None, :])
+        inside = (wx >= 0) & (wx < self.board_width[:, None]) & (wy >= 0) & (wy < self.board_height[:, None])
+        wg = np.broadcast_to(g[:, None], wx.shape)[inside]
+        wx, wy = wx[inside], wy[inside]
+        # Walls
+        w = self.wall[wg, wy, wx]
+        mark(wg[w], wx[w], wy[w], positions["wall"], 0)
+        # Pins
+        pins = self.pin_cells[wg, :, wy, wx]
+        k, c = np.nonzero(pins)
+        mark(wg[k], wx[k], wy[k], positions["pin"], c)
+        # Shrines and tower
+        for q in range(3):
+            mark(g, self.shrine_x[:, q], self.shrine_y[:, q], positions["shrine"], 0)
+        mark(g, self.tower_x, self.tower_y, positions["goal"], 0)
+        # Players
+        for q, name in enumerate(self.players):
+            mark(g, self.x[:, q], self.y[:, q], positions[name], 0)
+        # Enemies. The scene based version matches enemy types against "(monster|trap|stone)" from the start of the
+        # type (e.g. "s_monster"), which never succeeds, so every enemy size shares version 0
+        gi, e = np.nonzero(self.enemy_alive)
+        mark(gi, self.enemy_x[gi, e], self.enemy_y[gi, e], self.enemy_obs_type[gi, e], 0)
+
+        # Player state variables. Shrines are never marked as reached
+        obs[:, -6] = self.action_points[:, p]
+        obs[:, -5] = self.health[:, p]
+        obs[:, -4] = self.dead[:, p]
+        obs[:, -3] = 0
+        obs[:, -2] = np.maximum(self.pin_x[:, p], 0)
+        obs[:, -1] = np.maximum(self.pin_y[:, p], 0)
+        return obs
+
+    def get_state(self, i):
+        """
+        Constructs the state representation of DiceAdventure.get_state for a single game. Scene entries are listed
+        cell by cell, but not necessarily in the same order within a cell.
+        :param i: The game index
+        :return: Dict
+        """
+        lvl = self.levels[int(self.board_level[i])]
+        scene = []
+        for y in range(lvl["height"]):
+            for x in range(lvl["width"]):
+                if self.wall[i, y, x]:
+                    scene.append({"name": "Wall", "type": "wall", "x": x, "y": y})
+                    continue
+                if (x, y) == (self.tower_x[i], self.tower_y[i]):
+                    scene.append({"name": "Tower", "type": "goal", "x": x, "y": y,
+                                  "subgoalCount": int(self.subgoal_count[i])})
+                for q in range(3):
+                    if (x, y) == (self.shrine_x[i, q], self.shrine_y[i, q]):
+                        scene.append({"name": "Shrine", "type": "shrine", "x": x, "y": y,
+                                      "reached": False, "character": self.players[q]})
+                for q in np.flatnonzero(self.player_cells[i, :, y, x]):
+                    scene.append(self._player_state(i, q))
+                for e in np.flatnonzero(self.enemy_alive[i] & (self.enemy_x[i] == x) & (self.enemy_y[i] == y)):
+                    code = lvl["enemy_code"][e]
+                    ele = {"name": lvl["enemy_index"][e], "type": self.object_records[code].type,
+                           "x": int(self.enemy_x[i, e]), "y": int(self.enemy_y[i, e]),
+                           "combatDice": self.object_records[code].dice}
+                    if self.enemy_kind[i, e] == 0:
+                        ele["actionPoints"] = self.object_records[code].action_points
+                    scene.append(ele)
+                for c in np.flatnonzero(self.pin_cells[i, :, y, x]):
+                    scene.append({"name": self.pin_codes[c], "type": "pin", "x": x, "y": y,
+                                  "placedBy": self.players[self.pin_owner[i, c, y, x]]})
+        return {
+            "command": "get_state",
+            "status": "OK" if not self.terminated[i] else "Done",
+            "message": "Full State",
+            "content": {
+                "gameData": {
+                    "boardWidth": lvl["width"],
+                    "boardHeight": lvl["height"],
+                    "level": int(self.curr_level_num[i]),
+                    "num_repeats": int(self.get_num_repeats()[i]),
+                    "currentPhase": self.config["GAMEPLAY"]["PHASES"]["PHASE_LIST"][self.phase_num[i]],
+                },
+                "scene": scene
+            }
+        }
+
+    def _player_state(self, i, q):
+        dice = self.object_records[self.player_codes[q]].dice
+        return {"name": self.players[q], "type": self.players[q], "x": int(self.x[i, q]), "y": int(self.y[i, q]),
+                "characterId": int(self.player_codes[q][0]),
+                "pinCursorX": int(self.pin_x[i, q]) if self.pin_x[i, q] >= 0 else None,
+                "pinCursorY": int(self.pin_y[i, q]) if self.pin_y[i, q] >= 0 else None,
+                "sightRange": self.sight_ranges[self.players[q]],
+                "monsterDice": dice["MONSTER"],
+                "trapDice": dice["TRAP"],
+                "stoneDice": dice["STONE"],
+                "health": int(self.health[i, q]),
+                "dead": bool(self.dead[i, q]),
+                "actionPoints": int(self.action_points[i, q]),
+                "actionPlan": [self.actions[a] for a in self.plan[i, q, :self.plan_length[i, q]]],
+                "action_plan_finalized": bool(self.plan_finalized[i, q])}
+
+    def check_player_status(self, g):
+        """
+        Checks whether players are dead or alive and respawn players if enough game cycles have passed
+        :param g: Index array of games
+        :return: N/A
+        """
+        # If all players have died, reset level
+        wiped = self.dead[g].all(1)
+        self.restart_on_team_loss[g[wiped]] = True
+        self.next_level(g[wiped])
+        # Otherwise, check if players need respawning
+        g = g[~wiped]
+        for p in range(3):
+            r = g[self.dead[g, p] & (self.num_rounds[g] - self.death_round[g, p] >= self.respawn_wait)]
+            self.dead[r, p] = False
+            self.death_round[r, p] = -1
+            self.health[r, p] = self.max_health[p]
+            self._place_player(r, p, self.start_x[r, p], self.start_y[r, p])
+
+    ##############################
+    # PHASE PLANNING & EXECUTION #
+    ##############################
+
+    def pin_planning(self, p, g, a):
+        """
+        Executes logic for the pin planning phase.
+        :param p: The player index
+        :param g: Index array of games in the pinning phase
+        :param a: Array of action codes
+        :return: N/A
+        """
+        valid = ~self.dead[g, p] & self.is_pin_action[a] & ~self.pin_finalized[g, p]
+        g, a = g[valid], a[valid]
+        self.pin_finalized[g[a == self.submit], p] = True
+        # Can only take action if player has enough action points
+        has_points = self.action_points[g, p] > 0
+        # Move pin cursor
+        d = has_points & self.is_direction[a]
+        gd = g[d]
+        self.pin_x[gd, p], self.pin_y[gd, p] = self._update_location_by_direction(gd, a[d], self.pin_x[gd, p],
+                                                                                  self.pin_y[gd, p])
+        # Place new pin
+        t = has_points & self.is_pin_type[a]
+        gt, codes = g[t], a[t] - self.pin_action_offset
+        self.pin_cells[gt, codes, self.pin_y[gt, p], self.pin_x[gt, p]] = True
+        self.pin_owner[gt, codes, self.pin_y[gt, p], self.pin_x[gt, p]] = p
+        self.pin_registered[gt, codes] = True
+        self.pin_registered_x[gt, codes] = self.pin_x[gt, p]
+        self.pin_registered_y[gt, codes] = self.pin_y[gt, p]
+        self.placed_pin[gt, p] = True
+        self.action_points[gt, p] -= 1
+        # Reset pin_x and pin_y location to player position
+        self.pin_x[gt, p] = self.x[gt, p]
+        self.pin_y[gt, p] = self.y[gt, p]
+        # If player is out of action points and has placed a pin, they are forced to submit
+        self.pin_finalized[g[self.placed_pin[g, p] & (self.action_points[g, p] <= 0)], p] = True
+        self.check_phase(g)
+
+    def action_planning(self, p, g, a):
+        """
+        Executes logic for the action planning phase.
+        :param p: The player index
+        :param g: Index array of games in the planning phase
+        :param a: Array of action codes
+        :return: N/A
+        """
+        valid = ~self.dead[g, p] & self.is_move_action[a] & ~self.plan_finalized[g, p]
+        g, a = g[valid], a[valid]
+        # Set init values of action plan
+        empty = g[self.plan_length[g, p] == 0]
+        self.path_x[empty, p] = self.x[empty, p]
+        self.path_y[empty, p] = self.y[empty, p]
+        self.plan_finalized[g[a == self.submit], p] = True
+        # Test whether action supplied by agent was a valid move
+        moving = (a != self.submit) & (self.action_points[g, p] > 0)
+        gm, am = g[moving], a[moving]
+        x, y = self.path_x[gm, p], self.path_y[gm, p]
+        ok = self._occupied(gm, x + self.dx[am], y + self.dy[am])
+        gm, am, x, y = gm[ok], am[ok], x[ok], y[ok]
+        new_x, new_y = self._update_location_by_direction(gm, am, x, y)
+        step = self.plan_length[gm, p]
+        self.plan[gm, p, step] = am
+        self.plan_x[gm, p, step] = new_x
+        self.plan_y[gm, p, step] = new_y
+        self.plan_length[gm, p] += 1
+        self.path_x[gm, p], self.path_y[gm, p] = new_x, new_y
+        self.action_points[gm, p] -= 1
+        # Invalid moves are a no-op and do not check the phase
+        self.check_phase(np.setdiff1d(g, g[moving][~ok]))
+
+    def check_phase(self, g):
+        """
+        Checks whether conditions have been met to end the current phase and apply the actions of the current phase.
+        :param g: Index array of games
+        :return: N/A
+        """
+        pins_done = g[(self.phase_num[g] == 0) & (self.pin_finalized[g] | self.dead[g]).all(1)]
+        plans_done = g[(self.phase_num[g] == 1) & (self.plan_finalized[g] | self.dead[g]).all(1)]
+
+        # Need to end pinning phase, place pins, and begin planning phase
+        self.pin_x[pins_done] = -1
+        self.pin_y[pins_done] = -1
+        self.pin_finalized[pins_done] = False
+        self.update_phase(pins_done)
+
+        # Update phase to player execution
+        self.update_phase(plans_done)
+        won = self.execute_plans(plans_done)
+        self.next_level(plans_done[won])
+        # Change to enemy execution phase
+        rest = plans_done[~won]
+        self.update_phase(rest)
+        # Remove pins and reset player values
+        self._remove_pins(rest)
+        self.pin_x[rest] = self.x[rest]
+        self.pin_y[rest] = self.y[rest]
+        self.placed_pin[rest] = False
+        self.pin_finalized[rest] = False
+        self.plan_length[rest] = 0
+        self.plan_finalized[rest] = False
+
+    def update_phase(self, g):
+        """
+        Moves the given games to the next phase.
+        :param g: Index array of games
+        :return: N/A
+        """
+        if not len(g):
+            return
+        self.phase_num[g] = (self.phase_num[g] + 1) % 4
+        # Check if players need respawning
+        self.check_player_status(g)
+        # Trigger enemy movement
+        enemy = g[self.phase_num[g] == 3]
+        if len(enemy):
+            self.execute_enemy_plans(enemy)
+            self.num_rounds[enemy] += 1
+            # If a cap has been placed on the number of rounds per level and that cap has been exceeded,
+            # move on to next level
+            if self.round_cap:
+                self.next_level(enemy[self.num_rounds[enemy] > self.round_cap])
+
+    def execute_plans(self, g):
+        """
+        Executes plans for each player by iterating over team until no actions remain in their plans.
+        :param g: Index array of games
+        :return: Boolean array, True where the team reached the tower
+        """
+        won = np.zeros(len(g), dtype=bool)
+        if not len(g):
+            return won
+        max_moves = self.plan_length[g].max(1)
+        for i in range(max_moves.max()):
+            for p in range(3):
+                idx = np.flatnonzero(~won & ~self.dead[g, p] & (i < self.plan_length[g, p]))
+                gm = g[idx]
+                self._move_player(gm, p, self.plan[gm, p, i])
+                # Check if player has reached goal
+                at_goal = ~self.goal_reached[gm, p] & (self.x[gm, p] == self.shrine_x[gm, p]) \
+                    & (self.y[gm, p] == self.shrine_y[gm, p])
+                self.goal_reached[gm[at_goal], p] = True
+                self.subgoal_count[gm[at_goal]] += 1
+                # Check if player has reached tower
+                won[idx[(self.x[gm, p] == self.tower_x[gm]) & (self.y[gm, p] == self.tower_y[gm])
+                        & self.goal_reached[gm, p]]] = True
+            # CHECK IF PLAYER AND MONSTER/TRAP/STONE IN SAME AREA AFTER
+            # EACH PASS OF EACH CHARACTER MOVES
+            self.check_combat(g[~won & (i < max_moves)], i)
+        return won
+
+    def execute_enemy_plans(self, g):
+        """
+        Executes plans for enemy monsters by iterating over enemy team until no actions remain in their plans.
+        :param g: Index array of games
+        :return: N/A
+        """
+        active = g[(self.enemy_alive[g] & (self.enemy_kind[g] == 0)).any(1)]
+        move_count = 0
+        while len(active):
+            movers = self.enemy_alive[active] & (self.enemy_kind[active] == 0) \
+                & (move_count < self.enemy_ap[active])
+            for e in range(self.max_enemies):
+                self._move_monster(active[movers[:, e]], e)
+            # Check to see if combat needs to be initiated
+            self.check_combat(active)
+            active = active[movers.any(1)]
+            move_count += 1
+        self.update_phase(g)
+
+    ##########
+    # COMBAT #
+    ##########
+
+    def check_combat(self, g, step_index=None):
+        """
+        Checks if players and enemies are co-located which would initiate combat
+        :param g: Index array of games
+        :param step_index: Determines the position in the action sequence
+        :return: N/A
+        """
+        if not len(g):
+            return
+        x, y = self.x[g], self.y[g]
+        for p in range(3):
+            # Each location is only checked once, in player order
+            first = np.ones(len(g), dtype=bool)
+            for q in range(p):
+                first &= (x[:, q] != x[:, p]) | (y[:, q] != y[:, p])
+            gl, lx, ly = g[first], x[first, p], y[first, p]
+            players = self.player_cells[gl, :, ly, lx]
+            enemies = self.enemy_alive[gl] & (self.enemy_x[gl] == lx[:, None]) & (self.enemy_y[gl] == ly[:, None])
+            fight = players.any(1) & enemies.any(1)
+            self.combat(gl[fight], players[fight], enemies[fight], step_index)
+
+    def combat(self, g, players, enemies, step_index):
+        """
+        Executes combat logic for the players and enemies sharing a location in each game
+        :param g: Index array of games
+        :param players: Boolean array (games x players) of players at the location
+        :param enemies: Boolean array (games x enemy slots) of enemies at the location
+        :param step_index: Determines the position in the action sequence
+        :return: N/A
+        """
+        if not len(g):
+            return
+        # Enemies are always all the same type
+        kind = self.enemy_kind[g, enemies.argmax(1)]
+        # Dice of every combatant, players first and then enemy slots, which is the order DiceAdventure rolls them in
+        vals = np.concatenate([self.player_dice[:, kind, 0].T, self.enemy_val[g]], 1)
+        consts = np.concatenate([self.player_dice[:, kind, 1].T, self.enemy_const[g]], 1)
+        rolling = np.concatenate([players, enemies], 1)
+        rolls = np.where(rolling, self._roll(g, rolling) * vals, 0).astype(int) + np.where(rolling, consts, 0)
+        player_rolls = rolls[:, :3].sum(1)
+        enemy_rolls = rolls[:, 3:].sum(1)
+
+        # Players win (players win ties)
+        win = player_rolls >= enemy_rolls
+        self._remove_enemies(g[win], enemies[win])
+        # Players lose
+        g, players, enemies, kind = g[~win], players[~win], enemies[~win], kind[~win]
+        for p in range(3):
+            hit = players[:, p]
+            # Monsters and traps cost a heart
+            self.health[g[hit & (kind != 2)], p] -= 1
+            if step_index:
+                # Go back a step if player has moved
+                pushed = g[hit & (kind == 0) & (self.plan_length[g, p] > 0)]
+                self.plan_length[pushed, p] = 0
+                self._place_player(pushed, p, self.plan_x[pushed, p, step_index - 1],
+                                   self.plan_y[pushed, p, step_index - 1])
+                # Truncate action plan
+                self.plan_length[g[hit & (kind != 0)], p] = 0
+            # If player dies, remove from board
+            died = g[hit & (self.health[g, p] <= 0)]
+            self.health[died, p] = 0
+            self.dead[died, p] = True
+            self.death_round[died, p] = self.num_rounds[died]
+        # Traps are destroyed
+        self._remove_enemies(g[kind == 1], enemies[kind == 1])
+
+    def _roll(self, g, rolling):
+        """
+        Takes one uniform value per rolled die from the dice block of each game. Like DiceRoller.roll(), a game draws a
+        new block when its current one can not supply all of its dice.
+        :param g: Index array of games
+        :param rolling: Boolean array (games x dice) of dice to roll
+        :return: Array (games x dice) of uniform values, undefined where no die is rolled
+        """
+        n = rolling.sum(1)
+        for i in g[self.dice_position[g] + n > BLOCK_SIZE]:
+            self.dice_blocks[i] = self.dice_generators[i].random(BLOCK_SIZE)
+            self.dice_position[i] = 0
+        index = self.dice_position[g][:, None] + np.maximum(rolling.cumsum(1) - 1, 0)
+        self.dice_position[g] += n
+        return self.dice_blocks[g[:, None], index]
+
+    ###########
+    # HELPERS #
+    ###########
+
+    def _indices(self, games):
+        if games is None:
+            return np.arange(self.num_games)
+        games = np.asarray(games)
+        return np.flatnonzero(games) if games.dtype == bool else games
+
+    def _action_codes(self, actions):
+        actions = np.asarray(actions)
+        if actions.dtype.kind in "US":
+            return np.array([self.action_codes[a] for a in actions], dtype=int)
+        return actions.astype(int)
+
+    def _occupied(self, g, x, y):
+        """
+        Checks whether the given cells are valid positions for movement/placement, i.e. inside the board and not empty
+        """
+        inside = (x >= 0) & (x < self.board_width[g]) & (y >= 0) & (y < self.board_height[g])
+        x, y = np.clip(x, 0, self.width - 1), np.clip(y, 0, self.height - 1)
+        return inside & (self.static[g, y, x] | (self.enemy_count[g, y, x] > 0) |
+                         self.player_cells[g, :, y, x].any(-1) | self.pin_cells[g, :, y, x].any(-1))
+
+    def _update_location_by_direction(self, g, a, x, y, avoid_blockers=False):
+        new_x, new_y = x + self.dx[a], y + self.dy[a]
+        valid = self.is_direction[a] & self._occupied(g, new_x, new_y)
+        if avoid_blockers:
+            valid &= self.blocker_count[g, np.clip(new_y, 0, self.height - 1), np.clip(new_x, 0, self.width - 1)] == 0
+        return np.where(valid, new_x, x), np.where(valid, new_y, y)
+
+    def _move_player(self, g, p, a):
+        x, y = self.x[g, p], self.y[g, p]
+        new_x, new_y = self._update_location_by_direction(g, a, x, y)
+        moved = (new_x != x) | (new_y != y)
+        g, x, y, new_x, new_y = g[moved], x[moved], y[moved], new_x[moved], new_y[moved]
+        self.player_cells[g, p, new_y, new_x] = True
+        self.player_cells[g, p, y, x] = False
+        self.x[g, p], self.y[g, p] = new_x, new_y
+
+    def _place_player(self, g, p, x, y):
+        # Placing without a previous position leaves the player listed in its old cell
+        self.player_cells[g, p, y, x] = True
+        self.x[g, p], self.y[g, p] = x, y
+
+    def _move_monster(self, g, e):
+        """
+        Random walk for monster slot e: directions are shuffled and tried from the back until one is valid
+        """
+        if not len(g):
+            return
+        order = np.zeros((len(g), len(self.directions)), dtype=int)
+        for j, i in enumerate(g):
+            directions = list(range(len(self.directions)))
+            self.rngs[i].shuffle(directions)
+            order[j] = directions
+        x, y = self.enemy_x[g, e], self.enemy_y[g, e]
+        new_x, new_y = x.copy(), y.copy()
+        moved = np.zeros(len(g), dtype=bool)
+        for k in range(len(self.directions) - 1, -1, -1):
+            nx, ny = self._update_location_by_direction(g, order[:, k], x, y, avoid_blockers=True)
+            ok = ~moved & ((nx != x) | (ny != y))
+            new_x[ok], new_y[ok] = nx[ok], ny[ok]
+            moved |= ok
+        g, x, y, new_x, new_y = g[moved], x[moved], y[moved], new_x[moved], new_y[moved]
+        self.enemy_count[g, y, x] -= 1
+        self.enemy_count[g, new_y, new_x] += 1
+        self.enemy_x[g, e], self.enemy_y[g, e] = new_x, new_y
+
+    def _remove_enemies(self, g, enemies):
+        k, e = np.nonzero(enemies)
+        gi = g[k]
+        np.subtract.at(self.enemy_count, (gi, self.enemy_y[gi, e], self.enemy_x[gi, e]), 1)
+        blockers = self.enemy_kind[gi, e] != 0
+        np.subtract.at(self.blocker_count, (gi[blockers], self.enemy_y[gi, e][blockers],
+                                            self.enemy_x[gi, e][blockers]), 1)
+        self.enemy_alive[gi, e] = False
+
+    def _remove_pins(self, g):
+        """
+        Removes the registered pins of the given games from the board
+        """
+        k, codes = np.nonzero(self.pin_registered[g])
+        g = g[k]
+        self.pin_cells[g, codes, self.pin_registered_y[g, codes], self.pin_registered_x[g, codes]] = False
+        self.pin_registered[g, codes] = False
@@ -1,8 +1,26 @@
-from copy import deepcopy
-from json import loads
+from copy import copy
+from itertools import count
+from random import Random
+from time import time_ns
+from classes.board import ArrayBoard
 from classes.board import Board
+from classes.config import get_object_records
+from classes.config import load_config
+from classes.dice import DiceRoller
+from classes.state_codec import get_state_codec
 from classes.game_objects import *
 from classes.metrics_tracker import GameMetricsTracker
+from classes.perf_stats import PerfStats
+
+# Levels compiled once per process, keyed by the level string from the config. Each entry holds the level layout and a
+# snapshot of a freshly built board (see DiceAdventure.get_levels())
+LEVEL_TEMPLATES = {}
+# State versions (see DiceAdventure.get_state_delta()) are drawn from one process-wide counter that starts at the time
+# the process started, so versions of different games, and of a restarted server, do not collide
+STATE_VERSIONS = count(time_ns())
+# Engine stages timed by instrumented games (see DiceAdventure.perf_stats())
+PERF_STAGES = ("execute_action", "check_phase", "execute_plans", "execute_enemy_plans", "check_combat", "next_level",
+               "get_state")
 
 
 class DiceAdventure:
@@ -16,25 +34,35 @@ class DiceAdventure:
                  render_verbose=False,
                  restart_on_finish=False,
                  round_cap=0,
-                 track_metrics=False):
+                 seed=None,
+                 track_metrics=False,
+                 array_board=False,
+                 tb_writer=None,
+                 instrument=False):
 
         #################
         # GAME METADATA #
         #################
-        self.config = loads(open("game/config/main_config.json", "r").read())
+        self.config = load_config()
+        self.object_records = get_object_records(self.config)
         self.terminated = False
+        # Every game owns its random streams, so games never share global random state. The Random stream is used for
+        # level sampling and monster movement, dice are rolled from a block-based NumPy stream
+        self.rng = Random(seed)
+        self.dice = DiceRoller(seed)
 
         ##############
         # LEVEL VARS #
         ##############
         # Level Setup
         self.levels = {}
+        self.level_templates = {}
         self.limit_levels = limit_levels if limit_levels \
             else [int(i) for i in list(self.config["GAMEPLAY"]["LEVELS"].keys())]
         self.get_levels()
         # Level Control
         self.curr_level_num = level if level in self.limit_levels else self.limit_levels[0]
-        self.curr_level = deepcopy(self.levels[self.curr_level_num])
+        self.curr_level = self.levels[self.curr_level_num]
         self.num_repeats = num_repeats
         self.lvl_repeats = {lvl: self.num_repeats for lvl in self.levels}
         self.restart_on_finish = restart_on_finish
@@ -54,10 +82,14 @@ class DiceAdventure:
         ##########
         # BOARD #
         #########
-        self.board = Board(width=len(self.curr_level[0]),
-                           height=len(self.curr_level),
-                           object_positions=self.curr_level,
-                           config=self.config)
+        # The array-backed board keeps NumPy layers of the grid next to the cell dicts
+        board_class = ArrayBoard if array_board else Board
+        self.board = board_class(width=len(self.curr_level[0]),
+                                 height=len(self.curr_level),
+                                 object_positions=self.curr_level,
+                                 config=self.config,
+                                 rng=self.rng,
+                                 template=self.level_templates[self.curr_level_num])
 
         ##############
         # PHASE VARS #
@@ -76,6 +108,16 @@ class DiceAdventure:
         self.directions = self.config["GAMEPLAY"]["ACTIONS"]["DIRECTIONS"]
         # Enemy Execution
         self.enemy_execution_phase_name = self.config["GAMEPLAY"]["PHASES"]["ENEMY_EXECUTION_PHASE_NAME"]
+        ##################
+        # STATE VERSIONS #
+        ##################
+        # Scenes of the most recent state versions, by version (see get_state_delta())
+        self.state_version = None
+        self.state_versions = {}
+        self.max_state_versions = 16
+        # Wall entries of the current level, which never change while the level is played
+        self.wall_entities = (None, {})
+
         #############
         # RENDERING #
         #############
@@ -94,19 +136,39 @@ class DiceAdventure:
         self.tracker = GameMetricsTracker(level=self.curr_level_num,
                                           metrics_config=self.config["GAMEPLAY"]["METRICS"],
                                           instance_id=model_number,
-                                          model_number=model_number)
+                                          model_number=model_number,
+                                          tb_writer=tb_writer) if self.track_metrics else None
+
+        ###################
+        # INSTRUMENTATION #
+        ###################
+        # Calls and time spent in each engine stage. Games that are not instrumented run the plain stage methods
+        self.perf = None
+        if instrument:
+            self.perf = PerfStats(PERF_STAGES)
+            self.perf.instrument(self)
 
     #################
     # LEVEL CONTROL #
     #################
     def get_levels(self):
-        levels = deepcopy(self.config["GAMEPLAY"]["LEVELS"])
-        # This makes sure positions are indexed with origin at "bottom left"
-        self.levels = {
-            int(k): [[row[i:i + 2] for i in range(0, len(row), 2)] for row in reversed(v.strip().split("\n"))]
-            for k, v in levels.items()
-            if int(k) in self.limit_levels
-        }
+        """
+        Gets the layout and board template of each level in use. Levels are compiled once per process into immutable
+        templates so that resetting the board to a level does not recreate its objects from the config.
+        :return: N/A
+        """
+        for k, v in self.config["GAMEPLAY"]["LEVELS"].items():
+            if int(k) not in self.limit_levels:
+                continue
+            if v not in LEVEL_TEMPLATES:
+                # This makes sure positions are indexed with origin at "bottom left"
+                layout = tuple(tuple(row[i:i + 2] for i in range(0, len(row), 2))
+                               for row in reversed(v.strip().split("\n")))
+                # Built as an ArrayBoard so the template also carries the NumPy layers
+                board = ArrayBoard(width=len(layout[0]), height=len(layout), object_positions=layout,
+                                   config=self.config)
+                LEVEL_TEMPLATES[v] = (layout, board.snapshot())
+            self.levels[int(k)], self.level_templates[int(k)] = LEVEL_TEMPLATES[v]
 
     def next_level(self):
         """
@@ -138,12 +200,9 @@ class DiceAdventure:
             self.restart_on_team_loss = False
 
         # Set current level
-        self.curr_level = deepcopy(self.levels[self.curr_level_num])
+        self.curr_level = self.levels[self.curr_level_num]
         # Re-initialize values
-        self.board = Board(width=len(self.curr_level[0]),
-                           height=len(self.curr_level),
-                           object_positions=self.curr_level,
-                           config=self.config)
+        self.board.restore(self.level_templates[self.curr_level_num])
         self.phase_num = 0
         self.num_rounds = 0
 
@@ -152,7 +211,7 @@ class DiceAdventure:
         # If level sampling turned on, randomly sample for next level
         if self.level_sampling:
 
-            self.curr_level_num = choice(list(eligible_levels))
+            self.curr_level_num = self.rng.choice(list(eligible_levels))
         else:
             # Otherwise, move on to next level
             self.curr_level_num += 1
@@ -165,13 +224,85 @@ class DiceAdventure:
             else:
                 self.tracker.update(target="game", metric_name="new_level", level=self.curr_level_num)
 
+    ####################
+    # SNAPSHOT & CLONE #
+    ####################
+
+    def snapshot(self):
+        """
+        Captures the mutable game state (board occupancy, object fields, level, phase, round and random state) so the
+        game can be rolled back with restore(). The config, level templates and metrics tracker are not included.
+        :return: Tuple
+        """
+        return (self.terminated,
+                self.curr_level_num,
+                self.curr_level,
+                tuple(self.lvl_repeats.items()),
+                self.restart_on_team_loss,
+                self.phase_num,
+                self.num_rounds,
+                self.rng.getstate(),
+                self.dice.get_state(),
+                self.board.snapshot())
+
+    def restore(self, snapshot):
+        """
+        Restores the game to a snapshot taken with snapshot(). A snapshot can be restored any number of times.
+        :param snapshot: The snapshot
+        :return: N/A
+        """
+        (self.terminated,
+         self.curr_level_num,
+         self.curr_level,
+         lvl_repeats,
+         self.restart_on_team_loss,
+         self.phase_num,
+         self.num_rounds,
+         rng_state,
+         dice_state,
+         board) = snapshot
+        self.lvl_repeats = dict(lvl_repeats)
+        self.rng.setstate(rng_state)
+        self.dice.set_state(dice_state)
+        self.board.restore(board)
+
+    def clone(self):
+        """
+        Creates an independent copy of the game. The copy shares the config and level templates with this game, owns
+        its own random streams (starting from this game's state) and neither tracks metrics nor is instrumented.
+        :return: DiceAdventure
+        """
+        game = copy(self)
+        game.rng = Random()
+        game.dice = DiceRoller()
+        game.board = copy(self.board)
+        game.board.rng = game.rng
+        game.state_versions = dict(self.state_versions)
+        game.track_metrics = False
+        # The timed stage methods of this game would run (and be counted) on this game
+        if self.perf is not None:
+            PerfStats.uninstrument(game, PERF_STAGES)
+            game.perf = None
+        game.restore(self.snapshot())
+        return game
+
+    def perf_stats(self):
+        """
+        Gets the number of calls and the total time (in nanoseconds) spent in each engine stage since the game started.
+        Times are inclusive of the stages a stage calls (i.e., execute_action() includes check_phase()).
+        :return: Dict of stage to calls and total time, or an empty dict if the game is not instrumented
+        """
+        return self.perf.get() if self.perf is not None else {}
+
     ###########################
     # GET STATE & SEND ACTION #
     ###########################
 
-    def get_state(self):
+    def get_state(self, objects=None):
         """
         Constructs a state representation of the game.
+        :param objects: If provided, only the listed objects (by index) are included in the scene instead of the full
+        board. Objects that are not on the board are left out
         :return: Dict
         """
         # self.num_calls += 1
@@ -180,68 +311,188 @@ class DiceAdventure:
             "status": "OK" if not self.terminated else "Done",
             "message": "Full State",
             "content": {
-                "gameData": {
-                    "boardWidth": len(self.curr_level[0]),
-                    "boardHeight": len(self.curr_level),
-                    "level": self.curr_level_num,
-                    "num_repeats": self.num_repeats - self.lvl_repeats[self.curr_level_num],
-                    "currentPhase": self.phases[self.phase_num],
-                },
+                "gameData": self.get_game_data(),
                 "scene": []
             }
         }
+        if objects is not None:
+            state["content"]["scene"] = [self.get_object_state(self.board.objects[o])
+                                         for o in objects if o in self.board.objects]
+            return state
+
         for pos, obj_dict in self.board.board.items():
             # Walls
             if obj_dict is None:
                 state["content"]["scene"].append({"name": "Wall", "type": "wall", "x": int(pos[1]), "y": int(pos[0])})
             else:
                 for o in obj_dict:
-                    obj = obj_dict[o]
-
-                    ele = {"name": obj.name, "type": obj.type, "x": obj.x, "y": obj.y}
-                    if isinstance(obj, Player):
-                        ele.update({
-                            "characterId": int(obj.obj_code[0]),
-                            "pinCursorX": obj.pin_x,
-                            "pinCursorY": obj.pin_y,
-                            "sightRange": obj.sight_range,
-                            "monsterDice": f"D{obj.dice_rolls['MONSTER']['VAL']}+{obj.dice_rolls['MONSTER']['CONST']}",
-                            "trapDice": f"D{obj.dice_rolls['TRAP']['VAL']}+{obj.dice_rolls['TRAP']['CONST']}",
-                            "stoneDice": f"D{obj.dice_rolls['STONE']['VAL']}+{obj.dice_rolls['STONE']['CONST']}",
-                            "health": obj.health,
-                            "dead": obj.dead,
-                            "actionPoints": obj.action_points,
-                            "actionPlan": obj.action_plan,
-                            "action_plan_finalized": obj.action_plan_finalized
-                        })
-                    # Goals
-                    elif isinstance(obj, Shrine):
-                        ele.update({
-                            "reached": obj.reached,
-                            "character": obj.player
-                        })
-                    elif isinstance(obj, Tower):
-                        ele.update({
-                            "subgoalCount": obj.subgoal_count
-                        })
-                    # Enemies
-                    elif isinstance(obj, Enemy):
-                        ele.update({
-                            "name": obj.index,
-                            "combatDice": f"D{obj.dice_rolls['VAL']}+{obj.dice_rolls['CONST']}"
-                        })
-                        # Action points only apply to monsters
-                        if obj.name == "Monster":
-                            ele["actionPoints"] = self.config["OBJECT_INFO"]["OBJECT_CODES"][obj.obj_code]["ACTION_POINTS"]
-                    # Pins
-                    elif isinstance(obj, Pin):
-                        ele.update({
-                            "name": obj.name,
-                            "placedBy": obj.placed_by
-                        })
-                    state["content"]["scene"].append(ele)
+                    state["content"]["scene"].append(self.get_object_state(obj_dict[o]))
         return state
 
+    def get_state_binary(self, command="get_state"):
+        """
+        Constructs the binary encoding of the full state (see StateCodec), directly from the board.
+        :param command: The command the state answers
+        :return: bytes
+        """
+        codec = get_state_codec(self.config)
+        records = []
+        for pos, obj_dict in self.board.board.items():
+            if obj_dict is None:
+                records.append(codec.wall_record(int(pos[1]), int(pos[0])))
+            else:
+                for o in obj_dict:
+                    records.append(codec.object_record(obj_dict[o]))
+        return codec.encode_records(command, "OK" if not self.terminated else "Done", self.get_game_data(), records)
+
+    def get_game_data(self):
+        return {
+            "boardWidth": len(self.curr_level[0]),
+            "boardHeight": len(self.curr_level),
+            "level": self.curr_level_num,
+            "num_repeats": self.num_repeats - self.lvl_repeats[self.curr_level_num],
+            "currentPhase": self.phases[self.phase_num],
+        }
+
+    def get_state_delta(self, since_version=None):
+        """
+        Constructs a versioned state representation that only holds the scene entries added, changed or removed since
+        the version a client already has. Scene entries are keyed by object index and cell ("1S@3,4", "Wall@0,0"),
+        so an object listed in more than one cell keeps one entry per cell, as in the full scene. The version only
+        changes when the scene or gameData changes. If the client's version is unknown (None, too old or from another
+        level), every entry is sent and 'baseVersion' is None, which tells the client to drop its entries first.
+        :param since_version: The version the client has
+        :return: Dict
+        """
+        game_data = self.get_game_data()
+        entities = {}
+        for pos, obj_dict in self.board.board.items():
+            if obj_dict:
+                for o in obj_dict:
+                    entities[f"{o}@{pos[1]},{pos[0]}"] = self.get_object_state(obj_dict[o])
+        latest = self.state_versions.get(self.state_version)
+        if latest is None or latest != (self.curr_level, game_data, entities):
+            self.state_version = next(STATE_VERSIONS)
+            self.state_versions[self.state_version] = (self.curr_level, game_data, entities)
+            if len(self.state_versions) > self.max_state_versions:
+                del self.state_versions[next(iter(self.state_versions))]
+
+        base = self.state_versions.get(since_version)
+        if base is None or base[0] is not self.curr_level:
+            base_version = None
+            changed = self.get_wall_entities() | entities
+            removed = []
+        else:
+            base_version = since_version
+            changed = {k: e for k, e in entities.items() if base[2].get(k) != e}
+            removed = [k for k in base[2] if k not in entities]
+        return {
+            "command": "get_state",
+            "status": "OK" if not self.terminated else "Done",
+            "message": "State Delta",
+            "content": {
+                "version": self.state_version,
+                "baseVersion": base_version,
+                "gameData": game_data,
+                "changed": changed,
+                "removed": removed
+            }
+        }
+
+    def get_wall_entities(self):
+        """
+        Gets the scene entries of the walls of the current level, keyed as in get_state_delta()
+        :return: Dict
+        """
+        if self.wall_entities[0] is not self.curr_level:
+            self.wall_entities = (self.curr_level,
+                                  {f"Wall@{pos[1]},{pos[0]}": {"name": "Wall", "type": "wall",
+                                                               "x": int(pos[1]), "y": int(pos[0])}
+                                   for pos, obj_dict in self.board.board.items() if obj_dict is None})
+        return self.wall_entities[1]
+
+    def get_object_state(self, obj):
+        """
+        Constructs the scene entry of a single game object.
+        :param obj: The object
+        :return: Dict
+        """
+        ele = {"name": obj.name, "type": obj.type, "x": obj.x, "y": obj.y}
+        if isinstance(obj, Player):
+            ele.update({
+                "characterId": int(obj.obj_code[0]),
+                "pinCursorX": obj.pin_x,
+                "pinCursorY": obj.pin_y,
+                "sightRange": obj.sight_range,
+                "monsterDice": self.object_records[obj.obj_code].dice["MONSTER"],
+                "trapDice": self.object_records[obj.obj_code].dice["TRAP"],
+                "stoneDice": self.object_records[obj.obj_code].dice["STONE"],
+                "health": obj.health,
+                "dead": obj.dead,
+                "actionPoints": obj.action_points,
+                "actionPlan": list(obj.action_plan),
+                "action_plan_finalized": obj.action_plan_finalized
+            })
+        # Goals
+        elif isinstance(obj, Shrine):
+            ele.update({
+                "reached": obj.reached,
+                "character": obj.player
+            })
+        elif isinstance(obj, Tower):
+            ele.update({
+                "subgoalCount": obj.subgoal_count
+            })
+        # Enemies
+        elif isinstance(obj, Enemy):
+            ele.update({
+                "name": obj.index,
+                "combatDice": self.object_records[obj.obj_code].dice
+            })
+            # Action points only apply to monsters
+            if obj.name == "Monster":
+                ele["actionPoints"] = self.object_records[obj.obj_code].action_points
+        # Pins
+        elif isinstance(obj, Pin):
+            ele.update({
+                "name": obj.name,
+                "placedBy": obj.placed_by
+            })
+        return ele
+
+    def run_command(self, command):
+        """
+        Runs a socket protocol command, so the local game and the Unity game can be driven with the same messages.
+        Commands:
+            {"command": "get_state"}
+            {"command": "execute_action", "player": "Dwarf", "action": "up", "return_state": true}
+            {"command": "execute_actions", "actions": [{"player": "Giant", "action": "up"}, ...], "return_state": true}
+        The Unity game takes the player of "execute_action" from the socket it was sent on. Batched actions are applied
+        in the order given. If "return_state" is set, the state after the actions is returned instead of an
+        acknowledgement, which saves a separate get_state round trip. Any command that returns a state returns a
+        delta (see get_state_delta()) instead if it includes "since_version", or the binary encoded state (see
+        get_state_binary()) if it includes "encoding": "binary".
+        :param command: The command (dict)
+        :return: Dict
+        """
+        if command["command"] == "execute_action":
+            self.execute_action(command["player"], command["action"])
+        elif command["command"] == "execute_actions":
+            for a in command["actions"]:
+                self.execute_action(a["player"], a["action"])
+        elif command["command"] != "get_state":
+            return {"command": command["command"], "status": "Error", "message": "Unknown command"}
+        if command["command"] == "get_state" or command.get("return_state"):
+            if "since_version" in command:
+                state = self.get_state_delta(command["since_version"])
+            elif command.get("encoding") == "binary":
+                return self.get_state_binary(command["command"])
+            else:
+                state = self.get_state()
+            state["command"] = command["command"]
+            return state
+        return {"command": command["command"], "status": "OK", "message": "Action executed"}
+
     def execute_action(self, player, action):
         """
         Applies an action to the player given.
@@ -514,7 +765,7 @@ class DiceAdventure:
                     # Monster can move on this turn
                     if move_count < m.action_points:
                         done = False
-                        self.board.move_monster(m.index, self.directions.copy())
+                        self.board.move_monster(m.index, list(self.directions))
                 # Check to see if com at needs to be initiated
                 self.check_combat()
                 # Some monsters may have been defeated
@@ -546,8 +797,8 @@ class DiceAdventure:
             if self.board.objects[p].action_plan:
                 self.board.objects[p].action_plan.pop()
                 last_position = self.board.objects[p].action_positions.pop()
-                self.board.objects[p].action_plan_x = last_position[1]
-                self.board.objects[p].action_plan_y = last_position[0]
+                self.board.objects[p].action_path_x = last_position[1]
+                self.board.objects[p].action_path_y = last_position[0]
                 self.board.objects[p].action_points += 1
         else:
             # No-op/invalid action
@@ -563,14 +814,18 @@ class DiceAdventure:
         :param step_index: Determines the position in the action sequence
         :return: N/A
         """
-        # Gets location of all players. If multiple players end up on the same grid square, using a set will ensure
-        # spot is only checked once for combat
-        player_loc = set([(self.board.objects[p].y, self.board.objects[p].x)
-                          for p in self.player_code_mapping.values()])
+        # Gets location of all players. If multiple players end up on the same grid square, the dict will ensure
+        # spot is only checked once for combat. Locations, players and enemies are visited in a fixed order (player
+        # order, then object creation order) so dice are always drawn in the same order for the same seed
+        player_loc = dict.fromkeys([(self.board.objects[p].y, self.board.objects[p].x)
+                                    for p in self.player_code_mapping.values()])
         # For each location where player is present, check if there are enemies. If so, initiate combat
         for loc in player_loc:
-            players = [obj for obj in self.board.board[loc].values() if isinstance(obj, Player)]
-            enemies = [obj for obj in self.board.board[loc].values() if isinstance(obj, Enemy)]
+            if not self.board.enemies_at(loc[1], loc[0]):
+                continue
+            players = [self.board.objects[p] for p in self.player_code_mapping.values() if p in self.board.board[loc]]
+            enemies = [obj for k, obj in self.board.objects.items()
+                       if isinstance(obj, Enemy) and k in self.board.board[loc]]
             # There are enemies at this position
             if enemies and players:
                 self.combat(players, enemies, step_index)
@@ -588,8 +843,11 @@ class DiceAdventure:
         """
         # Enemies are always all the same type
         enemy_type = enemies[0].name
-        player_rolls = sum([p.get_dice_roll(enemy_type) for p in players])
-        enemy_rolls = sum([e.get_dice_roll() for e in enemies])
+        # All dice of the combat are rolled at once, players first
+        dice = [p.get_dice(enemy_type) for p in players] + [e.get_dice() for e in enemies]
+        rolls = self.dice.roll([d[0] for d in dice], [d[1] for d in dice])
+        player_rolls = rolls[:len(players)].sum()
+        enemy_rolls = rolls[len(players):].sum()
 
         # Players win (players win ties)
         if player_rolls >= enemy_rolls:
@@ -1,20 +1,19 @@
 from game.dice_adventure import DiceAdventure
 import game.env.rewards as rewards
 import game.env.unity_socket as unity_socket
+from game.env.model_cache import get_model_cache
+from game.env.reward_log import RewardLog
+from classes.config import load_config
+from classes.metrics_tracker import get_tensorboard_writer
+from classes.perf_stats import add_stats
+from classes.state_codec import BinaryState
+from classes.state_codec import get_state_codec
 
-from copy import deepcopy
-from datetime import datetime
 from gymnasium import Env
 from gymnasium import spaces
-from json import loads
 import numpy as np
-from os import listdir
 from os import makedirs
-from os import path
-from random import choice
-from random import seed
-from stable_baselines3 import PPO
-import re
+from random import Random
 import pprint
 pp = pprint.PrettyPrinter(indent=2)
 
@@ -30,14 +29,16 @@ class DiceAdventurePythonEnv(Env):
                  automate_players=True,
                  random_players=False,
                  set_random_seed=False,
+                 inference_client=None,
                  **kwargs):
         self.id = id_
         print(f"INITIALIZING ENV {self.id}...")
-        if set_random_seed:
-            seed(self.id)
+        # Random stream of this env, which seeds every game it creates. Envs never touch the global random state, so
+        # parallel envs have independent streams that are reproducible when seeded by id
+        self.rng = Random(self.id) if set_random_seed else Random()
 
         self.game = None
-        self.config = self.config = loads(open("game/config/main_config.json", "r").read())
+        self.config = load_config()
         self.reward_codes = self.config["GYM_ENVIRONMENT"]["REWARD"]["CODES"]
         self.observation_object_positions = self.config["GYM_ENVIRONMENT"]["OBSERVATION"]["OBJECT_POSITIONS"]
         self.object_size_mappings = self.config["OBJECT_INFO"]["ENEMIES"]["ENEMY_SIZE_MAPPING"]
@@ -67,6 +68,12 @@ class DiceAdventurePythonEnv(Env):
         self.model_dir = "train/{}/model/".format(self.model_number)
         self.model_file = None
         self.model = None
+        # Teammate model, shared by every env of the process that plays with the same model directory
+        self.model_cache = get_model_cache(self.model_dir,
+                                           self.config["GYM_ENVIRONMENT"]["TEAMMATE_MODEL"]["RELOAD_CHECK_SECONDS"],
+                                           self.config["GYM_ENVIRONMENT"]["TEAMMATE_MODEL"]["RELOAD_CHECK_STEPS"])
+        # If set, teammate actions are predicted by an InferenceServer instead of a model loaded in this process
+        self.inference_client = inference_client
 
         ##################
         # TRAIN SETTINGS #
@@ -86,32 +93,86 @@ class DiceAdventurePythonEnv(Env):
         vector_len = (self.mask_size * self.mask_size * len(set(self.observation_object_positions.values())) * 4) + 6
         self.observation_space = spaces.Box(low=-5, high=100,
                                             shape=(vector_len,), dtype=np.float32)
+        # Preallocated observation buffers, one per player. The grid views share memory with the flat buffers
+        self.observations = {p: np.zeros(vector_len, dtype=np.float32) for p in self.players}
+        self.observation_grids = {p: self.observations[p][:-6].reshape((self.mask_size, self.mask_size,
+                                                                        len(set(self.observation_object_positions.values())),
+                                                                        4))
+                                  for p in self.players}
+        self.player_code_mapping = self.config["OBJECT_INFO"]["PLAYERS"]["PLAYER_CODE_MAPPING"]
+        # Objects the local game includes in its scene when the full scene is not requested
+        self.state_objects = self.player_ids + [p[0] + "G" for p in self.player_ids]
         ###################
         # METRIC TRACKING #
         ###################
         self.metrics_dir = self.config["GYM_ENVIRONMENT"]["METRICS"]["DIRECTORY"].format(model_number)
         makedirs(self.metrics_dir, exist_ok=True)
         self.track_metrics = env_metrics
-        self.metrics_save_threshold = 10000
         # Reward tracking
-        self.rewards_tracker = []
+        self.reward_log = RewardLog(directory=f"{self.metrics_dir}/rewards_over_time-{self.player}-id-{self.id}",
+                                    players=self.players,
+                                    reward_codes=self.reward_codes) if self.track_metrics else None
         self.num_games = 0
+        # Engine stage timings of the local games (see DiceAdventure.perf_stats()), summed over the games of this env
+        # and exported to TensorBoard every few steps
+        self.instrument = kwargs.get("instrument", False) and server == "local"
+        self.perf_totals = {}
+        self.perf_exported = {}
+        self.perf_export_steps = self.config["GYM_ENVIRONMENT"]["METRICS"]["PERF_EXPORT_STEPS"]
+        self.perf_writer = None
+        if self.instrument:
+            self.perf_writer = kwargs.get("tb_writer") or get_tensorboard_writer(self.config["GAMEPLAY"]["METRICS"],
+                                                                                 model_number)
 
         # Server type
         self.server = server
         self.unity_socket_url = self.config["GYM_ENVIRONMENT"]["UNITY"]["URL"]
+        # If the Unity build supports them, actions return the resulting state and teammate actions are batched into
+        # one message (see DiceAdventure.run_command())
+        self.combined_commands = self.config["GYM_ENVIRONMENT"]["UNITY"]["COMBINED_COMMANDS"]
+        # If the Unity build supports versioned states, states are fetched as deltas and applied to a local mirror
+        self.delta_states = self.config["GYM_ENVIRONMENT"]["UNITY"]["DELTA_STATES"]
+        # Full states from the Unity build can be sent in the compact binary encoding (see StateCodec)
+        if self.server != "local":
+            for p in self.players:
+                unity_socket.set_encoding(self.unity_socket_url.format(p.lower()),
+                                          self.config["GYM_ENVIRONMENT"]["UNITY"]["STATE_ENCODING"])
+        # Lookups for observations of binary states (see fill_observation_from_records())
+        codec = get_state_codec(self.config)
+        self.record_positions = [self.observation_object_positions.get(t) for t in codec.types]
+        self.record_pin_type = codec.type_index["pin"]
+        self.record_codes = {p: (f"{codec.players[p]}S".encode(), f"{codec.players[p]}G".encode())
+                             for p in self.players}
 
         #if self.server == "local":
         #    self.create_game()
+        # States are never modified once built, so they are kept by reference between steps
+        self.state = None
         self.prev_observed_state = None
+        # Step in progress (see step_agent())
+        self.pending_step = None
+        self.pending_actions = {}
 
     def step(self, action, player=None):
+        observations = self.step_agent(action, player)
+        return self.step_others(self.predict_others(observations))
+
+    def step_agent(self, action, player=None):
+        """
+        First half of step(). Executes the agent's action, determines its reward and chooses the actions of the other
+        players that do not come from the model. The step is completed by step_others(), so the model actions of
+        several envs can be predicted in a single forward pass (see TeammateBatchVecEnv).
+        :param action: The agent's action
+        :param player: The player the agent plays as
+        :return: Dict of player to observation, for the other players whose action comes from the model
+        """
         if player is None:
             player = self.player
         action = int(action)
         self.time_steps += 1
 
-        state = self.get_state()
+        # The state at the end of the previous step is the current state
+        state = self.state
         # Execute action and get next state
         game_action = self.action_map[action]
         next_state = self.execute_action(player, game_action)
@@ -126,12 +187,26 @@ class DiceAdventurePythonEnv(Env):
 
         # Update previous state to current one
         # Should update this before
-        self.prev_observed_state = deepcopy(next_state)
+        self.prev_observed_state = next_state
 
+        observations = {}
+        self.pending_actions = {}
+        if self.automate_players:
+            self.pending_actions, observations = self.plan_others(game_action, self.prev_observed_state, next_state)
+        self.pending_step = (next_state, reward)
+        return observations
+
+    def step_others(self, model_actions):
+        """
+        Second half of step(). Plays as the other players and completes the step started by step_agent().
+        :param model_actions: Dict of player to action, for the other players whose action comes from the model
+        :return: new_obs, reward, terminated, truncated, info
+        """
+        next_state, reward = self.pending_step
         # Simulate other players
         if self.automate_players:
-            self.play_others(game_action, self.prev_observed_state, next_state)
-            next_state = self.get_state()
+            next_state = self.send_others({**self.pending_actions, **model_actions})
+        self.state = next_state
 
         # new_obs, reward, terminated, truncated, info
         # TODO define termination for local game and unity version
@@ -139,16 +214,46 @@ class DiceAdventurePythonEnv(Env):
         if terminated:
             new_obs, info = self.reset()
         else:
-            new_obs = self.get_observation(next_state)
+            # The buffer is reused by the next step, and VecEnvs keep the observation of the last step of an episode
+            # as its terminal observation, so a copy is returned
+            new_obs = self.get_observation(next_state).copy()
             info = {}
         truncated = False
-        # Track metrics
-        self.save_metrics()
+        if self.instrument and self.time_steps % self.perf_export_steps == 0:
+            self.export_perf_stats()
 
         return new_obs, reward, terminated, truncated, info
 
+    def step_joint(self, actions):
+        """
+        Steps the game with one action per player, for games where the agent plays as every player (see
+        MultiAgentVecEnv). The actions are executed in player order and every player is rewarded for the change in
+        state over the whole step. Unlike step(), the game is not reset when it ends.
+        :param actions: Dict of player to action
+        :return: Dict of player to observation, dict of player to reward, terminated, truncated, info
+        """
+        self.time_steps += 1
+        state = self.state
+        next_state = self.send_others({p: self.action_map[int(a)] for p, a in actions.items()})
+        rewards = {p: self.get_reward(self.get_obj_from_scene_by_type(state, p),
+                                      self.get_obj_from_scene_by_type(next_state, p),
+                                      self.prev_observed_state, next_state, player=p)
+                   for p in actions}
+        self.prev_observed_state = next_state
+        self.state = next_state
+        terminated = next_state["status"] == "Done"
+        if self.instrument and self.time_steps % self.perf_export_steps == 0:
+            self.export_perf_stats()
+        return self.get_observations(next_state), rewards, terminated, False, {}
+
     def close(self):
-        pass
+        if self.track_metrics:
+            self.reward_log.close()
+        # Records of the current game that are still in memory (see create_game())
+        if self.game is not None and self.game.track_metrics:
+            self.game.tracker.save()
+        if self.server != "local":
+            unity_socket.close()
 
     def render(self, mode='console'):
         if self.server == "local":
@@ -159,28 +264,43 @@ class DiceAdventurePythonEnv(Env):
     def reset(self, **kwargs):
         if self.server == "local":
             self.create_game()
-            state = self.get_state()
-            obs = self.get_observation(state)
-        else:
-            state = self.get_state()
-            obs = self.get_observation(state)
-        self.prev_observed_state = deepcopy(state)
+        state = self.get_state()
+        # A copy, so the reset does not overwrite an observation returned by step() (see step_others())
+        obs = self.get_observation(state).copy()
+        self.state = state
+        self.prev_observed_state = state
         return obs, {}
 
-    def execute_action(self, player, game_action):
+    def execute_action(self, player, game_action, return_state=True):
+        """
+        Executes an action for a player.
+        :param player: The player
+        :param game_action: The action
+        :param return_state: If False, the state is not fetched after the action
+        :return: The resulting state, or None if 'return_state' is False
+        """
         if self.server == "local":
             self.game.execute_action(player, game_action)
         else:
             url = self.unity_socket_url.format(player.lower())
+            if return_state and self.combined_commands:
+                return unity_socket.execute_action(url, game_action, return_state=True, delta=self.delta_states)
             unity_socket.execute_action(url, game_action)
-        return self.get_state()
+        return self.get_state() if return_state else None
 
-    def get_state(self, player="dwarf"):
+    def get_state(self, player="dwarf", full_scene=False):
+        """
+        Gets the current state of the game. For the local game, only the players and shrines are included in the scene
+        unless the full scene is requested, since observations are read directly from the board.
+        :param player: The player whose socket is used for the unity game
+        :param full_scene: If True, the local game includes every object on the board in the scene
+        :return: Dict
+        """
         if self.server == "local":
-            state = self.game.get_state()
+            state = self.game.get_state(objects=None if full_scene else self.state_objects)
         else:
             url = self.unity_socket_url.format(player)
-            state = unity_socket.get_state(url)
+            state = unity_socket.get_state(url, delta=self.delta_states)
         return state
 
     ###########
@@ -188,32 +308,111 @@ class DiceAdventurePythonEnv(Env):
     ###########
 
     def play_others(self, game_action, state, next_state):
-        # Play as other players
-        for p in self.players:
-            if p != self.player:
-                # Only force submit on other characters if case where self.player clicking submit does not
-                # change the game phase (otherwise, these players will just forfeit their turns immediately)
-                if game_action == "submit" \
-                        and state["content"]["gameData"]["currentPhase"] == next_state["content"]["gameData"]["currentPhase"]:
-                    a = game_action
-                elif not self.random_players:
-                    self.load_model()
-                    a, _states = self.model.predict(self.get_observation(next_state, player=p))
-                    # Need to convert to python int
-                    a = self.action_map[int(a)]
-                else:
-                    a = choice(list(self.action_map.values()))
-                # print(f"Other Player: {p}: Action: {a}")
-                _ = self.execute_action(p, a)
-                # next_state = self.get_state()
+        """
+        Plays as the other players.
+        :param game_action: The action of the env's player
+        :param state: The state before the env's player acted
+        :param next_state: The state after the env's player acted
+        :return: The state after the other players acted
+        """
+        actions, observations = self.plan_others(game_action, state, next_state)
+        return self.send_others({**actions, **self.predict_others(observations)})
+
+    def plan_others(self, game_action, state, next_state):
+        """
+        Chooses the actions of the other players, except those that come from the model.
+        :param game_action: The action of the env's player
+        :param state: The state before the env's player acted
+        :param next_state: The state after the env's player acted
+        :return: Dict of player to action, and dict of player to observation for the players whose action comes from
+        the model (see predict_others())
+        """
+        others = [p for p in self.players if p != self.player]
+        # Force submit on other characters if case where self.player clicking submit does not
+        # change the game phase (otherwise, these players will just forfeit their turns immediately)
+        force_submit = game_action == "submit" \
+            and state["content"]["gameData"]["currentPhase"] == next_state["content"]["gameData"]["currentPhase"]
+        if force_submit:
+            return {p: game_action for p in others}, {}
+        if self.random_players:
+            return {p: self.rng.choice(list(self.action_map.values())) for p in others}, {}
+        # Observations are read from the live board for the local game, so they must all be taken before
+        # any other player acts
+        return {}, {p: self.get_observation(next_state, player=p) for p in others}
+
+    def predict_others(self, observations):
+        """
+        Predicts the actions of the other players with the model, in a single forward pass.
+        :param observations: Dict of player to observation
+        :return: Dict of player to action
+        """
+        if not observations:
+            return {}
+        if self.inference_client is not None:
+            actions = self.inference_client.predict(np.stack(list(observations.values())))
+        else:
+            self.load_model()
+            actions, _states = self.model.predict(np.stack(list(observations.values())))
+        # Need to convert to python int
+        return {p: self.action_map[int(a)] for p, a in zip(observations, actions)}
+
+    def send_others(self, actions):
+        """
+        Executes the actions of the other players.
+        :param actions: Dict of player to action
+        :return: The state after the other players acted
+        """
+        if self.server == "local":
+            for p, a in actions.items():
+                self.execute_action(p, a, return_state=False)
+        elif self.combined_commands:
+            # All actions and the resulting state in one round trip
+            return unity_socket.execute_batch(self.unity_socket_url.format("dwarf"), actions, return_state=True,
+                                              delta=self.delta_states)
+        else:
+            # The actions of the other players are sent on their sockets at the same time
+            unity_socket.execute_actions({self.unity_socket_url.format(p.lower()): a for p, a in actions.items()})
+        return self.get_state()
 
     def create_game(self):
+        # Records of the previous game that are still in memory are written before it is replaced
+        if self.game is not None and self.game.track_metrics:
+            self.game.tracker.save()
+        if self.game is not None and self.instrument:
+            add_stats(self.perf_totals, self.game.perf_stats())
         self.kwargs["model_number"] = self.model_number
+        self.kwargs["seed"] = self.rng.getrandbits(32)
         self.game = DiceAdventure(**self.kwargs)
         self.num_games += 1
         # self.prev_state = self.game.get_state()
 
-    def get_reward(self, p1, p2, state, next_state):
+    def perf_stats(self):
+        """
+        Gets the engine stage timings of every game this env has played, including the current one
+        :return: Dict of stage to calls and total time (in nanoseconds)
+        """
+        totals = {stage: dict(values) for stage, values in self.perf_totals.items()}
+        if self.game is not None:
+            add_stats(totals, self.game.perf_stats())
+        return totals
+
+    def export_perf_stats(self):
+        """
+        Writes the calls and the mean time per call (in microseconds) of each engine stage since the last export to
+        TensorBoard
+        :return: N/A
+        """
+        totals = self.perf_stats()
+        for stage, values in totals.items():
+            exported = self.perf_exported.get(stage, {"calls": 0, "total_ns": 0})
+            calls = values["calls"] - exported["calls"]
+            self.perf_writer.put(f"perf_{self.id}/{stage}_calls", calls)
+            if calls:
+                self.perf_writer.put(f"perf_{self.id}/{stage}_mean_us",
+                                     (values["total_ns"] - exported["total_ns"]) / calls / 1000)
+        self.perf_exported = totals
+
+    def get_reward(self, p1, p2, state, next_state, player=None):
         # Get reward
         """
         Rewards:
@@ -227,17 +426,18 @@ class DiceAdventurePythonEnv(Env):
         2. Player not moving (-0.1)
         """
         r = 0
-        reward_types = []
+        # Bitmask of reward codes
+        reward_types = 0
 
         # Player getting goal
         g1 = self.get_obj_from_scene_by_type(state, "shrine")
         g2 = self.get_obj_from_scene_by_type(next_state, "shrine")
         if rewards.goal_reached(g1, g2, state, next_state):
-            reward_types.append(self.reward_codes["0"])
+            reward_types |= 1 << 0
             r += 1
         # Players getting to tower after getting all goals
         if rewards.check_new_level(state, next_state):
-            reward_types.append(self.reward_codes["1"])
+            reward_types |= 1 << 1
             r += 1
         # Player winning combat
         # if self.check_combat_outcome():
@@ -247,29 +447,24 @@ class DiceAdventurePythonEnv(Env):
         #     r += .1
         # Player losing health
         if rewards.health_lost_or_dead(p1, p2):
-            reward_types.append(self.reward_codes["2"])
+            reward_types |= 1 << 2
             r -= .2
 
         # Player not moving
         if not rewards.has_moved(p1, p2):
-            reward_types.append(self.reward_codes["3"])
+            reward_types |= 1 << 3
             r -= .1
 
         if self.track_metrics:
-            # [timestep, timestamp, player, game, level, reward_type, reward]
-            self.rewards_tracker.append([self.time_steps,
-                                         datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f'),
-                                         self.player,
-                                         str(self.num_games),
-                                         state["content"]["gameData"]["level"],
-                                         ",".join(reward_types),
-                                         str(r)
-                                         ])
+            self.reward_log.append(self.time_steps, player or self.player, self.num_games,
+                                   state["content"]["gameData"]["level"], reward_types, r)
         return r
 
 
     @staticmethod
     def get_obj_from_scene_by_type(state, obj_type):
+        if isinstance(state, BinaryState):
+            return state.find(obj_type)
         o = None
         for ele in state["content"]["scene"]:
             if ele.get("type") == obj_type:
@@ -287,11 +482,75 @@ class DiceAdventurePythonEnv(Env):
         3. 4 (4) - max number of object types is 4 [i.e., M4]
         4. six additional state variables
         Total Est.: 7x7x10x4+6= 1006
+        The local game is read directly from the board, so 'state' is only used for the unity game. The returned
+        array is the player's preallocated buffer and is overwritten by the next call for the same player.
         :param state:
         :return:
         """
         if player is None:
             player = self.player
+        obs = self.observations[player]
+        obs.fill(0)
+        if self.server == "local":
+            self.fill_observation_from_board(player)
+        elif isinstance(state, BinaryState):
+            self.fill_observation_from_records(state, player)
+        else:
+            self.fill_observation_from_scene(state, player)
+        return obs
+
+    def get_observations(self, state):
+        """
+        Constructs the observation of every player (see get_observation())
+        :param state: The state
+        :return: Dict of player to observation
+        """
+        return {p: self.get_observation(state, player=p) for p in self.players}
+
+    def fill_observation_from_board(self, player):
+        """
+        Fills the player's observation buffer from the local game's board, visiting only the cells around the player.
+        :param player: The player
+        :return: None
+        """
+        grid = self.observation_grids[player]
+        board = self.game.board
+        player_obj = board.objects[self.player_code_mapping[player]]
+        x = player_obj.x
+        y = player_obj.y
+        r = self.local_mask_radius
+
+        for cell_y in range(max(y - r, 0), min(y + r, board.height - 1) + 1):
+            for cell_x in range(max(x - r, 0), min(x + r, board.width - 1) + 1):
+                cell = board.board[(cell_y, cell_x)]
+                if cell is None:
+                    if cell_x and cell_y:
+                        grid[r - (x - cell_x), r - (y - cell_y), self.observation_object_positions["wall"], 0] = 1
+                    continue
+                for obj in cell.values():
+                    # Objects are listed by their own position, which can differ from the cell they are found in
+                    if obj.type in self.observation_object_positions and obj.x and obj.y \
+                            and abs(x - obj.x) <= r and abs(y - obj.y) <= r:
+                        # Enemies share a single version, matching the scene-based observation
+                        version = self.pin_mapping[obj.name[1]] if obj.type == "pin" else 0
+                        grid[r - (x - obj.x), r - (y - obj.y), self.observation_object_positions[obj.type], version] = 1
+
+        shrine_obj = board.objects[player_obj.obj_code[0] + "G"]
+        self.observations[player][-6:] = [player_obj.action_points,
+                                          player_obj.health,
+                                          int(player_obj.dead),
+                                          int(shrine_obj.reached),
+                                          player_obj.pin_x or 0,
+                                          player_obj.pin_y or 0]
+
+    def fill_observation_from_scene(self, state, player):
+        """
+        Fills the player's observation buffer from the scene of a state.
+        :param state: The state
+        :param player: The player
+        :return: None
+        """
+        grid = self.observation_grids[player]
         x, y, player_info = self.parse_player_state_data(state, player)
 
         x_bound_upper = x + self.local_mask_radius
@@ -299,26 +558,50 @@ class DiceAdventurePythonEnv(Env):
         y_bound_upper = y + self.local_mask_radius
         y_bound_lower = y - self.local_mask_radius
 
-        grid = np.zeros((self.mask_size, self.mask_size, len(set(self.observation_object_positions.values())), 4))
         for obj in state["content"]["scene"]:
             if obj["type"] in self.observation_object_positions and obj["x"] and obj["y"]:
                 if x_bound_lower <= obj["x"] <= x_bound_upper and \
                         y_bound_lower <= obj["y"] <= y_bound_upper:
                     other_x = self.local_mask_radius - (x - obj["x"])
                     other_y = self.local_mask_radius - (y - obj["y"])
-                    # For pins and enemies, determine which type for version
-                    if obj["type"] == "pin":
-                        version = self.pin_mapping[obj["name"][1]]
-                    # For enemies, determine which type for version
-                    elif re.match("(monster|trap|stone)", obj["type"].lower()):
-                        # elif obj["name"] in ["Monster", "Trap", "Stone"]:
-                        version = self.object_size_mappings[obj["type"].split("_")[0]]
-                    # All other objects have one version
-                    else:
-                        version = 0
+                    # For pins, determine which type for version. Enemies share a single version
+                    version = self.pin_mapping[obj["name"][1]] if obj["type"] == "pin" else 0
                     grid[other_x][other_y][self.observation_object_positions[obj["type"]]][version] = 1
 
-        return np.concatenate((np.ndarray.flatten(grid), np.ndarray.flatten(player_info)))
+        self.observations[player][-6:] = player_info
+
+    def fill_observation_from_records(self, state, player):
+        """
+        Fills the player's observation buffer from the records of a binary state, without creating scene entries.
+        :param state: The BinaryState
+        :param player: The player
+        :return: None
+        """
+        grid = self.observation_grids[player]
+        records = state.records
+        codes = records["code"].tolist()
+        # Players and shrines are the only records with their codes
+        player_code, shrine_code = self.record_codes[player]
+        player_rec = records[codes.index(player_code)]
+        shrine_rec = records[codes.index(shrine_code)]
+        x = int(player_rec["x"])
+        y = int(player_rec["y"])
+        r = self.local_mask_radius
+
+        for t, code, obj_x, obj_y in zip(records["type"].tolist(), codes, records["x"].tolist(), records["y"].tolist()):
+            position = self.record_positions[t]
+            if position is not None and obj_x and obj_y and abs(x - obj_x) <= r and abs(y - obj_y) <= r:
+                # For pins, the version is given by the pin type letter of the code (i.e., PA). Enemies share a
+                # single version
+                version = self.pin_mapping[chr(code[1])] if t == self.record_pin_type else 0
+                grid[r - (x - obj_x), r - (y - obj_y), position, version] = 1
+
+        self.observations[player][-6:] = [player_rec["action_points"],
+                                          player_rec["health"],
+                                          player_rec["dead"],
+                                          shrine_rec["reached"],
+                                          max(player_rec["pin_x"], 0),
+                                          max(player_rec["pin_y"], 0)]
 
     @staticmethod
     def parse_player_state_data(state, player):
@@ -357,19 +640,6 @@ class DiceAdventurePythonEnv(Env):
                 player_info[state_map[field]] = data
         return player_obj["x"], player_obj["y"], player_info
 
-    def save_metrics(self):
-        if self.track_metrics:
-            # Save rewards logs
-            if len(self.rewards_tracker) >= self.metrics_save_threshold:
-                filename = f"{self.metrics_dir}/rewards_over_time_-{self.player}-id-{self.id}.txt"
-                with open(filename,
-                          "a" if path.exists(filename) else "w") as file:
-                    for i in self.rewards_tracker:
-                        file.write("\t".join([str(ele) for ele in i])+"\n")
-                self.rewards_tracker = []
-
     def load_model(self):
-        model_files = [self.model_dir + file.rstrip(".zip") for file in listdir(self.model_dir)]
-        latest = sorted([(file, int(file.split("-")[-1])) for file in model_files], key=lambda x: x[1])[-1]
-        if latest != self.model_file:
-            self.model = PPO.load(latest[0])
+        self.model = self.model_cache.get()
+        self.model_file = self.model_cache.model_file
@@ -0,0 +1,171 @@
+import multiprocessing as mp
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from queue import Empty
+from time import monotonic
+from traceback import print_exc
+from classes.config import load_config
+from game.env.model_cache import ModelCache
+
+
+class InferenceServer:
+    """
+    A process that owns the teammate model and predicts teammate actions for the envs of every SubprocVecEnv worker.
+    Each worker writes its observations to its own shared memory block and only sends a small request message. The
+    server collects requests until every client has one pending or the deadline since the first request has passed,
+    and answers them all with a single forward pass. The model is reloaded when a new checkpoint appears (see
+    ModelCache). A batch that fails is answered with an error, and clients stop waiting once the server process ends.
+    """
+    def __init__(self, model_dir, num_clients, deadline=0.002, start_method=None):
+        """
+        :param model_dir: The directory teammate checkpoints are saved to
+        :param num_clients: The number of clients (one per env)
+        :param deadline: The longest time (in seconds) a request waits for other requests to join its batch
+        :param start_method: The multiprocessing start method, which must match the one of the SubprocVecEnv
+        """
+        ctx = mp.get_context(start_method)
+        config = load_config()["GYM_ENVIRONMENT"]["TEAMMATE_MODEL"]
+        self.requests = ctx.Queue()
+        self.responses = [ctx.Semaphore(0) for _ in range(num_clients)]
+        # Only the server process holds the sending end, so the receiving end reads EOF once the server has ended for
+        # any reason (see InferenceClient.predict())
+        self.alive, alive_sender = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=serve,
+                                   args=(self.requests, self.responses, model_dir, config["RELOAD_CHECK_SECONDS"],
+                                         config["RELOAD_CHECK_STEPS"], deadline, alive_sender),
+                                   daemon=True)
+        self.process.start()
+        alive_sender.close()
+
+    def client(self, client_id):
+        return InferenceClient(self.requests, self.responses[client_id], self.alive, client_id)
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join()
+
+
+class InferenceClient:
+    """
+    Sends observations to an InferenceServer. A client serves one env and has at most one request pending.
+    """
+    # Time (in seconds) between checks that the server is still running while waiting for a response
+    check_interval = 1.0
+
+    def __init__(self, requests, response, alive, client_id, capacity=2):
+        """
+        :param requests: The request queue of the server
+        :param response: Semaphore the server releases when the actions are written
+        :param alive: Connection that reads EOF once the server process has ended
+        :param client_id: The id of the client
+        :param capacity: The most observations per request (one per teammate)
+        """
+        self.requests = requests
+        self.response = response
+        self.alive = alive
+        self.client_id = client_id
+        self.capacity = capacity
+        # The shared memory block is created by the process that uses the client
+        self.memory = None
+        self.observations = None
+        self.actions = None
+        self.failed = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update({"memory": None, "observations": None, "actions": None, "failed": None})
+        # Clients reach worker processes inside cloudpickled env functions (see SubprocVecEnv). Cloudpickle would copy
+        # the file descriptors of the queue as plain ints, so the queue, semaphore and connection are pickled by
+        # multiprocessing, which passes them on to the process being started
+        state["requests"] = ForkingPickler.dumps((self.requests, self.response, self.alive))
+        del state["response"], state["alive"]
+        return state
+
+    def __setstate__(self, state):
+        state["requests"], state["response"], state["alive"] = ForkingPickler.loads(state["requests"])
+        self.__dict__.update(state)
+
+    def predict(self, observations):
+        """
+        Predicts the actions for a batch of observations
+        :param observations: Array of observations
+        :return: Array of actions
+        """
+        n, obs_size = observations.shape
+        if self.memory is None:
+            self.memory, self.observations, self.actions, self.failed = attach_buffers(None, self.capacity, obs_size)
+        self.observations[:n] = observations
+        self.requests.put((self.client_id, n, self.memory.name, self.capacity, obs_size))
+        while not self.response.acquire(timeout=self.check_interval):
+            if self.alive.poll():
+                raise RuntimeError("The inference server has stopped.")
+        if self.failed[0]:
+            raise RuntimeError("The inference server failed to predict the actions (see its error output).")
+        return self.actions[:n].copy()
+
+
+def attach_buffers(name, capacity, obs_size):
+    """
+    Creates (if name is None) or attaches to the shared memory block of a client, which holds its observations
+    followed by its actions and a flag the server sets when it failed to predict them
+    :param name: The name of the block
+    :param capacity: The most observations per request
+    :param obs_size: The observation size
+    :return: The block, the observation array, the action array and the failure flag array
+    """
+    obs_bytes = capacity * obs_size * np.dtype(np.float32).itemsize
+    action_bytes = capacity * np.dtype(np.int64).itemsize
+    size = obs_bytes + action_bytes + np.dtype(bool).itemsize
+    memory = SharedMemory(create=True, size=size) if name is None else SharedMemory(name=name)
+    observations = np.ndarray((capacity, obs_size), dtype=np.float32, buffer=memory.buf)
+    actions = np.ndarray((capacity,), dtype=np.int64, buffer=memory.buf, offset=obs_bytes)
+    failed = np.ndarray((1,), dtype=bool, buffer=memory.buf, offset=obs_bytes + action_bytes)
+    return memory, observations, actions, failed
+
+
+def serve(requests, responses, model_dir, check_seconds, check_steps, deadline, alive_sender):
+    """
+    Runs the server loop of an InferenceServer until it receives None. If a batch fails (i.e., no checkpoint can be
+    loaded), the error is printed and its clients are answered with their failure flag set. The shared memory blocks
+    of the clients are unlinked when the server stops. 'alive_sender' is never written to: it is only held open while
+    the server runs.
+    :return: N/A
+    """
+    model_cache = ModelCache(model_dir, check_seconds, check_steps)
+    buffers = {}
+    running = True
+    while running:
+        message = requests.get()
+        if message is None:
+            break
+        batch = [message]
+        # Each client has at most one request pending, so the batch is full once every client has sent one
+        end = monotonic() + deadline
+        while len(batch) < len(responses):
+            try:
+                message = requests.get(timeout=max(end - monotonic(), 0))
+            except Empty:
+                break
+            if message is None:
+                running = False
+                break
+            batch.append(message)
+
+        for client_id, n, name, capacity, obs_size in batch:
+            if client_id not in buffers or buffers[client_id][0].name != name:
+                buffers[client_id] = attach_buffers(name, capacity, obs_size)
+        try:
+            actions, _states = model_cache.get().predict(np.concatenate([buffers[c][1][:n] for c, n, *_ in batch]))
+        except Exception:
+            print_exc()
+            actions = None
+        i = 0
+        for client_id, n, *_ in batch:
+            buffers[client_id][3][0] = actions is None
+            if actions is not None:
+                buffers[client_id][2][:n] = actions[i:i + n]
+            i += n
+            responses[client_id].release()
+    for memory, *_arrays in buffers.values():
+        memory.unlink()
@@ -0,0 +1,95 @@
+from os import listdir
+from os import path
+from os import stat
+from stable_baselines3 import PPO
+from time import monotonic
+from zipfile import BadZipFile
+
+# Caches of this process, keyed by model directory (see get_model_cache())
+MODEL_CACHES = {}
+
+
+def get_model_cache(model_dir, check_seconds, check_steps):
+    """
+    Gets the model cache of a model directory. Every env of the process that reads the same directory shares the
+    cache, and so shares one loaded model.
+    :param model_dir: The directory checkpoints are saved to
+    :param check_seconds: The time between checks for a new checkpoint
+    :param check_steps: The number of model requests between checks for a new checkpoint
+    :return: ModelCache
+    """
+    if model_dir not in MODEL_CACHES:
+        MODEL_CACHES[model_dir] = ModelCache(model_dir, check_seconds, check_steps)
+    return MODEL_CACHES[model_dir]
+
+
+class ModelCache:
+    """
+    Keeps the latest checkpoint of a model directory loaded in memory. The directory is checked for a newer checkpoint
+    at most every 'check_seconds' seconds or 'check_steps' requests, whichever comes first. A check only lists the
+    directory if its mtime changed, and only loads a checkpoint if its name, inode, mtime or size changed.
+    """
+    def __init__(self, model_dir, check_seconds, check_steps):
+        self.model_dir = model_dir
+        self.check_seconds = check_seconds
+        self.check_steps = check_steps
+        self.model = None
+        self.model_file = None
+        # Identify the directory listing and the loaded checkpoint file
+        self.dir_mtime = None
+        self.file_signature = None
+        self.last_check = None
+        self.requests = 0
+
+    def get(self):
+        """
+        Gets the loaded model, checking for a newer checkpoint if one is due
+        :return: PPO
+        """
+        self.requests += 1
+        if self.model is None or self.requests >= self.check_steps \
+                or monotonic() - self.last_check >= self.check_seconds:
+            self.check()
+        if self.model is None:
+            raise FileNotFoundError(f"No model checkpoint found in {self.model_dir}.")
+        return self.model
+
+    def check(self):
+        """
+        Loads the latest checkpoint if it differs from the loaded one
+        :return: N/A
+        """
+        self.requests = 0
+        self.last_check = monotonic()
+        dir_mtime = stat(self.model_dir).st_mtime_ns
+        if dir_mtime != self.dir_mtime:
+            self.model_file = self.get_latest_checkpoint()
+            self.dir_mtime = dir_mtime
+        if self.model_file is None:
+            return
+        file_stat = stat(self.model_file)
+        signature = (self.model_file, file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+        if signature != self.file_signature:
+            try:
+                self.model = PPO.load(self.model_file)
+            except (BadZipFile, EOFError, ValueError) as error:
+                # The checkpoint may still be being written. The current model is kept and the file is loaded on a
+                # later check. Without a current model, the error is raised. PPO.load() reports an archive it can not
+                # read as a ValueError raised from the BadZipFile, while other ValueErrors (i.e., a broken model
+                # file in a complete archive) are raised
+                if self.model is None or isinstance(error, ValueError) and not isinstance(error.__cause__, BadZipFile):
+                    raise
+                self.dir_mtime = None
+                return
+            self.file_signature = signature
+
+    def get_latest_checkpoint(self):
+        """
+        Finds the checkpoint with the highest version (i.e., dice_adventure_ppo_modelchkpt-12.zip)
+        :return: The checkpoint path, or None if there are no checkpoints
+        """
+        checkpoints = [file for file in listdir(self.model_dir) if file.endswith(".zip")]
+        if not checkpoints:
+            return None
+        latest = max(checkpoints, key=lambda file: int(file[:-len(".zip")].split("-")[-1]))
+        return path.join(self.model_dir, latest)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from json import dumps
+from json import loads
+from os import makedirs
+from os import path
+from queue import Queue
+from threading import Thread
+from time import time_ns
+
+# Column name and type of every reward record. Timestamps are nanoseconds since the epoch (UTC), players are stored by
+# their index in the log's player list and reward types as a bitmask of reward codes (bit 0 is code "0")
+COLUMNS = [("time_step", "<i8"),
+           ("timestamp", "<i8"),
+           ("player", "u1"),
+           ("game", "<i4"),
+           ("level", "<i2"),
+           ("reward_types", "u1"),
+           ("reward", "<f4")]
+
+
+class RewardLog:
+    """
+    Reward records of an env, kept in preallocated typed columns. When the columns are full, they are handed to a
+    background thread that appends each column to its own binary file, while logging continues in a second set of
+    columns. The log directory can be loaded as a DataFrame with load_rewards().
+    """
+    def __init__(self, directory, players, reward_codes, capacity=10000):
+        """
+        :param directory: The directory of the log
+        :param players: The players, in the order of their indices
+        :param reward_codes: Dict of reward code to reward type
+        :param capacity: The number of records per set of columns
+        """
+        self.directory = directory
+        self.player_index = {p: i for i, p in enumerate(players)}
+        self.capacity = capacity
+        makedirs(self.directory, exist_ok=True)
+        with open(path.join(self.directory, "meta.json"), "w") as file:
+            file.write(dumps({"columns": COLUMNS, "players": list(players), "reward_codes": reward_codes}))
+        # Sets of columns that are free to be filled, and filled ones waiting to be written
+        self.free = Queue()
+        self.pending = Queue()
+        for _ in range(2):
+            self.free.put({name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS})
+        self.columns = self.free.get()
+        self.size = 0
+        self.thread = Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def append(self, time_step, player, game, level, reward_types, reward):
+        """
+        Adds a reward record
+        :param time_step: The env time step
+        :param player: The player
+        :param game: The game number
+        :param level: The level
+        :param reward_types: Bitmask of reward codes
+        :param reward: The reward
+        :return: N/A
+        """
+        i = self.size
+        self.columns["time_step"][i] = time_step
+        self.columns["timestamp"][i] = time_ns()
+        self.columns["player"][i] = self.player_index[player]
+        self.columns["game"][i] = game
+        self.columns["level"][i] = level
+        self.columns["reward_types"][i] = reward_types
+        self.columns["reward"][i] = reward
+        self.size += 1
+        if self.size == self.capacity:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the filled columns to the writer thread. Waits if the thread is still writing the previous set.
+        :return: N/A
+        """
+        if self.size:
+            self.pending.put((self.columns, self.size))
+            self.columns = self.free.get()
+            self.size = 0
+
+    def close(self):
+        """
+        Writes the remaining records and stops the writer thread
+        :return: N/A
+        """
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+
+    def write(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            columns, size = item
+            for name, _dtype in COLUMNS:
+                with open(path.join(self.directory, name + ".bin"), "ab") as file:
+                    columns[name][:size].tofile(file)
+            self.free.put(columns)
+
+
+def load_rewards(directory):
+    """
+    Loads a reward log. Players and reward types are decoded, and timestamps are converted to datetimes.
+    :param directory: The directory of the log
+    :return: DataFrame with one row per reward record, and one boolean column per reward type
+    """
+    with open(path.join(directory, "meta.json")) as file:
+        meta = loads(file.read())
+    df = pd.DataFrame({name: np.fromfile(path.join(directory, name + ".bin"), dtype=dtype)
+                       for name, dtype in meta["columns"]})
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ns")
+    df["player"] = pd.Categorical.from_codes(df["player"], categories=meta["players"])
+    for code, reward_type in meta["reward_codes"].items():
+        df[reward_type] = (df["reward_types"] & (1 << int(code))) > 0
+    return df
@@ -1,23 +1,321 @@
+import asyncio
+from json import dumps
 from json import loads
-from websockets.sync.client import connect
+from os import getpid
+from threading import Thread
+from time import perf_counter
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+from classes.config import load_config
+from classes.state_codec import get_state_codec
 
 
-def execute_action(url, action):
+def execute_action(url, action, return_state=False, delta=False):
+    """
+    Executes an action for the player of the socket
+    :param url: The websocket url of the player
+    :param action: The action
+    :param return_state: If True, the server returns the state after the action in the same round trip
+    :param delta: If True, the state is requested as a delta and applied to the state mirror of the url
+    :return: The state if 'return_state' is True, otherwise the raw response
+    """
+    return request(url, action_command(action), return_state, delta)
+
+
+def execute_actions(actions):
+    """
+    Executes actions on several player sockets concurrently
+    :param actions: Dict of url to action
+    :return: Dict of url to response
+    """
+    return dict(zip(actions, send_all([(url, dumps(action_command(action))) for url, action in actions.items()])))
+
+
+def execute_batch(url, actions, return_state=False, delta=False):
+    """
+    Executes the actions of several players with a single message, in the order given
+    :param url: The websocket url the message is sent on
+    :param actions: Dict of player to action
+    :param return_state: If True, the server returns the state after the actions in the same round trip
+    :param delta: If True, the state is requested as a delta and applied to the state mirror of the url
+    :return: The state if 'return_state' is True, otherwise the raw response
+    """
+    command = {"command": "execute_actions",
+               "actions": [{"player": player, "action": action} for player, action in actions.items()]}
+    return request(url, command, return_state, delta)
+
+
+def get_state(url, delta=False):
+    return request(url, {"command": "get_state"}, True, delta)
+
+
+def get_states(urls):
+    """
+    Gets the state from several player sockets concurrently
+    :param urls: The websocket urls
+    :return: Dict of url to state
+    """
+    return {url: loads(state) for url, state in zip(urls, send_all([(url, '{"command":"get_state"}') for url in urls]))}
+
+
+def action_command(action):
     # Command to send to Game env
-    action_command = {"command": "execute_action",
-                      "action": action}
     # Planning phase: no inputs
     # Pinging phase: no inputs
-    return send(url, str(action_command))
+    return {"command": "execute_action",
+            "action": action}
+
 
+def request(url, command, return_state=False, delta=False):
+    """
+    Sends a command
+    :param url: The websocket url
+    :param command: The command (dict)
+    :param return_state: If True, the server returns the state after the command in the same round trip
+    :param delta: If True, the state is requested as a delta and applied to the state mirror of the url
+    :return: The state if 'return_state' is True, otherwise the raw response
+    """
+    if return_state:
+        if delta:
+            return get_mirror(url).request(command)
+        if command["command"] != "get_state":
+            command["return_state"] = True
+        # Full states are sent in the encoding selected for the url (see set_encoding())
+        if ENCODINGS.get(url) == "binary":
+            command["encoding"] = "binary"
+            return get_state_codec(load_config()).decode(send(url, dumps(command)))
+        return loads(send(url, dumps(command)))
+    return send(url, dumps(command))
 
-def get_state(url):
-    state = send(url, '{"command":"get_state"}')
-    return loads(state)
+
+def set_encoding(url, encoding):
+    """
+    Selects the encoding of the full states sent on a url. Binary states (see StateCodec) are decoded to BinaryState
+    objects, which can be read like state dicts. Delta states are always sent as JSON.
+    :param url: The websocket url
+    :param encoding: "json" or "binary"
+    :return: N/A
+    """
+    ENCODINGS[url] = encoding
 
 
 def send(url, message):
-    with connect(url) as websocket:
-        websocket.send(message)
-        return websocket.recv()
+    return get_client().send(url, message)
+
+
+def send_all(requests):
+    return get_client().send_all(requests)
+
+
+def latency_stats():
+    return get_client().pool.latency_stats()
+
+
+def close():
+    if CLIENT is not None:
+        CLIENT.close()
+
+
+def get_mirror(url):
+    """
+    Gets the state mirror of a url. Mirrors are kept per process, like connections.
+    :param url: The websocket url
+    :return: StateMirror
+    """
+    mirrors = get_client().mirrors
+    if url not in mirrors:
+        mirrors[url] = StateMirror(url)
+    return mirrors[url]
+
+
+def get_client():
+    """
+    Gets the Unity client of this process. The client is created on first use, and again in forked worker processes
+    since the event loop thread of the parent does not exist there.
+    :return: UnityClient
+    """
+    global CLIENT
+    if CLIENT is None or CLIENT.pid != getpid():
+        CLIENT = UnityClient()
+    return CLIENT
+
+
+class UnityClient:
+    """
+    Runs the player sockets on an asyncio event loop in a background thread, so requests to different players (i.e.,
+    /hmt/dwarf, /hmt/giant and /hmt/human) are in flight at the same time. The blocking methods submit coroutines to
+    the loop and wait for their results, which keeps the synchronous env API unchanged.
+    """
+    def __init__(self):
+        self.pid = getpid()
+        self.pool = ConnectionPool()
+        self.mirrors = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the event loop and waits for its result
+        :param coroutine: The coroutine
+        :return: The result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def send(self, url, message):
+        return self.run(self.pool.send(url, message))
+
+    def send_all(self, requests):
+        """
+        Sends messages concurrently and waits for all responses. Requests to the same url are still sent one at a
+        time, in order.
+        :param requests: List of (url, message)
+        :return: List of responses, in the order of the requests
+        """
+        return self.run(self.gather(requests))
+
+    async def gather(self, requests):
+        return await asyncio.gather(*[self.pool.send(url, message) for url, message in requests])
+
+    def close(self):
+        self.run(self.pool.close())
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived websocket connection per url, so every request after the first one skips the TCP and
+    websocket handshakes. Closed connections are replaced transparently. Handshake and request times are recorded per
+    url (see latency_stats()).
+    """
+    def __init__(self):
+        self.connections = {}
+        # A connection serves one request at a time, so responses can not be mixed up
+        self.locks = {}
+        self.stats = {}
+
+    async def get_connection(self, url):
+        """
+        Gets the open connection to a url, connecting if there is none
+        :param url: The websocket url
+        :return: ClientConnection
+        """
+        if url not in self.connections:
+            start = perf_counter()
+            self.connections[url] = await connect(url)
+            self.record(url, "handshake", perf_counter() - start)
+        return self.connections[url]
+
+    async def send(self, url, message):
+        """
+        Sends a message and waits for the response. If the connection was closed before the message could be sent,
+        e.g. because the Unity server was restarted, it is reopened and the message is sent again. If the connection
+        closes after the message was sent, the error is raised since the command may already have been executed. The
+        connection is reopened on the next request.
+        :param url: The websocket url
+        :param message: The message
+        :return: The response
+        """
+        async with self.locks.setdefault(url, asyncio.Lock()):
+            start = perf_counter()
+            websocket = await self.get_connection(url)
+            try:
+                await websocket.send(message)
+            except (ConnectionClosed, OSError):
+                await self.drop(url)
+                start = perf_counter()
+                websocket = await self.get_connection(url)
+                await websocket.send(message)
+            try:
+                response = await websocket.recv()
+            except (ConnectionClosed, OSError):
+                await self.drop(url)
+                raise
+            self.record(url, "request", perf_counter() - start)
+            return response
+
+    async def drop(self, url):
+        """
+        Closes and forgets the connection to a url
+        :param url: The websocket url
+        :return: N/A
+        """
+        websocket = self.connections.pop(url, None)
+        if websocket is not None:
+            await websocket.close()
+
+    async def close(self):
+        """
+        Closes all connections
+        :return: N/A
+        """
+        for url in list(self.connections):
+            await self.drop(url)
+
+    def record(self, url, kind, seconds):
+        stats = self.stats.setdefault(url, {"handshake": [0, 0.0], "request": [0, 0.0]})
+        stats[kind][0] += 1
+        stats[kind][1] += seconds
+
+    def latency_stats(self):
+        """
+        Gets the number and mean latency (in ms) of handshakes and requests per url. Requests that opened a new
+        connection include the handshake. Without pooling, every request would cost a handshake plus a request.
+        :return: Dict
+        """
+        return {url: {f"{kind}s": count for kind, (count, _) in stats.items()} |
+                     {f"mean_{kind}_ms": 1000 * total / count if count else 0.0
+                      for kind, (count, total) in stats.items()}
+                for url, stats in self.stats.items()}
+
+
+class StateMirror:
+    """
+    Client-side copy of the state of a game. Every request asks for the changes since the version the mirror holds
+    (see DiceAdventure.get_state_delta()), so only scene entries that were added, changed or removed are sent and
+    parsed. Entries are replaced rather than changed in place, so states returned earlier are never modified.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.version = None
+        self.entities = {}
+
+    def request(self, command):
+        """
+        Sends a command that returns a state and applies the returned delta
+        :param command: The command (dict)
+        :return: The full state, in the same format as get_state()
+        """
+        command = dict(command, since_version=self.version)
+        if command["command"] != "get_state":
+            command["return_state"] = True
+        return self.apply(loads(send(self.url, dumps(command))))
+
+    def apply(self, delta):
+        """
+        Applies a delta to the mirror
+        :param delta: The delta
+        :return: The full state, in the same format as get_state()
+        """
+        content = delta["content"]
+        # The server could not compute a delta from this mirror's version, so every entry was sent
+        if content["baseVersion"] is None:
+            self.entities = {}
+        for k in content["removed"]:
+            del self.entities[k]
+        self.entities.update(content["changed"])
+        self.version = content["version"]
+        return {
+            "command": delta["command"],
+            "status": delta["status"],
+            "message": "Full State",
+            "content": {
+                "gameData": content["gameData"],
+                "scene": list(self.entities.values())
+            }
+        }
+
 
+# Encoding of full states per url (see set_encoding()). Kept at module level so forked workers inherit it
+ENCODINGS = {}
+# Client of this process (see get_client())
+CLIENT = None
@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from copy import deepcopy
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import SubprocVecEnv
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+
+class TeammateBatchVecEnv(DummyVecEnv):
+    """
+    Steps several DiceAdventurePythonEnvs in one process and predicts the model actions of the automated players of
+    every env in a single forward pass per model, instead of one batch-of-one prediction per player per env.
+    """
+    def step_wait(self):
+        # Agent actions, and the observations of every automated player that needs a model action
+        observations = [env.step_agent(action) for env, action in zip(self.envs, self.actions)]
+        model_actions = self.predict_others(observations)
+        for env_idx in range(self.num_envs):
+            obs, self.buf_rews[env_idx], terminated, truncated, self.buf_infos[env_idx] = \
+                self.envs[env_idx].step_others(model_actions[env_idx])
+            # Same bookkeeping as DummyVecEnv.step_wait()
+            self.buf_dones[env_idx] = terminated or truncated
+            self.buf_infos[env_idx]["TimeLimit.truncated"] = truncated and not terminated
+            if self.buf_dones[env_idx]:
+                self.buf_infos[env_idx]["terminal_observation"] = obs
+                obs, self.reset_infos[env_idx] = self.envs[env_idx].reset()
+            self._save_obs(env_idx, obs)
+        return self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), deepcopy(self.buf_infos)
+
+    def predict_others(self, observations):
+        """
+        Predicts the actions for the observations of every env. Envs that share a model (i.e., read the same model
+        directory) are predicted together.
+        :param observations: List with a dict of player to observation per env
+        :return: List with a dict of player to action per env
+        """
+        model_actions = [{} for _ in self.envs]
+        batches = {}
+        for env_idx, env_observations in enumerate(observations):
+            if env_observations:
+                env = self.envs[env_idx]
+                batch = batches.setdefault(env.model_cache.model_dir, (env, []))[1]
+                batch.extend([(env_idx, p, obs) for p, obs in env_observations.items()])
+        for env, batch in batches.values():
+            env.load_model()
+            actions, _states = env.model.predict(np.stack([obs for _, _, obs in batch]))
+            for (env_idx, p, _), a in zip(batch, actions):
+                model_actions[env_idx][p] = env.action_map[int(a)]
+        return model_actions
+
+
+class MultiAgentVecEnv(DummyVecEnv):
+    """
+    Plays every player of each game as a separate agent, for training one policy shared by all players. A game with
+    three players fills three env slots, so slot i is player i % 3 of game i // 3, and every step executes the joint
+    action of each game and returns one observation and reward per player. No teammate actions are predicted or
+    sampled. The envs are created with automate_players=False.
+    """
+    def __init__(self, env_fns):
+        super().__init__(env_fns)
+        self.players = self.envs[0].players
+        # One slot per player of every game
+        VecEnv.__init__(self, len(self.envs) * len(self.players), self.observation_space, self.action_space)
+        self.buf_obs = OrderedDict([(None, np.zeros((self.num_envs, *self.observation_space.shape),
+                                                    dtype=self.observation_space.dtype))])
+        self.buf_dones = np.zeros((self.num_envs,), dtype=bool)
+        self.buf_rews = np.zeros((self.num_envs,), dtype=np.float32)
+        self.buf_infos = [{} for _ in range(self.num_envs)]
+
+    def step_wait(self):
+        n = len(self.players)
+        for game_idx, env in enumerate(self.envs):
+            observations, rewards, terminated, truncated, info = \
+                env.step_joint(dict(zip(self.players, self.actions[game_idx * n:(game_idx + 1) * n])))
+            done = terminated or truncated
+            if done:
+                # Observations are the env's buffers, which the reset overwrites
+                terminal_observations = {p: obs.copy() for p, obs in observations.items()}
+                env.reset()
+                observations = env.get_observations(env.state)
+            for i, p in enumerate(self.players):
+                slot = game_idx * n + i
+                self.buf_rews[slot] = rewards[p]
+                self.buf_dones[slot] = done
+                self.buf_infos[slot] = {**info, "TimeLimit.truncated": truncated and not terminated}
+                if done:
+                    self.buf_infos[slot]["terminal_observation"] = terminal_observations[p]
+                self.buf_obs[None][slot] = observations[p]
+        return self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), deepcopy(self.buf_infos)
+
+    def reset(self):
+        n = len(self.players)
+        for game_idx, env in enumerate(self.envs):
+            env.reset()
+            for i, obs in enumerate(env.get_observations(env.state).values()):
+                self.buf_obs[None][game_idx * n + i] = obs
+        self.reset_infos = [{} for _ in range(self.num_envs)]
+        return self._obs_from_buf()
+
+    def _get_target_envs(self, indices):
+        # Slots of the same game share its env
+        return [self.envs[i // len(self.players)] for i in self._get_indices(indices)]
+
+
+class SharedMemoryVecEnv(SubprocVecEnv):
+    """
+    Runs each env in its own process, like SubprocVecEnv, but workers write observations, rewards and done flags to
+    buffers in shared memory instead of pickling them through the pipes. Actions are read from shared memory too, so
+    a step only sends a command and receives the info dict when it is not empty (i.e., at the end of a game).
+    """
+    def __init__(self, env_fns, start_method=None):
+        self.waiting = False
+        self.closed = False
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in env_fns])
+        self.processes = []
+        for env_idx, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            process = ctx.Process(target=_shared_memory_worker,
+                                  args=(work_remote, remote, CloudpickleWrapper(env_fn), env_idx),
+                                  daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+
+        # The buffers are created once the observation space is known
+        self.memory, self.buffers = shared_buffers(None, self.num_envs, observation_space)
+        for remote in self.remotes:
+            remote.send(("attach", (self.memory.name, self.num_envs)))
+        for remote in self.remotes:
+            remote.recv()
+
+    def step_async(self, actions):
+        self.buffers["actions"][:] = actions
+        for remote in self.remotes:
+            remote.send(("step", None))
+        self.waiting = True
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        infos = []
+        for env_idx, result in enumerate(results):
+            if result is None:
+                infos.append({"TimeLimit.truncated": False})
+                continue
+            info, self.reset_infos[env_idx] = result
+            if "terminal_observation" in info:
+                info["terminal_observation"] = self.buffers["terminal_observations"][env_idx].copy()
+            infos.append(info)
+        return (self.buffers["observations"].copy(), self.buffers["rewards"].copy(), self.buffers["dones"].copy(),
+                infos)
+
+    def reset(self):
+        for env_idx, remote in enumerate(self.remotes):
+            remote.send(("reset", self._seeds[env_idx]))
+        self.reset_infos = [remote.recv() for remote in self.remotes]
+        # Seeds are only used once
+        self._reset_seeds()
+        return self.buffers["observations"].copy()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        # The block can only be closed once no arrays use it
+        self.buffers = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+def shared_buffers(name, num_envs, observation_space):
+    """
+    Creates (if name is None) or attaches to the shared memory block of a SharedMemoryVecEnv
+    :param name: The name of the block
+    :param num_envs: The number of envs
+    :param observation_space: The observation space of the envs
+    :return: The block, and a dict of buffer name to array
+    """
+    layout = [("observations", (num_envs, *observation_space.shape), observation_space.dtype),
+              ("terminal_observations", (num_envs, *observation_space.shape), observation_space.dtype),
+              ("actions", (num_envs,), np.int64),
+              ("rewards", (num_envs,), np.float32),
+              ("dones", (num_envs,), bool)]
+    size = sum([int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in layout])
+    memory = SharedMemory(create=True, size=size) if name is None else SharedMemory(name=name)
+    buffers = {}
+    offset = 0
+    for buffer_name, shape, dtype in layout:
+        buffers[buffer_name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+        offset += buffers[buffer_name].nbytes
+    return memory, buffers
+
+
+def _shared_memory_worker(remote, parent_remote, env_fn_wrapper, env_idx):
+    """
+    Worker process of a SharedMemoryVecEnv. Answers the same commands as the SubprocVecEnv worker, except that
+    observations, rewards and done flags are written to the shared buffers at the env's index.
+    :return: N/A
+    """
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    memory = None
+    buffers = None
+    while True:
+        try:
+            cmd, data = remote.recv()
+        except EOFError:
+            break
+        if cmd == "step":
+            observation, reward, terminated, truncated, info = env.step(buffers["actions"][env_idx])
+            done = terminated or truncated
+            reset_info = {}
+            if done:
+                buffers["terminal_observations"][env_idx] = observation
+                observation, reset_info = env.reset()
+            buffers["observations"][env_idx] = observation
+            buffers["rewards"][env_idx] = reward
+            buffers["dones"][env_idx] = done
+            if info or done:
+                info["TimeLimit.truncated"] = truncated and not terminated
+                if done:
+                    # Read from the shared buffers by the parent
+                    info["terminal_observation"] = None
+                remote.send((info, reset_info))
+            else:
+                remote.send(None)
+        elif cmd == "reset":
+            observation, reset_info = env.reset(seed=data)
+            buffers["observations"][env_idx] = observation
+            remote.send(reset_info)
+        elif cmd == "attach":
+            # The block is kept referenced for as long as the buffers are used
+            memory, buffers = shared_buffers(data[0], data[1], env.observation_space)
+            remote.send(None)
+        elif cmd == "close":
+            env.close()
+            remote.close()
+            break
+        elif cmd == "get_spaces":
+            remote.send((env.observation_space, env.action_space))
+        elif cmd == "env_method":
+            remote.send(getattr(env, data[0])(*data[1], **data[2]))
+        elif cmd == "get_attr":
+            remote.send(getattr(env, data))
+        elif cmd == "set_attr":
+            remote.send(setattr(env, data[0], data[1]))
+        elif cmd == "is_wrapped":
+            remote.send(is_wrapped(env, data))
+        else:
+            raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
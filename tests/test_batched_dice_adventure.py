@@ -0,0 +1,44 @@
+from json import dumps
+from random import Random
+import numpy as np
+import pytest
+from game.batched_dice_adventure import BatchedDiceAdventure
+from game.dice_adventure import DiceAdventure
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+
+NUM_GAMES = 4
+PLAYERS = ["Dwarf", "Giant", "Human"]
+
+
+def canonical(state):
+    # Scene entries of a cell are not listed in the same order by both engines
+    state = {**state, "content": {**state["content"],
+                                  "scene": sorted(dumps(obj, sort_keys=True) for obj in state["content"]["scene"])}}
+    return dumps(state, sort_keys=True)
+
+
+@pytest.mark.parametrize("level_sampling,round_cap", [(False, 0), (False, 4), (True, 4)])
+def test_matches_scalar_engine(level_sampling, round_cap):
+    settings = dict(level=1, limit_levels=[1, 2, 3, 4, 5], level_sampling=level_sampling, num_repeats=3,
+                    round_cap=round_cap)
+    games = [DiceAdventure(seed=i, **settings) for i in range(NUM_GAMES)]
+    batched = BatchedDiceAdventure(NUM_GAMES, seeds=list(range(NUM_GAMES)), **settings)
+    # Observations of the scalar games are built from their full scenes
+    envs = {p: DiceAdventurePythonEnv(id_=0, player=p, model_number=99, server="unity") for p in PLAYERS}
+    rng = Random(123)
+    # Submits are favoured so that games advance through phases and rounds. A small round cap moves games through
+    # every level
+    biased = ["submit", "submit", "up", "down", "left", "right", "wait"]
+    for step in range(1000):
+        player = rng.choice(PLAYERS)
+        actions = [rng.choice(batched.actions) if rng.random() < .3 else rng.choice(biased) for _ in games]
+        for game, action in zip(games, actions):
+            game.execute_action(player, action)
+        batched.execute_action(player, actions)
+        for i, game in enumerate(games):
+            assert canonical(batched.get_state(i)) == canonical(game.get_state()), f"state of game {i}, step {step}"
+        if step % 20 == 0:
+            for p in PLAYERS:
+                observations = batched.get_observation(p)
+                for i, game in enumerate(games):
+                    np.testing.assert_array_equal(observations[i], envs[p].get_observation(game.get_state(), p))
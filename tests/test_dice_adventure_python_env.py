@@ -0,0 +1,31 @@
+import numpy as np
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+
+
+def make_env(**kwargs):
+    return DiceAdventurePythonEnv(id_=0, player="Dwarf", model_number=99, random_players=True, set_random_seed=True,
+                                  level=1, limit_levels=[1, 2, 3], **kwargs)
+
+
+def test_observations_outlive_reset():
+    # VecEnvs keep the observation of the last step of an episode as its terminal observation and then reset
+    env = make_env()
+    reset_obs, _ = env.reset()
+    obs, *_ = env.step(2)
+    terminal_obs = obs.copy()
+    next_obs, _ = env.reset()
+    assert obs is not next_obs and obs is not reset_obs
+    np.testing.assert_array_equal(obs, terminal_obs)
+
+
+def test_board_observation_matches_scene_observation():
+    env = make_env()
+    scene_env = make_env(server="unity")
+    env.reset()
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        env.step(rng.integers(0, 6))
+        state = env.game.get_state()
+        for p in env.players:
+            np.testing.assert_array_equal(env.get_observation(state, player=p),
+                                          scene_env.get_observation(state, player=p))
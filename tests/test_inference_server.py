@@ -0,0 +1,40 @@
+from os import kill
+from signal import SIGKILL
+import numpy as np
+import pytest
+from stable_baselines3 import PPO
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+from game.env.inference_server import InferenceServer
+
+
+def test_predicts_actions(tmp_path):
+    env = DiceAdventurePythonEnv(id_=0, player="Dwarf", model_number=99, random_players=True)
+    PPO("MlpPolicy", env, device="cpu").save(tmp_path / "dice_adventure_ppo_modelchkpt-1")
+    server = InferenceServer(f"{tmp_path}/", 2)
+    try:
+        observations = np.zeros((2, env.observation_space.shape[0]), dtype=np.float32)
+        for client_id in range(2):
+            actions = server.client(client_id).predict(observations)
+            assert actions.shape == (2,) and all(env.action_space.contains(int(a)) for a in actions)
+    finally:
+        server.close()
+
+
+def test_failed_batch_raises_in_client(tmp_path):
+    server = InferenceServer(f"{tmp_path}/missing/", 1)
+    try:
+        client = server.client(0)
+        # The server keeps serving after a failed batch
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="failed to predict"):
+                client.predict(np.zeros((2, 10), dtype=np.float32))
+    finally:
+        server.close()
+
+
+def test_stopped_server_raises_in_client(tmp_path):
+    server = InferenceServer(f"{tmp_path}/", 1)
+    kill(server.process.pid, SIGKILL)
+    server.process.join()
+    with pytest.raises(RuntimeError, match="has stopped"):
+        server.client(0).predict(np.zeros((2, 10), dtype=np.float32))
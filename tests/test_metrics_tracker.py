@@ -0,0 +1,33 @@
+import numpy as np
+from classes.metrics_tracker import format_timestamp
+from classes.metrics_tracker import TimeSeries
+
+
+def read_rows(filepath):
+    with open(filepath) as file:
+        return [line.rstrip("\n").split("\t") for line in file]
+
+
+def test_full_series_spills_to_its_file(tmp_path):
+    filepath = tmp_path / "series.log"
+    series = TimeSeries(columns=[("phase", "category"), ("value", np.int32)], capacity=3, filepath=str(filepath),
+                        header=["timestamp", "phase", "value"])
+    phases = ["pinning", "planning", "execution"]
+    for i in range(8):
+        series.append(1000 + i, phases[i % 3], i)
+        # The array never grows past its capacity
+        assert len(series.data) == 3 and len(series) == i % 3 + 1
+    assert series.last_timestamp == 1007
+    # Two spills so far, and the remaining records are written by save()
+    assert len(read_rows(filepath)) == 1 + 6
+    series.save()
+    assert len(series) == 0 and series.last_timestamp == 1007
+    assert read_rows(filepath) == [["timestamp", "phase", "value"]] + \
+        [[format_timestamp(1000 + i), phases[i % 3], str(i)] for i in range(8)]
+
+
+def test_series_without_file_drops_records():
+    series = TimeSeries(columns=[("value", np.int32)], capacity=2)
+    for i in range(5):
+        series.append(i, i)
+    assert len(series) == 1 and series.data["value"][0] == 4
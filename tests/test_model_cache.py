@@ -0,0 +1,62 @@
+from os import utime
+from zipfile import BadZipFile
+from zipfile import ZipFile
+import pytest
+from stable_baselines3 import PPO
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+from game.env.model_cache import ModelCache
+
+
+@pytest.fixture(scope="module")
+def checkpoint(tmp_path_factory):
+    env = DiceAdventurePythonEnv(id_=0, player="Dwarf", model_number=99, random_players=True)
+    path = tmp_path_factory.mktemp("model") / "model.zip"
+    PPO("MlpPolicy", env, device="cpu").save(path)
+    return path.read_bytes()
+
+
+def write(path, data):
+    path.write_bytes(data)
+    # Directory and file mtimes can have a coarse resolution, so each write is made to look newer
+    utime(path.parent, ns=(0, path.parent.stat().st_mtime_ns + 10 ** 9))
+
+
+def test_missing_checkpoint(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ModelCache(f"{tmp_path}/", 30, 1000).get()
+
+
+def test_first_load_raises_the_load_error(tmp_path, checkpoint):
+    write(tmp_path / "dice_adventure_ppo_modelchkpt-1.zip", checkpoint[:len(checkpoint) // 2])
+    cache = ModelCache(f"{tmp_path}/", 30, 1000)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get()
+
+
+def test_partial_checkpoint_keeps_the_loaded_model(tmp_path, checkpoint):
+    write(tmp_path / "dice_adventure_ppo_modelchkpt-1.zip", checkpoint)
+    cache = ModelCache(f"{tmp_path}/", 30, 2)
+    model = cache.get()
+    assert cache.get() is model
+    # A newer checkpoint that is still being written
+    newer = tmp_path / "dice_adventure_ppo_modelchkpt-2.zip"
+    write(newer, checkpoint[:len(checkpoint) // 2])
+    assert cache.get() is model and cache.get() is model
+    write(newer, checkpoint)
+    cache.get()
+    assert cache.get() is not model
+    assert cache.model_file == str(newer)
+
+
+def test_other_load_errors_are_raised(tmp_path, checkpoint):
+    write(tmp_path / "dice_adventure_ppo_modelchkpt-1.zip", checkpoint)
+    cache = ModelCache(f"{tmp_path}/", 30, 1)
+    cache.get()
+    # A complete archive that is not a model
+    with ZipFile(tmp_path / "dice_adventure_ppo_modelchkpt-2.zip", "w") as archive:
+        archive.writestr("data", "not json")
+    utime(tmp_path, ns=(0, tmp_path.stat().st_mtime_ns + 10 ** 9))
+    with pytest.raises(ValueError) as error:
+        cache.get()
+    assert not isinstance(error.value.__cause__, BadZipFile)
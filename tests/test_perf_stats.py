@@ -0,0 +1,85 @@
+from random import Random
+from classes.perf_stats import add_stats
+from classes.perf_stats import PerfStats
+from game.dice_adventure import DiceAdventure
+from game.dice_adventure import PERF_STAGES
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+
+ACTIONS = ["left", "right", "up", "down", "wait", "submit", "pinga", "pingb", "pingc", "pingd", "undo"]
+
+
+class Adder:
+    def add(self, a, b):
+        return a + b
+
+    def fail(self):
+        raise ValueError()
+
+
+def test_timed_methods_count_calls_and_time():
+    obj = Adder()
+    perf = PerfStats(["add", "fail"])
+    perf.instrument(obj)
+    assert obj.add(1, b=2) == 3
+    try:
+        obj.fail()
+    except ValueError:
+        pass
+    stats = perf.get()
+    assert stats["add"]["calls"] == 1 and stats["fail"]["calls"] == 1
+    assert stats["add"]["total_ns"] > 0
+    PerfStats.uninstrument(obj, ["add", "fail"])
+    obj.add(1, 2)
+    assert perf.get()["add"]["calls"] == 1
+
+
+def test_add_stats():
+    totals = {}
+    add_stats(totals, {"get_state": {"calls": 2, "total_ns": 10}})
+    add_stats(totals, {"get_state": {"calls": 1, "total_ns": 5}, "next_level": {"calls": 1, "total_ns": 7}})
+    assert totals == {"get_state": {"calls": 3, "total_ns": 15}, "next_level": {"calls": 1, "total_ns": 7}}
+
+
+def test_instrumented_game_plays_the_same_game():
+    games = [DiceAdventure(seed=1, limit_levels=[1, 2, 3], level_sampling=True, round_cap=4, instrument=instrument)
+             for instrument in (False, True)]
+    rng = Random(0)
+    for _ in range(500):
+        # Submits are favoured so that games advance through phases, rounds and levels
+        player, action = rng.choice(["Dwarf", "Giant", "Human"]), rng.choice(ACTIONS + ["submit"] * 5)
+        states = [game.execute_action(player, action) or game.get_state() for game in games]
+        assert states[0] == states[1]
+    assert games[0].perf_stats() == {}
+    stats = games[1].perf_stats()
+    assert list(stats) == list(PERF_STAGES)
+    assert stats["execute_action"]["calls"] == 500 and stats["get_state"]["calls"] == 500
+    assert stats["next_level"]["calls"] > 0
+    # Clones are not instrumented and do not count towards the original game
+    clone = games[1].clone()
+    clone.execute_action("Dwarf", "submit")
+    assert clone.perf_stats() == {} and games[1].perf_stats()["execute_action"]["calls"] == 500
+
+
+class Writer:
+    def __init__(self):
+        self.records = []
+
+    def put(self, tag, value):
+        self.records.append((tag, value))
+
+
+def test_env_exports_stats_per_interval():
+    writer = Writer()
+    env = DiceAdventurePythonEnv(id_=3, player="Dwarf", model_number=99, random_players=True, set_random_seed=True,
+                                 limit_levels=[1, 2, 3], level_sampling=True, round_cap=4, instrument=True,
+                                 tb_writer=writer)
+    env.perf_export_steps = 100
+    env.reset()
+    for step in range(300):
+        env.step(step % 6)
+    assert env.num_games > 1
+    calls = [value for tag, value in writer.records if tag == "perf_3/execute_action_calls"]
+    # Every step executes the actions of the three players
+    assert calls == [300, 300, 300]
+    assert env.perf_stats()["execute_action"]["calls"] == 900
+    assert all(value > 0 for tag, value in writer.records if tag.endswith("_mean_us"))
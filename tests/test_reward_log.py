@@ -0,0 +1,29 @@
+import numpy as np
+from game.env.reward_log import load_rewards
+from game.env.reward_log import RewardLog
+
+PLAYERS = ["Dwarf", "Giant", "Human"]
+REWARD_CODES = {"0": "Personal Goal Reached", "1": "New Level/Tower Reached", "2": "Health Lost/Dead",
+                "3": "Has Not Moved"}
+
+
+def test_records_survive_the_round_trip(tmp_path):
+    log = RewardLog(str(tmp_path), PLAYERS, REWARD_CODES, capacity=4)
+    records = [(t, PLAYERS[t % 3], t // 5, 1 + t % 2, t % 16, round(.1 * t - .5, 1)) for t in range(11)]
+    for record in records:
+        log.append(*record)
+    log.close()
+
+    df = load_rewards(str(tmp_path))
+    # Records spread over two full sets of columns and the partial set written by close()
+    assert len(df) == len(records)
+    assert df["time_step"].tolist() == [r[0] for r in records]
+    assert df["player"].tolist() == [r[1] for r in records]
+    assert list(df["player"].cat.categories) == PLAYERS
+    assert df["game"].tolist() == [r[2] for r in records]
+    assert df["level"].tolist() == [r[3] for r in records]
+    np.testing.assert_array_equal(df["reward"], np.array([r[5] for r in records], dtype=np.float32))
+    for code, reward_type in REWARD_CODES.items():
+        assert df[reward_type].tolist() == [bool(r[4] & (1 << int(code))) for r in records]
+    assert df["timestamp"].is_monotonic_increasing
+
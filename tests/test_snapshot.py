@@ -0,0 +1,26 @@
+from json import dumps
+from random import Random
+from game.dice_adventure import DiceAdventure
+
+PLAYERS = ["Dwarf", "Giant", "Human"]
+ACTIONS = ["left", "right", "up", "down", "wait", "submit", "pinga", "pingb", "pingc", "pingd", "undo"]
+
+
+def test_restore_and_clone_replay_the_same_game():
+    game = DiceAdventure(level=1, level_sampling=True, limit_levels=[1, 2, 3, 4, 5], seed=4, num_repeats=50)
+    rng = Random(1)
+    for _ in range(50):
+        for _ in range(rng.randrange(50)):
+            game.execute_action(rng.choice(PLAYERS), rng.choice(ACTIONS))
+        snapshot = game.snapshot()
+        clone = game.clone()
+        actions = [(rng.choice(PLAYERS), rng.choice(ACTIONS)) for _ in range(rng.randrange(1, 200))]
+        states = []
+        for g in (game, clone):
+            for p, a in actions:
+                g.execute_action(p, a)
+            states.append(dumps(g.get_state(), sort_keys=True))
+        game.restore(snapshot)
+        for p, a in actions:
+            game.execute_action(p, a)
+        assert states[0] == states[1] == dumps(game.get_state(), sort_keys=True)
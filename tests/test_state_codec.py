@@ -0,0 +1,65 @@
+from json import dumps
+from random import Random
+import numpy as np
+import pytest
+from classes.state_codec import get_state_codec
+from game.dice_adventure import DiceAdventure
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+
+PLAYERS = ["Dwarf", "Giant", "Human"]
+ACTIONS = ["left", "right", "up", "down", "wait", "submit", "pinga", "pingb", "pingc", "pingd", "undo"]
+
+
+def as_json(state):
+    return dumps({"command": state["command"], "status": state["status"],
+                  "gameData": state["content"]["gameData"], "scene": list(state["content"]["scene"])}, sort_keys=True)
+
+
+def test_binary_state_matches_full_state():
+    game = DiceAdventure(seed=2, level=1, limit_levels=[1, 2, 3, 4, 5], level_sampling=True, num_repeats=3,
+                         round_cap=4)
+    codec = get_state_codec(game.config)
+    # Observations of binary states are read from the records, those of state dicts from the scene
+    envs = {p: DiceAdventurePythonEnv(id_=0, player=p, model_number=99, server="unity") for p in PLAYERS}
+    rng = Random(1)
+    for step in range(1500):
+        game.execute_action(rng.choice(PLAYERS), rng.choice(ACTIONS))
+        state = game.get_state()
+        data = game.get_state_binary()
+        assert codec.encode(state) == data
+        decoded = codec.decode(data)
+        assert as_json(decoded) == as_json(state), f"step {step}"
+        assert decoded.find("Dwarf") == next(e for e in state["content"]["scene"] if e["type"] == "Dwarf")
+        if step % 10 == 0:
+            for p in PLAYERS:
+                np.testing.assert_array_equal(envs[p].get_observation(codec.decode(data), player=p).copy(),
+                                              envs[p].get_observation(state, player=p))
+
+
+def test_field_limits():
+    codec = get_state_codec(DiceAdventure().config)
+    game_data = {"boardWidth": 32767, "boardHeight": 32767, "level": 32767, "num_repeats": 32767,
+                 "currentPhase": codec.phases[-1]}
+    plan = [codec.moves[-1]] * codec.max_plan
+    records = [codec.record("Dwarf", "1S", 32767, -32768, pin_x=32767, pin_y=None, health=127, dead=True,
+                            action_points=-128, plan_finalized=True, plan=plan),
+               codec.record("S_Monster", "M1", 0, 0, copy=65535),
+               codec.record("goal", "**", 1, 1, subgoal_count=255)]
+    state = codec.decode(codec.encode_records("execute_actions", "Done", game_data, records))
+    assert state["command"] == "execute_actions" and state["status"] == "Done"
+    assert state["content"]["gameData"] == game_data
+    player, monster, tower = state["content"]["scene"]
+    assert (player["x"], player["y"], player["pinCursorX"], player["pinCursorY"]) == (32767, -32768, 32767, None)
+    assert (player["health"], player["dead"], player["actionPoints"]) == (127, True, -128)
+    assert player["actionPlan"] == plan and player["action_plan_finalized"]
+    assert monster["name"] == "M1(65535)"
+    assert tower["subgoalCount"] == 255
+
+    # Values past the limits are rejected rather than wrapped or cut short
+    for record in [dict(health=128), dict(action_points=-129), dict(pin_x=32768)]:
+        with pytest.raises(OverflowError):
+            codec.encode_records("get_state", "OK", game_data, [codec.record("Dwarf", "1S", 0, 0, **record)])
+    with pytest.raises(OverflowError):
+        codec.encode_records("get_state", "OK", game_data, [codec.record("S_Monster", "M1", 0, 0, copy=65536)])
+    with pytest.raises(ValueError):
+        codec.record("S_Monster", "M10", 0, 0)
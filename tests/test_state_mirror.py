@@ -0,0 +1,34 @@
+from copy import deepcopy
+from json import dumps
+from random import Random
+from game.dice_adventure import DiceAdventure
+from game.env.unity_socket import StateMirror
+
+PLAYERS = ["Dwarf", "Giant", "Human"]
+ACTIONS = ["left", "right", "up", "down", "wait", "submit", "pinga", "pingb", "pingc", "pingd", "undo"]
+
+
+def canonical(state):
+    state = {**state, "message": None,
+             "content": {**state["content"],
+                         "scene": sorted(dumps(obj, sort_keys=True) for obj in state["content"]["scene"])}}
+    return dumps(state, sort_keys=True)
+
+
+def test_mirror_follows_full_state():
+    game = DiceAdventure(level=1, level_sampling=True, limit_levels=[1, 2, 3, 4, 5], seed=2, num_repeats=50,
+                         round_cap=4)
+    mirror = StateMirror(url=None)
+    rng = Random(3)
+    previous = None
+    for step in range(1500):
+        game.execute_action(rng.choice(PLAYERS), rng.choice(ACTIONS))
+        if step % 100 == 99:
+            # A version the game no longer keeps, so every entry is sent again
+            mirror.version = -1
+        state = mirror.apply(game.get_state_delta(since_version=mirror.version))
+        assert canonical(state) == canonical(game.get_state()), f"step {step}"
+        # States returned earlier are not modified by later deltas
+        if previous is not None:
+            assert canonical(previous[0]) == previous[1]
+        previous = (state, canonical(deepcopy(state)))
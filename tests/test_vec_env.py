@@ -0,0 +1,75 @@
+import numpy as np
+from stable_baselines3.common.vec_env import DummyVecEnv
+from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+from game.env.vec_env import MultiAgentVecEnv
+from game.env.vec_env import SharedMemoryVecEnv
+
+SETTINGS = dict(model_number=99, set_random_seed=True, level=1, limit_levels=[1, 2, 3], level_sampling=True,
+                round_cap=5)
+
+
+def make_env(env_id, **kwargs):
+    def env_fn():
+        return DiceAdventurePythonEnv(id_=env_id, **{**SETTINGS, **kwargs})
+    return env_fn
+
+
+def test_multi_agent_slots_follow_their_games():
+    num_games = 2
+    vec_env = MultiAgentVecEnv([make_env(str(j), player="Human", automate_players=False) for j in range(num_games)])
+    games = [make_env(str(j), player="Human", automate_players=False)() for j in range(num_games)]
+    players = games[0].players
+    assert vec_env.num_envs == num_games * len(players)
+
+    obs = vec_env.reset()
+    for game in games:
+        game.reset()
+    expected = np.concatenate([list(game.get_observations(game.state).values()) for game in games])
+    np.testing.assert_array_equal(obs, expected)
+
+    rng = np.random.default_rng(0)
+    dones = 0
+    for _ in range(300):
+        actions = np.where(rng.random(vec_env.num_envs) < .5, 5, rng.integers(0, 5, vec_env.num_envs))
+        obs, rewards, done, infos = vec_env.step(actions)
+        for j, game in enumerate(games):
+            slots = range(j * len(players), (j + 1) * len(players))
+            observations, game_rewards, terminated, _, _ = game.step_joint(
+                {p: actions[slot] for p, slot in zip(players, slots)})
+            observations = {p: o.copy() for p, o in observations.items()}
+            if terminated:
+                game.reset()
+                dones += 1
+            for p, slot in zip(players, slots):
+                assert rewards[slot] == np.float32(game_rewards[p]) and done[slot] == terminated
+                if terminated:
+                    np.testing.assert_array_equal(infos[slot]["terminal_observation"], observations[p])
+                    np.testing.assert_array_equal(obs[slot], game.get_observation(game.state, player=p))
+                else:
+                    np.testing.assert_array_equal(obs[slot], observations[p])
+    assert dones
+    vec_env.close()
+
+
+def test_shared_memory_matches_dummy():
+    env_fns = [make_env(str(i), player="Dwarf", random_players=True) for i in range(2)]
+    vec_envs = [SharedMemoryVecEnv(env_fns), DummyVecEnv(env_fns)]
+    try:
+        obs = [vec_env.reset() for vec_env in vec_envs]
+        np.testing.assert_array_equal(*obs)
+        rng = np.random.default_rng(0)
+        dones = 0
+        for _ in range(300):
+            actions = np.where(rng.random(2) < .5, 5, rng.integers(0, 5, 2))
+            (obs, rewards, done, infos), (obs_2, rewards_2, done_2, infos_2) = [vec_env.step(actions)
+                                                                                for vec_env in vec_envs]
+            np.testing.assert_array_equal(obs, obs_2)
+            np.testing.assert_array_equal(rewards, rewards_2)
+            np.testing.assert_array_equal(done, done_2)
+            for i in np.flatnonzero(done):
+                np.testing.assert_array_equal(infos[i]["terminal_observation"], infos_2[i]["terminal_observation"])
+                dones += 1
+        assert dones
+    finally:
+        for vec_env in vec_envs:
+            vec_env.close()
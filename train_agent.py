@@ -1,10 +1,17 @@
 from abc import ABC
+from classes.config import load_config
+from classes.metrics_tracker import MetricsAggregator
 from game.env.dice_adventure_python_env import DiceAdventurePythonEnv
+from game.env.inference_server import InferenceServer
+from game.env.vec_env import MultiAgentVecEnv
+from game.env.vec_env import SharedMemoryVecEnv
+from game.env.vec_env import TeammateBatchVecEnv
 from os import listdir
 from os import makedirs
 from stable_baselines3 import PPO
 from stable_baselines3.common.callbacks import BaseCallback
 from stable_baselines3.common.vec_env import SubprocVecEnv
+from multiprocessing import get_all_start_methods
 from tqdm import tqdm
 from json import loads
 
@@ -30,10 +37,18 @@ def _train_ppo(config):
                                  save_threshold=config["TRAINING_SETTINGS"]["GLOBAL"]["save_threshold"])
 
     kwargs = {**config["ENV_SETTINGS"], **config["GAME_SETTINGS"], "model_number": save_callback.model_number}
+    metrics_aggregator = None
+    if config["GAME_SETTINGS"]["track_metrics"]:
+        # The game metrics of every env are written to TensorBoard by a single process
+        metrics_aggregator = MetricsAggregator(metrics_config=load_config()["GAMEPLAY"]["METRICS"],
+                                               model_number=save_callback.model_number,
+                                               start_method=_get_start_method())
+        kwargs["tb_writer"] = metrics_aggregator.writer()
     # Create list of vectorized environments for agent
     vec_env = _make_envs(num_envs=config["TRAINING_SETTINGS"]["GLOBAL"]["num_envs"],
                          players=config["TRAINING_SETTINGS"]["GLOBAL"]["players"],
-                         env_args=kwargs)
+                         env_args=kwargs,
+                         vec_env_type=config["TRAINING_SETTINGS"]["GLOBAL"].get("vec_env", "subproc"))
 
     # Get tensorboard folder info
     tb_name = config["TRAINING_SETTINGS"]["GLOBAL"]["model_type"] + "_" + str(save_callback.model_number)
@@ -57,10 +72,17 @@ def _train_ppo(config):
                     # Kwargs
                     **config["TRAINING_SETTINGS"]["PPO"])
 
-    model.learn(total_timesteps=config["TRAINING_SETTINGS"]["GLOBAL"]["num_time_steps"],
-                callback=save_callback,
-                progress_bar=False,
-                tb_log_name=tb_name)
+    try:
+        model.learn(total_timesteps=config["TRAINING_SETTINGS"]["GLOBAL"]["num_time_steps"],
+                    callback=save_callback,
+                    progress_bar=False,
+                    tb_log_name=tb_name)
+    finally:
+        # Envs write the records they still hold when closed, and the aggregator then writes the records still on its
+        # queue before it exits
+        vec_env.close()
+        if metrics_aggregator is not None:
+            metrics_aggregator.close()
 
     # model.save(MODEL_DIR.format(save_callback.model_number) + "dice_adventure_ppo_model_final")
     print("DONE TRAINING!")
@@ -74,18 +96,56 @@ def _train_htn(config):
 # ENVIRONMENTS #
 ################
 
-def _make_envs(num_envs: int, players: list, env_args: dict):
+def _make_envs(num_envs: int, players: list, env_args: dict, vec_env_type: str = "subproc"):
+    """
+    Creates the vectorized environments
+    :param num_envs: The number of environments per player
+    :param players: The players to train
+    :param env_args: The environment settings
+    :param vec_env_type: "subproc" runs each env in its own process. "teammate_batch" runs all envs in this process
+    and predicts the actions of all automated teammates in a single forward pass per step. "inference_server" runs
+    each env in its own process and predicts the actions of the automated teammates of all envs in one server process.
+    "multi_agent" runs 'num_envs' games in this process, and the agent plays as every player of each game.
+    "shared_memory" runs each env in its own process and passes observations, rewards and done flags through shared
+    memory instead of pipes
+    :return: VecEnv
+    """
+    if vec_env_type == "multi_agent":
+        return MultiAgentVecEnv([_get_env(env_id=str(j),
+                                          player=players[0],
+                                          env_args={**env_args, "automate_players": False})
+                                 for j in range(num_envs)])
+    server = None
+    if vec_env_type == "inference_server":
+        server = InferenceServer(model_dir="train/{}/model/".format(env_args["model_number"]),
+                                 num_clients=num_envs * len(players),
+                                 start_method=_get_start_method())
     envs = [
         _get_env(env_id=str(i * num_envs + j),
                  player=p,
-                 env_args=env_args) #,
+                 env_args=env_args if server is None else
+                 {**env_args, "inference_client": server.client(i * num_envs + j)}) #,
                  # model_number=save_callback.model_number)
         for i, p in enumerate(players)
         for j in range(num_envs)
     ]
+    if vec_env_type == "teammate_batch":
+        return TeammateBatchVecEnv(envs)
+    elif vec_env_type == "shared_memory":
+        return SharedMemoryVecEnv(envs)
+    elif vec_env_type == "inference_server":
+        vec_env = SubprocVecEnv(envs, start_method=_get_start_method())
+        # Keeps the server alive as long as the envs
+        vec_env.inference_server = server
+        return vec_env
     return SubprocVecEnv(envs)
 
 
+def _get_start_method():
+    # Queues and semaphores can only be shared with processes of the same start method (SubprocVecEnv default)
+    return "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+
+
 def _get_env(env_id, player, env_args):
     # Needs to be function so that it is callable
     def env_fxn():